@@ -34,12 +34,46 @@
 # Imports
 #
 import argparse
-import fileinput
+import array
+import bisect
+import bz2
+import collections
+import concurrent.futures
+import contextlib
+import cProfile
+import csv
+import functools
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import lzma
+import math
+import mmap
 import os
+import pickle
+import random
 import re
+import shlex
+import signal
+import socket
+import stat
+import struct
 import sys
 import time
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 #
 # Unit tests for the dump_path() function.
 # Invoke as: cally.py --unit-test dummy
@@ -60,10 +94,9 @@ import time
 unit_test_full_dump_output = [
     'strict digraph callgraph {',
     '"A" -> "A";', '"A" -> "B";',
-    '"B" -> "C";', '"B" -> "E";',
-    '"E" [style=dashed]', '"B" -> "F";',
-    '"B" -> "G";', '"B" -> "H";',
-    '"C" -> "D";', '"D"', '"F"',
+    '"B" -> "C";', '"C" -> "E";',
+    '"E" -> "F";', '"F" -> "G";',
+    '"G" -> "H";', '"C" -> "D";',
     '"G" -> "B";', '"H" -> "I";',
     '"I" -> "J";', '"J" -> "D";',
     '"main" -> "A";',
@@ -71,53 +104,54 @@ unit_test_full_dump_output = [
 ]
 unit_test_full_caller_output = [
     '"A" -> "A";',
-    '"A" -> "B" -> "H" -> "I" -> "J" -> "D";',
     '"A" -> "B" -> "C" -> "D";',
     '"A" -> "B" -> "E";\n"E" [style=dashed];',
+    '"A" -> "B" -> "F";',
     '"A" -> "B" -> "G" -> "B";',
-    '"A" -> "B" -> "F";'
+    '"A" -> "B" -> "H" -> "I" -> "J" -> "D";'
 ]
 unit_test_noexterns_caller_output = [
     '"A" -> "A";',
-    '"A" -> "B" -> "H" -> "I" -> "J" -> "D";',
     '"A" -> "B" -> "C" -> "D";',
     '"B" [color=red];',
+    '"A" -> "B" -> "F";',
     '"A" -> "B" -> "G" -> "B";',
-    '"A" -> "B" -> "F";'
+    '"A" -> "B" -> "H" -> "I" -> "J" -> "D";'
 ]
 unit_test_maxdepth2_caller_output = [
     '"A" -> "A";',
     '"A" -> "B";\n"B" [color=red];',
-    '"A" -> "B";\n"B" [color=red];',
     '"B" [color=red];',
     '"A" -> "B";\n"B" [color=red];',
+    '"A" -> "B";\n"B" [color=red];',
     '"A" -> "B";\n"B" [color=red];'
 ]
 unit_test_maxdepth3_caller_output = [
     '"A" -> "A";',
-    '"A" -> "B" -> "H";\n"H" [color=red];',
     '"A" -> "B" -> "C";\n"C" [color=red];',
     '"A" -> "B" -> "E";\n"E" [style=dashed];',
+    '"A" -> "B" -> "F";',
     '"A" -> "B" -> "G";\n"G" [color=red];',
-    '"A" -> "B" -> "F";'
+    '"A" -> "B" -> "H";\n"H" [color=red];'
 ]
 unit_test_regex_caller_output = [
-    '"A" -> "A";', '"A" -> "B" -> "H" -> "I" -> "J" -> "D";',
+    '"A" -> "A";',
     '"A" -> "B";\n"B" [color=red];',
     '"B" [color=red];',
+    '"A" -> "B" -> "F";',
     '"A" -> "B";\n"B" [color=red];',
-    '"A" -> "B" -> "F";']
+    '"A" -> "B" -> "H" -> "I" -> "J" -> "D";']
 unit_test_full_callee_output = [
-    '"A" -> "A" -> "B";', '"main" -> "A" -> "B";', '"B" -> "G" -> "B";'
+    '"main" -> "A" -> "B";', '"A" -> "A" -> "B";', '"B" -> "G" -> "B";'
 ]
 unit_test_maxdepth4_callee_output = [
-    '"A" -> "A" -> "B" -> "C" -> "D";',
     '"A" -> "B" -> "C" -> "D";\n"A" [color=red];',
+    '"A" -> "A" -> "B" -> "C" -> "D";',
     '"G" -> "B" -> "C" -> "D";\n"G" [color=red];',
     '"H" -> "I" -> "J" -> "D";\n"H" [color=red];'
 ]
 unit_test_maxdepth5_callee_output = [
-    '"A" -> "A" -> "B" -> "C" -> "D";', '"main" -> "A" -> "B" -> "C" -> "D";',
+    '"main" -> "A" -> "B" -> "C" -> "D";', '"A" -> "A" -> "B" -> "C" -> "D";',
     '"B" -> "G" -> "B" -> "C" -> "D";', '"B" -> "H" -> "I" -> "J" -> "D";'
 ]
 
@@ -142,6 +176,7 @@ def unit_test():
     unit_test_add_call(functions, "I", ["J"])
     unit_test_add_call(functions, "J", ["D"])
 
+    functions = FunctionDB(functions)
     build_callee_info(functions)
 
     #
@@ -160,10 +195,11 @@ def unit_test():
     print_dbg("FULL GRAPH")
     print_dbg("============")
     total += 1
-    buffer = list()
-    full_call_graph(functions, stdio_buffer=buffer)
+    buffer = DotWriter(capture=True)
+    full_call_graph(functions, output=buffer)
     failures += unit_test_check_error("FULL GRAPH",
-                                      unit_test_full_dump_output, buffer)
+                                      unit_test_full_dump_output,
+                                      buffer.lines)
     #
     # Full caller dump
     #
@@ -171,14 +207,15 @@ def unit_test():
     print_dbg("FULL CALLER")
     print_dbg("===========")
     total += 1
-    buffer = list()
+    buffer = DotWriter(capture=True)
     dump_path([], functions, "A",
               max_depth=0,
               exclude=None,
               no_externs=False,
-              stdio_buffer=buffer)
+              output=buffer)
     failures += unit_test_check_error("FULL CALLER",
-                                      unit_test_full_caller_output, buffer)
+                                      unit_test_full_caller_output,
+                                      buffer.lines)
     #
     # Full caller dump with no exters
     #
@@ -186,15 +223,15 @@ def unit_test():
     print_dbg("CALLER NO EXTERNS")
     print_dbg("=================")
     total += 1
-    buffer = list()
+    buffer = DotWriter(capture=True)
     dump_path([], functions, "A",
               max_depth=0,
               exclude=None,
               no_externs=True,
-              stdio_buffer=buffer)
+              output=buffer)
     failures += unit_test_check_error("CALLER, NO_EXTERNS",
                                       unit_test_noexterns_caller_output,
-                                      buffer)
+                                      buffer.lines)
     #
     # Caller with limit depth
     #
@@ -202,29 +239,29 @@ def unit_test():
     print_dbg("CALLER LIMITED DEPTH (2)")
     print_dbg("========================")
     total += 1
-    buffer = list()
+    buffer = DotWriter(capture=True)
     dump_path([], functions, "A",
               max_depth=2,
               exclude=None,
               no_externs=False,
-              stdio_buffer=buffer)
+              output=buffer)
     failures += unit_test_check_error("CALLER, MAX DEPTH 2",
                                       unit_test_maxdepth2_caller_output,
-                                      buffer)
+                                      buffer.lines)
 
     print_dbg("")
     print_dbg("CALLER LIMITED DEPTH (3)")
     print_dbg("========================")
     total += 1
-    buffer = list()
+    buffer = DotWriter(capture=True)
     dump_path([], functions, "A",
               max_depth=3,
               exclude=None,
               no_externs=False,
-              stdio_buffer=buffer)
+              output=buffer)
     failures += unit_test_check_error("CALLER, MAX DEPTH 3",
                                       unit_test_maxdepth3_caller_output,
-                                      buffer)
+                                      buffer.lines)
     #
     # Caller with limited by regex
     #
@@ -232,15 +269,32 @@ def unit_test():
     print_dbg("CALLER REGEX MATCH")
     print_dbg("==================")
     total += 1
-    buffer = list()
+    buffer = DotWriter(capture=True)
     dump_path([], functions, "A",
               max_depth=0,
               exclude="C|E|G",
               no_externs=False,
-              stdio_buffer=buffer)
+              output=buffer)
     failures += unit_test_check_error("CALLER, REGEX",
                                       unit_test_regex_caller_output,
-                                      buffer)
+                                      buffer.lines)
+    #
+    # Caller limited by multiple regexes and a literal name, which should
+    # give the same result as the single regex above.
+    #
+    print_dbg("")
+    print_dbg("CALLER EXCLUDE FILTER")
+    print_dbg("=====================")
+    total += 1
+    regex_buffer = buffer.lines
+    buffer = DotWriter(capture=True)
+    dump_path([], functions, "A",
+              max_depth=0,
+              exclude=ExcludeFilter(["C", "E"], ["G"]),
+              no_externs=False,
+              output=buffer)
+    failures += unit_test_check_error("CALLER, EXCLUDE FILTER",
+                                      regex_buffer, buffer.lines)
     #
     # Full callee
     #
@@ -248,16 +302,16 @@ def unit_test():
     print_dbg("CALLEE FULL")
     print_dbg("===========")
     total += 1
-    buffer = list()
+    buffer = DotWriter(capture=True)
     dump_path([], functions, "B",
               max_depth=0,
               reverse_path=True,
               exclude=None,
               call_index="callee_calls",
-              stdio_buffer=buffer)
+              output=buffer)
     failures += unit_test_check_error("CALLEE, FULL",
                                       unit_test_full_callee_output,
-                                      buffer)
+                                      buffer.lines)
     #
     # Max depth callee
     #
@@ -265,30 +319,703 @@ def unit_test():
     print_dbg("CALLEE MAX DEPTH 4")
     print_dbg("==================")
     total += 1
-    buffer = list()
+    buffer = DotWriter(capture=True)
     dump_path([], functions, "D",
               max_depth=4,
               reverse_path=True,
               exclude=None,
               call_index="callee_calls",
-              stdio_buffer=buffer)
+              output=buffer)
     failures += unit_test_check_error("CALLEE, MAX DEPTH 4",
                                       unit_test_maxdepth4_callee_output,
-                                      buffer)
+                                      buffer.lines)
     print_dbg("")
     print_dbg("CALLEE MAX DEPTH 5")
     print_dbg("==================")
     total += 1
-    buffer = list()
+    buffer = DotWriter(capture=True)
     dump_path([], functions, "D",
               max_depth=5,
               reverse_path=True,
               exclude=None,
               call_index="callee_calls",
-              stdio_buffer=buffer)
+              output=buffer)
     failures += unit_test_check_error("CALLEE, MAX DEPTH 5",
                                       unit_test_maxdepth5_callee_output,
-                                      buffer)
+                                      buffer.lines)
+    #
+    # Deep call chain, well beyond the recursion limit
+    #
+    print_dbg("")
+    print_dbg("CALLER DEEP CHAIN")
+    print_dbg("=================")
+    total += 1
+    depth = sys.getrecursionlimit() * 2
+    chain = dict()
+    for i in range(depth):
+        unit_test_add_call(chain, "F{}".format(i),
+                           ["F{}".format(i + 1)] if i < depth - 1 else [])
+    chain = FunctionDB(chain)
+    build_callee_info(chain)
+    buffer = DotWriter(capture=True)
+    dump_path([], chain, "F0", output=buffer)
+    failures += unit_test_check_error(
+        "CALLER, DEEP CHAIN",
+        [" -> ".join('"F{}"'.format(i) for i in range(depth)) + ";"],
+        buffer.lines)
+    #
+    # Each edge once, same edges as the FULL CALLER and CALLEE MAX DEPTH 4
+    # tests above
+    #
+    print_dbg("")
+    print_dbg("UNIQUE EDGES")
+    print_dbg("============")
+    total += 1
+    buffer = DotWriter(capture=True)
+    dump_unique_edges(functions, "A", output=buffer)
+    failures += unit_test_check_error(
+        "UNIQUE EDGES, CALLER",
+        ['"A" -> "A";', '"A" -> "B";', '"B" -> "C";', '"C" -> "D";',
+         '"B" -> "E";', '"E" [style=dashed];', '"B" -> "F";', '"B" -> "G";',
+         '"G" -> "B";', '"B" -> "H";', '"H" -> "I";', '"I" -> "J";',
+         '"J" -> "D";'],
+        buffer.lines)
+
+    total += 1
+    buffer = DotWriter(capture=True)
+    dump_unique_edges(functions, "D",
+                      max_depth=4,
+                      reverse_path=True,
+                      call_index="callee_calls",
+                      output=buffer)
+    failures += unit_test_check_error(
+        "UNIQUE EDGES, CALLEE, MAX DEPTH 4",
+        ['"A" [color=red];', '"C" -> "D";', '"B" -> "C";', '"A" -> "B";',
+         '"A" -> "A";', '"G" [color=red];', '"G" -> "B";',
+         '"H" [color=red];', '"J" -> "D";', '"I" -> "J";', '"H" -> "I";'],
+        buffer.lines)
+    #
+    # Database updates, compared against a database built from scratch.
+    # G is removed, so it's an external function for B, C calls other
+    # functions, and K is new.
+    #
+    print_dbg("")
+    print_dbg("FUNCTION DB UPDATES")
+    print_dbg("===================")
+    total += 1
+    original = dict()
+    changed = dict()
+    for name in functions:
+        unit_test_add_call(original, name, list(functions[name]["calls"]))
+        if name == "C":
+            unit_test_add_call(changed, name, ["D", "F", "X"])
+        elif name != "G":
+            unit_test_add_call(changed, name, list(functions[name]["calls"]))
+    unit_test_add_call(changed, "K", ["B", "E"])
+
+    updated_functions = FunctionDB(original)
+    build_callee_info(updated_functions)
+    updated_functions.remove_function("G")
+    updated_functions.replace_function("C", changed["C"])
+    updated_functions.add_function("K", changed["K"])
+    results = unit_test_db_edges(updated_functions)
+    results.append(" -> ".join(CallGraphIndex(
+        updated_functions).shortest_path("K", "X")))
+    build_callee_info(updated_functions)
+    results.extend(unit_test_db_edges(updated_functions))
+
+    changed = FunctionDB(changed)
+    build_callee_info(changed)
+    failures += unit_test_check_error(
+        "FUNCTION DB UPDATES",
+        unit_test_db_edges(changed) + ["K -> B -> C -> X"] +
+        unit_test_db_edges(changed),
+        results)
+    #
+    # Membership tests on a function with many edges, which use a cached
+    # set, also after its edges changed.
+    #
+    print_dbg("")
+    print_dbg("FUNCTION DB MEMBERSHIP")
+    print_dbg("======================")
+    total += 1
+    hub = dict()
+    unit_test_add_call(hub, "hub", ["f{}".format(i) for i in range(40)])
+    unit_test_add_call(hub, "f7", [])
+    hub = FunctionDB(hub)
+    build_callee_info(hub)
+    results = ["f7" in hub["hub"]["calls"], "f39" in hub["hub"]["calls"],
+               "f40" in hub["hub"]["calls"], "hub" in hub["hub"]["calls"]]
+    hub.replace_function("hub", dict(
+        files=["unit_test.c"],
+        calls=dict(("g{}".format(i), True) for i in range(40)),
+        refs=dict()))
+    results += ["f7" in hub["hub"]["calls"], "g7" in hub["hub"]["calls"]]
+    failures += unit_test_check_error(
+        "FUNCTION DB MEMBERSHIP",
+        [True, True, False, False, False, True], results)
+    #
+    # Database file, written and read back, before and after updates
+    #
+    print_dbg("")
+    print_dbg("FUNCTION DB FILE")
+    print_dbg("================")
+    total += 1
+    results = list()
+    for db in (functions, updated_functions):
+        db_file = io.BytesIO()
+        write_function_db(db, db_file)
+        results.append(unit_test_db_edges(read_function_db(
+            db_file.getvalue()), True) == unit_test_db_edges(db, True))
+    db_file = io.BytesIO()
+    write_function_db(functions, db_file)
+    results.append(unit_test_db_edges(read_function_db(
+        db_file.getvalue())) == unit_test_db_edges(functions))
+    failures += unit_test_check_error("FUNCTION DB FILE",
+                                      [True, True, True], results)
+    #
+    # Reachability index queries
+    #
+    print_dbg("")
+    print_dbg("CALL GRAPH INDEX")
+    print_dbg("================")
+    total += 1
+    index = CallGraphIndex(functions)
+    results = [
+        str(index.reachable("main", "D")),
+        str(index.reachable("D", "main")),
+        str(index.reachable("A", "E")),
+        str(index.reachable("A", "E", no_externs=True)),
+        " -> ".join(index.shortest_path("main", "D")),
+        " -> ".join(index.shortest_path("main", "D", exclude="C")),
+        str(index.shortest_path("main", "D", exclude="C|J")),
+        str(list(index.within_depth("B", 1).items())),
+        str(list(index.within_depth("D", 2, reverse=True).items())),
+        str(index.common_callers("C", "I")),
+        str(index.common_callers("C", "I", max_depth=1))]
+    failures += unit_test_check_error(
+        "CALL GRAPH INDEX",
+        ["True", "False", "True", "False",
+         "main -> A -> B -> C -> D",
+         "main -> A -> B -> H -> I -> J -> D",
+         "None",
+         "[('B', 0), ('C', 1), ('E', 1), ('F', 1), ('G', 1), ('H', 1)]",
+         "[('D', 0), ('C', 1), ('J', 1), ('B', 2), ('I', 2)]",
+         "[('B', 1, 2), ('A', 2, 3), ('G', 2, 3), ('main', 3, 4)]",
+         "[]"],
+        results)
+    #
+    # Condensed caller and callee graphs, B and G are mutually recursive
+    #
+    print_dbg("")
+    print_dbg("CONDENSED")
+    print_dbg("=========")
+    total += 1
+    buffer = DotWriter(capture=True)
+    dump_condensed(index, ["A"], root_color=True, output=buffer)
+    failures += unit_test_check_error(
+        "CONDENSED, CALLER",
+        ['"A" [color=blue, style=filled];', '"A" [shape=box];',
+         '"A" -> "B, G";', '"B, G" [shape=box];', '"B, G" -> "C";',
+         '"B, G" -> "E";', '"B, G" -> "F";', '"B, G" -> "H";',
+         '"C" -> "D";', '"E" [style=dashed];', '"H" -> "I";',
+         '"I" -> "J";', '"J" -> "D";'],
+        buffer.lines)
+
+    total += 1
+    buffer = DotWriter(capture=True)
+    dump_condensed(index, ["D"], reverse_path=True, max_depth=3,
+                   output=buffer)
+    failures += unit_test_check_error(
+        "CONDENSED, CALLEE, MAX DEPTH 3",
+        ['"C" -> "D";', '"J" -> "D";', '"B, G" -> "C";', '"I" -> "J";',
+         '"B, G" [shape=box];', '"A" -> "B, G";', '"H" -> "I";',
+         '"A" [shape=box];'],
+        buffer.lines)
+
+    total += 1
+    cycle = dict()
+    for i in range(depth):
+        unit_test_add_call(cycle, "F{}".format(i),
+                           ["F{}".format((i + 1) % depth)])
+    cycle = FunctionDB(cycle)
+    build_callee_info(cycle)
+    buffer = DotWriter(capture=True)
+    dump_condensed(CallGraphIndex(cycle), ["F0"], output=buffer)
+    failures += unit_test_check_error(
+        "CONDENSED, DEEP CYCLE",
+        ['"{}" [shape=box];'.format(", ".join(sorted(
+            "F{}".format(i) for i in range(depth))))],
+        buffer.lines)
+    #
+    # functions_pre post processing, compared against the original
+    # implementation for all sample RTL files, and some random sequences.
+    #
+    print_dbg("")
+    print_dbg("FUNCTIONS_PRE FIXUP")
+    print_dbg("===================")
+    total += 1
+    sequences = list()
+    for file in unit_test_rtl_files():
+        sequences.extend(unit_test_rtl_labels(file))
+    print_dbg("Found {} label sequences in the sample RTL files".
+              format(len(sequences)))
+
+    rand = random.Random(0)
+    for i in range(2000):
+        sequences.append([(rand.choice(("jump", "jump1", "code")),
+                           str(rand.randint(1, 12)))
+                          for j in range(rand.randint(0, 40))])
+
+    failed = 0
+    for labels in sequences:
+        if fixup_functions_pre(list(labels)) != \
+                unit_test_fixup_functions_pre(list(labels)):
+            print_err("[FAIL] \"FUNCTIONS_PRE FIXUP\" {}".format(labels))
+            failed = 1
+            break
+    failures += failed
+    #
+    # Queries answered by the --serve mode, compared against the command
+    # line for all sample RTL files.
+    #
+    print_dbg("")
+    print_dbg("SERVE QUERY")
+    print_dbg("===========")
+    total += 1
+    config = argparse.Namespace(RTLFILE=unit_test_rtl_files(), jobs=1,
+                                cache_dir=None, mmap=False, no_warnings=True,
+                                debug=False, poll_interval=1.0,
+                                prefetch=0)
+    server = CallGraphServer(config, Profiler())
+    server.refresh()
+    sample_functions = FunctionDB(parse_rtl_files(config, Profiler()))
+    build_callee_info(sample_functions)
+    buffer = DotWriter(capture=True)
+    write_call_graph(sample_functions,
+                     server.parser.parse_args(["--caller", "main",
+                                               "--max-depth", "4"]),
+                     None, buffer, Profiler())
+    failures += unit_test_check_error(
+        "SERVE QUERY",
+        ["\n".join(buffer.lines) + "\n",
+         "ERROR: Can't find caller \"nosuch\" in RTL data!\n"],
+        [server.query("--caller main --max-depth 4"),
+         server.query("--caller nosuch")])
+
+    #
+    # Update the server for a changed and a removed file, and compare the
+    # database against one merged from scratch.
+    #
+    total += 1
+    files = server.files
+    result = scan_rtl_file(files[-1])
+    server.results[files[1]] = pickle.dumps(result)
+    server.update_functions({files[1]: result})
+    del server.results[files[2]]
+    server.update_functions({files[2]: None})
+
+    functions_merged = dict()
+    for file in files:
+        if file in server.results:
+            merge_functions(functions_merged, dict(),
+                            pickle.loads(server.results[file]),
+                            no_warnings=True)
+    functions_merged = FunctionDB(functions_merged)
+    build_callee_info(functions_merged)
+    failures += unit_test_check_error(
+        "SERVE UPDATE",
+        sorted(unit_test_db_edges(functions_merged, True)),
+        sorted(unit_test_db_edges(server.functions, True)))
+    #
+    # Thread model, where main() joins taskA() before creating taskC(), and
+    # taskA() creates and joins taskD() through a helper. taskR() creates
+    # itself, so the threads it creates are not ordered.
+    #
+    #   main: create taskA, create taskB, join taskA, create taskC,
+    #         join taskB, join taskC, create taskR, join taskR, join ?
+    #
+    print_dbg("")
+    print_dbg("THREAD MODEL")
+    print_dbg("============")
+    total += 1
+    thread_functions = dict()
+    for function_name, calls in (
+            ("main", ["taskA", "taskB", "taskC", "taskR"]),
+            ("taskA", ["helper"]), ("helper", ["taskD"]), ("taskB", []),
+            ("taskC", []), ("taskD", []), ("taskR", ["taskR"])):
+        unit_test_add_call(thread_functions, function_name, calls)
+    thread_functions["main"]["threads"] = [
+        ("create", "c1", "t1", "taskA"), ("create", "c2", "t2", "taskB"),
+        ("join", "j1", "t1", ""), ("create", "c3", "t1", "taskC"),
+        ("join", "j2", "t2", ""), ("join", "j3", "t1", ""),
+        ("create", "c4", "t4", "taskR"), ("join", "j4", "t4", ""),
+        ("join", "j5", "", "")]
+    thread_functions["helper"]["threads"] = [
+        ("create", "c5", "t5", "taskD"), ("join", "j6", "t5", "")]
+    thread_functions["taskR"]["threads"] = [
+        ("create", "c6", "t6", "taskR"), ("join", "j7", "t6", "")]
+    thread_functions = FunctionDB(thread_functions)
+    build_callee_info(thread_functions)
+    model = ThreadModel(thread_functions)
+    failures += unit_test_check_error(
+        "THREAD MODEL",
+        ["main   [] [] [] [1, 2, 3, 4, 5, 6]",
+         "taskD helper c5 [2] [('helper', 'j6')] [] [0, 2, 3, 6]",
+         "taskA main c1 [0] [('main', 'j1')] [] [0, 1, 3, 6]",
+         "taskB main c2 [0] [('main', 'j2')] [] [0, 1, 2, 4, 6]",
+         "taskC main c3 [0] [('main', 'j3')] [1, 2] [0, 3, 6]",
+         "taskR main c4 [0] [('main', 'j4')] [1, 2, 3, 4] [0, 6]",
+         "taskR taskR c6 [5, 6] [('taskR', 'j7')] [] [0, 1, 2, 3, 4, 5]",
+         "[('main', 'j5', '')]"],
+        ["{} {} {} {} {} {} {}".format(
+            thread.task, thread.function or "", thread.site, thread.parents,
+            thread.joins, model.after(thread.id), model.overlaps(thread.id))
+         for thread in model.threads] + [str(model.unmatched)])
+
+    #
+    # Thread handles of the semaphore sample, where main() keeps its
+    # pthread_t handles in local variables, which pthread_create() gets by
+    # address and pthread_join() by value.
+    #
+    print_dbg("")
+    print_dbg("THREAD HANDLES")
+    print_dbg("==============")
+    total += 1
+    file = [file for file in unit_test_rtl_files()
+            if os.path.basename(file) == "sem.c.233r.expand"][0]
+    handle_functions = FunctionDB(scan_rtl_file(file)[1])
+    build_callee_info(handle_functions)
+    model = ThreadModel(handle_functions)
+    failures += unit_test_check_error(
+        "THREAD HANDLES",
+        [[("create", "main/pthread_create4", "thread", "threadA"),
+          ("create", "main/pthread_create5", "thread1", "threadB"),
+          ("create", "main/pthread_create6", "thread2", "threadC"),
+          ("join", "main/pthread_join7", "thread", ""),
+          ("join", "main/pthread_join8", "thread1", ""),
+          ("join", "main/pthread_join9", "thread2", "")],
+         ["threadA main/pthread_create4 [('main', 'main/pthread_join7')]",
+          "threadB main/pthread_create5 [('main', 'main/pthread_join8')]",
+          "threadC main/pthread_create6 [('main', 'main/pthread_join9')]"],
+         []],
+        [handle_functions["main"]["threads"],
+         ["{} {} {}".format(thread.task, thread.site, thread.joins)
+          for thread in model.threads[1:]], model.unmatched])
+
+    #
+    # Task graph of main() creating taskA() and taskB(), and joining both,
+    # with taskA() costing 5 and taskB() 3, and all other nodes 1.
+    #
+    #   main -> c1 -> taskA ---------> j1 -> j2
+    #            |                    ^     ^
+    #            +--> c2 -> taskB ----+-----+
+    #
+    print_dbg("")
+    print_dbg("TASK DAG")
+    print_dbg("========")
+    total += 1
+    task_functions = dict()
+    for function_name, calls in (("main", ["c1", "taskA", "c2", "taskB",
+                                           "j1", "j2"]),
+                                 ("taskA", []), ("taskB", [])):
+        unit_test_add_call(task_functions, function_name, calls)
+    task_functions["main"]["threads"] = [
+        ("create", "c1", "t1", "taskA"), ("create", "c2", "t2", "taskB"),
+        ("join", "j1", "t1", ""), ("join", "j2", "t2", "")]
+    task_functions = FunctionDB(task_functions)
+    build_callee_info(task_functions)
+    dag = TaskDAG(task_functions, "main", {"taskA": 5, "taskB": 3})
+    failures += unit_test_check_error(
+        "TASK DAG",
+        [13, 9, [0, 1, 2, 2, 3, 7, 8], ["main", "c1", "taskA", "j1", "j2"],
+         13, 9],
+        [dag.work(), dag.span(), dag.earliest_start(),
+         [dag.names[node] for node in dag.critical_path()],
+         dag.list_schedule(1), dag.list_schedule(2)])
+
+    #
+    # Task graph of the producer/consumer sample, where main() creates the
+    # three threads, and joins each one, with the static costs of the
+    # functions. The producer, being the most expensive one, is on the
+    # critical path.
+    #
+    print_dbg("")
+    print_dbg("TASK DAG SAMPLE")
+    print_dbg("===============")
+    total += 1
+    file = [file for file in unit_test_rtl_files()
+            if os.path.basename(file) == "produce.c.233r.expand"][0]
+    task_functions = FunctionDB(scan_rtl_file(file)[1])
+    build_callee_info(task_functions)
+    dag = TaskDAG(task_functions, "main", static_costs(task_functions))
+    failures += unit_test_check_error(
+        "TASK DAG SAMPLE",
+        [284, 184, 198,
+         ["main/while/pthread_create5", "producer",
+          "main/while/pthread_join6", "main/pthread_join7",
+          "main/pthread_join8"],
+         [("main/while/pthread_join6",
+           ["main/while/pthread_create5", "producer"]),
+          ("main/pthread_join7", ["main/while/pthread_join6", "consumer"]),
+          ("main/pthread_join8", ["main/pthread_join7", "watcher"])]],
+        [dag.work(), dag.span(), dag.list_schedule(2),
+         [dag.names[node] for node in dag.critical_path()][5:10],
+         [(dag.names[node], [dag.names[predecessor]
+                             for predecessor in dag.predecessors[node]])
+          for node in range(len(dag.names))
+          if "pthread_join" in dag.names[node]]])
+
+    #
+    # Task graph of main() calling spawn(), which creates and joins two
+    # work() threads, where both are defined after their caller. Such calls
+    # are numbered in mycalls, like the ones to external functions.
+    #
+    #   main -> spawn -> c1 -> c2 --------> j3 -> j4
+    #                     |     |           ^     ^
+    #                     |     +--> work --|-----+
+    #                     +--> work --------+
+    #
+    print_dbg("")
+    print_dbg("TASK DAG FORWARD")
+    print_dbg("================")
+    total += 1
+    task_functions = dict()
+    for function_name, calls in (
+            ("main", ["main/spawn1"]),
+            ("spawn", ["spawn/pthread_create1", "work",
+                       "spawn/pthread_create2", "work",
+                       "spawn/pthread_join3", "spawn/pthread_join4"]),
+            ("work", [])):
+        unit_test_add_call(task_functions, function_name, calls)
+    task_functions["main"]["calls"] = {"spawn": True}
+    task_functions["spawn"]["calls"] = {"work": True, "pthread_join": True}
+    task_functions["spawn"]["threads"] = [
+        ("create", "spawn/pthread_create1", "a", "work"),
+        ("create", "spawn/pthread_create2", "b", "work"),
+        ("join", "spawn/pthread_join3", "a", ""),
+        ("join", "spawn/pthread_join4", "b", "")]
+    task_functions = FunctionDB(task_functions)
+    build_callee_info(task_functions)
+    dag = TaskDAG(task_functions, "main", {"work": 5})
+    failures += unit_test_check_error(
+        "TASK DAG FORWARD",
+        [8, 16, 10, [[], [0], [1], [2], [2], [4], [4, 3], [6, 5]]],
+        [len(dag.names), dag.work(), dag.span(), dag.predecessors])
+
+    #
+    # Synchronization calls of the producer/consumer sample, and the
+    # critical sections found, where the consumer unlocks the mutex in a
+    # branch, and again after it. The watcher's condition wait releases the
+    # mutex, and acquires it again.
+    #
+    print_dbg("")
+    print_dbg("SYNC CALLS")
+    print_dbg("==========")
+    total += 1
+    file = [file for file in unit_test_rtl_files()
+            if os.path.basename(file) == "produce.c.233r.expand"][0]
+    sync_functions = scan_rtl_file(file)[1]
+    buffer = DotWriter(capture=True)
+    sections = dump_sync_edges(sync_functions, output=buffer,
+                               exclude=ExcludeFilter(["^producer"]))
+    failures += unit_test_check_error(
+        "SYNC CALLS",
+        [[("sem_wait", "consumer/sem_wait1", "sem_full"),
+          ("pthread_mutex_lock", "consumer/pthread_mutex_lock2", "buf_mutex"),
+          ("pthread_cond_broadcast", "consumer/if/pthread_cond_broadcast4",
+           "cond_done"),
+          ("pthread_mutex_unlock", "consumer/if/pthread_mutex_unlock5",
+           "buf_mutex"),
+          ("sem_post", "consumer/if/sem_post6", "sem_empty"),
+          ("pthread_mutex_unlock", "consumer/pthread_mutex_unlock7",
+           "buf_mutex"),
+          ("sem_post", "consumer/sem_post8", "sem_empty")],
+         [("pthread_mutex_unlock", "watcher/while/pthread_cond_wait2",
+           "buf_mutex"),
+          ("pthread_cond_wait", "watcher/while/pthread_cond_wait2",
+           "cond_done"),
+          ("pthread_mutex_lock", "watcher/while/pthread_cond_wait2",
+           "buf_mutex")],
+         4,
+         ['"consumer/pthread_mutex_lock2" -> "consumer/if/'
+          'pthread_mutex_unlock5" [color=red, style=bold, '
+          'label="buf_mutex"];',
+          '"consumer/pthread_mutex_lock2" -> "consumer/'
+          'pthread_mutex_unlock7" [color=red, style=bold, '
+          'label="buf_mutex"];',
+          '"watcher/while/pthread_mutex_lock1" -> "watcher/while/'
+          'pthread_cond_wait2" [color=red, style=bold, '
+          'label="buf_mutex"];',
+          '"watcher/while/pthread_cond_wait2" -> "watcher/'
+          'pthread_mutex_unlock4" [color=red, style=bold, '
+          'label="buf_mutex"];']],
+        [sync_functions["consumer"]["syncs"],
+         sync_functions["watcher"]["syncs"][1:4], sections,
+         [line for line in buffer.lines if "bold" in line]])
+
+    #
+    # Insn counts per region of the same sample, where the producer loops
+    # over all its calls, read back from a database file, and the static
+    # cost estimated from them.
+    #
+    print_dbg("")
+    print_dbg("INSN COUNTS")
+    print_dbg("===========")
+    total += 1
+    insn_functions = FunctionDB(sync_functions)
+    build_callee_info(insn_functions)
+    db_file = io.BytesIO()
+    write_function_db(insn_functions, db_file)
+    insn_functions = read_function_db(db_file.getvalue())
+    failures += unit_test_check_error(
+        "INSN COUNTS",
+        [{"": [8, 0, 1, 4], "while": [42, 5, 1, 16]},
+         [50, 5, 2, 20], 77],
+        [insn_functions["producer"]["insns"],
+         insn_totals(insn_functions["producer"]),
+         static_costs(insn_functions)["producer"]])
+
+    #
+    # Inclusive static cost of main(), which calls helper(), defined after
+    # it, and the external printf(), costing 1. It's a single node of the
+    # task graph, as nothing creates threads.
+    #
+    #   main (4 + 1 + 2) + helper (10 + 1 + 5) + printf (1)   24
+    #
+    print_dbg("")
+    print_dbg("INCLUSIVE COST")
+    print_dbg("==============")
+    total += 1
+    cost_functions = dict()
+    for function_name, calls, insns in (
+            ("main", ["main/helper1", "main/printf2"], [4, 1, 0, 2]),
+            ("helper", [], [10, 0, 1, 5])):
+        unit_test_add_call(cost_functions, function_name, calls)
+        cost_functions[function_name]["calls"] = dict(
+            (call.split("/")[-1].rstrip("0123456789"), True)
+            for call in calls)
+        cost_functions[function_name]["insns"] = {"": insns}
+    cost_functions = FunctionDB(cost_functions)
+    build_callee_info(cost_functions)
+    dag = TaskDAG(cost_functions, "main", static_costs(cost_functions))
+    failures += unit_test_check_error(
+        "INCLUSIVE COST",
+        [[16, 24], ["main"], [24]],
+        [[dag.inclusive_cost("helper"), dag.inclusive_cost("main")],
+         dag.names, dag.weights])
+
+    #
+    # Hot paths from main(), which calls A() and the external ext() in a
+    # loop, and B() once. A() calls C() in a branch, and B() calls it
+    # twice. The costs of main, A, B and C are 1, 2, 1 and 5.
+    #
+    #   main -> A (10 x 2) -> C (10 x 5)   71
+    #   main -> B (1)      -> C (2 x 5)    12
+    #   main -> ext (10 x 1)               11
+    #
+    print_dbg("")
+    print_dbg("HOT PATHS")
+    print_dbg("=========")
+    total += 1
+    hot_functions = dict()
+    for function_name, calls, insns in (
+            ("main", ["while/A", "B", "main/while/ext3"], 1),
+            ("A", ["if/C"], 2), ("B", ["C", "C"], 1), ("C", [], 5)):
+        unit_test_add_call(hot_functions, function_name, calls)
+        hot_functions[function_name]["calls"] = dict(
+            (call.split("/")[-1].rstrip("0123456789"), True)
+            for call in calls)
+        hot_functions[function_name]["insns"] = {"": [insns, 0, 0, 0]}
+    hot_functions = FunctionDB(hot_functions)
+    build_callee_info(hot_functions)
+    hot_paths = HotPaths(hot_functions, ["main"], 2)
+    buffer = DotWriter(capture=True)
+    dump_hot_paths(hot_paths, output=buffer)
+    failures += unit_test_check_error(
+        "HOT PATHS",
+        [[(71, ["main", "A", "C"]), (12, ["main", "B", "C"])],
+         [("main", 1), ("A", 20), ("B", 1), ("C", 60), ("ext", 10)], 3,
+         ['// 1. 71 main -> A -> C', '// 2. 12 main -> B -> C',
+          '"main" -> "A" [label="x10"];', '"A" -> "C";', '"main" -> "B";',
+          '"B" -> "C" [label="x2"];',
+          '"A" [style=filled, fillcolor="/ylorrd9/6"];',
+          '"B" [style=filled, fillcolor="/ylorrd9/1"];',
+          '"C" [style=filled, fillcolor="/ylorrd9/9"];',
+          '"main" [style=filled, fillcolor="/ylorrd9/1"];']],
+        [hot_paths.chains,
+         [(name, hot_paths.heat[name])
+          for name in ("main", "A", "B", "C", "ext")],
+         hot_paths.paths, buffer.lines])
+
+    #
+    # Hot paths through a recursive cycle, where main() calls A() in a
+    # loop, and C(). A() and B() call each other, and B() calls C(). The
+    # call back from B() to A() is not followed, as A() was found first.
+    #
+    #   main -> A (10 x 2) -> B (10 x 1) -> C (10 x 5)   81
+    #   main -> C (5)                                    6
+    #
+    print_dbg("")
+    print_dbg("HOT PATHS CYCLE")
+    print_dbg("===============")
+    total += 1
+    hot_functions = dict()
+    for function_name, calls, insns in (
+            ("main", ["while/A", "C"], 1), ("A", ["B"], 2),
+            ("B", ["A", "C"], 1), ("C", [], 5)):
+        unit_test_add_call(hot_functions, function_name, calls)
+        hot_functions[function_name]["calls"] = dict(
+            (call.split("/")[-1], True) for call in calls)
+        hot_functions[function_name]["insns"] = {"": [insns, 0, 0, 0]}
+    hot_functions = FunctionDB(hot_functions)
+    build_callee_info(hot_functions)
+    hot_paths = HotPaths(hot_functions, ["main"], 3)
+    failures += unit_test_check_error(
+        "HOT PATHS CYCLE",
+        [[(81, ["main", "A", "B", "C"]), (6, ["main", "C"])],
+         [("main", 1), ("A", 20), ("B", 10), ("C", 55)], 2],
+        [hot_paths.chains,
+         [(name, hot_paths.heat[name]) for name in ("main", "A", "B", "C")],
+         hot_paths.paths])
+
+    #
+    # Lines read from prefetched file contents must match the ones read
+    # from the files, both line by line and with the mmap keyword scan.
+    #
+    print_dbg("")
+    print_dbg("PREFETCH")
+    print_dbg("========")
+    total += 1
+    expected = list()
+    result = list()
+    for file, data in prefetch_rtl_files(unit_test_rtl_files(), 2):
+        for use_mmap in (False, True):
+            expected.append(list(rtl_file_lines(file, use_mmap, window=64)))
+            result.append(list(rtl_file_lines(file, use_mmap, window=64,
+                                              data=data)))
+    failures += unit_test_check_error("PREFETCH", expected, result)
+    #
+    # Lines read from compressed content must match the ones read from the
+    # plain file, for all formats with a module available.
+    #
+    print_dbg("")
+    print_dbg("COMPRESSED INPUT")
+    print_dbg("================")
+    total += 1
+    compressors = [gzip.compress, lzma.compress, bz2.compress]
+    if zstandard is not None:
+        compressors.append(zstandard.ZstdCompressor().compress)
+    file = unit_test_rtl_files()[0]
+    data = read_rtl_file(file)
+    expected = list()
+    result = list()
+    for compress in compressors:
+        for use_mmap in (False, True):
+            expected.append(list(rtl_file_lines(file, use_mmap, window=64)))
+            result.append(list(rtl_file_lines(file, use_mmap, window=64,
+                                              data=compress(data))))
+    failures += unit_test_check_error("COMPRESSED INPUT", expected, result)
     #
     # Show results
     #
@@ -299,6 +1026,7 @@ def unit_test():
     print_dbg("Total errors   : {}".format(failures))
     if failures > 0:
         print_err("!!! ERRORS WHERE FOUND !!!")
+        return 1
 
     return 0
 
@@ -320,6 +1048,90 @@ def unit_test_check_error(test, ref, results):
     return 0
 
 
+#
+# unit_test_fixup_functions_pre(), the original, quadratic, implementation
+# of fixup_functions_pre(), used as reference.
+#
+def unit_test_fixup_functions_pre(labels):
+    jump_flag = 0
+    for key in labels:
+        if key[0] == "jump":
+            index = labels.index(key) + 1
+            for key_test in labels[index:]:
+                if key_test[0] == "code" and key_test[1] < key[1]:
+                    jump_flag = 1
+        if key[0] == "jump1" and jump_flag == 1:
+            for key_test in labels[index:]:
+                if key_test[0] == "jump1" and key_test[1] == key[1]:
+                    newindex = labels.index(key_test)
+                    labels[newindex] = ("jump", key_test[1])
+                    jump_flag = 0
+
+    for key in labels:
+        if key[0] == "code":
+            key_exist = 0
+            for key_test in labels:
+                if key_test[0] == "jump" and key_test[1] == key[1]:
+                    key_exist = 1
+            if key_exist == 0:
+                labels.remove(key)
+        elif key[0] == "jump1":
+            labels.remove(key)
+    return labels
+
+
+#
+# unit_test_rtl_files(), the sample RTL files in this repository
+#
+def unit_test_rtl_files():
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir)
+    files = list()
+    for directory in ("cfile", "cppfile", "test"):
+        for path, dirs, names in os.walk(os.path.join(root, directory)):
+            files.extend(os.path.join(path, name)
+                         for name in sorted(names) if name.endswith(".expand"))
+    return files
+
+
+#
+# unit_test_rtl_labels(), the raw, not yet post processed, jump/code_label
+# sequences for all functions in a RTL file.
+#
+def unit_test_rtl_labels(file):
+    scanner = RtlScanner(dict(), no_warnings=True)
+    sequences = list()
+    with open(file) as rtl_file:
+        for line in rtl_file:
+            if function.match(line) is not None:
+                sequences.append(list())
+                continue
+            token = classify_line(line)
+            if token is not None and len(sequences) > 0:
+                scanner.pre_scan([token], sequences[-1])
+    return sequences
+
+
+#
+# unit_test_db_edges(), the edges of all functions in a database, as text.
+# With merged, the files and mycalls are included too, and the edges are
+# sorted, as the order of functions merged again differs.
+#
+def unit_test_db_edges(functions, merged=False):
+    lines = list()
+    for name, function in functions.items():
+        for edge_type in EDGE_TYPES:
+            edges = list(function[edge_type])
+            if merged:
+                edges.sort()
+            lines.append("{} {}: {}".format(name, edge_type,
+                                            ", ".join(edges)))
+        if merged:
+            lines.append("{} files: {}".format(name, function["files"]))
+            lines.append("{} mycalls: {}".format(name, function["mycalls"]))
+    return lines
+
+
 #
 # unit_test_add_call
 #
@@ -335,193 +1147,2146 @@ def unit_test_add_call(functions, function_name, calls):
     functions[function_name]["refs"] = dict()
     functions[function_name]["callee_calls"] = dict()
     functions[function_name]["callee_refs"] = dict()
+    functions[function_name]["mycalls"] = list(calls)
+    functions[function_name]["myinfo"] = dict()
+    functions[function_name]["threads"] = list()
+    functions[function_name]["syncs"] = list()
+    functions[function_name]["insns"] = dict()
 
 
 #
-# Add callee to database
+# FunctionDB()
 #
+# Compact function database, built from the functions dictionary once all
+# RTL files are parsed. Function names are interned to integer IDs, in
+# definition order, followed by the external functions. The calls, refs,
+# callee_calls and callee_refs edges are stored CSR style, i.e. per edge
+# type there is an offset array indexed by function ID, and one array
+# holding all target IDs. The reverse edges also cover the external
+# functions.
+#
+# Functions can be added, removed or replaced afterwards. The edges of the
+# functions changed are then kept in a per function array, which takes
+# precedence over the CSR arrays, and the reverse edges are updated for
+# the targets of the changed edges only. Removing a function does not free
+# its ID, so it keeps its place in the definition order when added again,
+# and any calls to it now go to an external function.
+#
+# It can be used where the functions dictionary is expected, so
+# functions[name]["calls"] and friends still work, see Function().
+#
+EDGE_TYPES = ("calls", "refs", "callee_calls", "callee_refs")
+REVERSE_EDGE_TYPES = (("calls", "callee_calls"), ("refs", "callee_refs"))
 
 
-def build_callee_info(function_db):
-    for call, value in function_db.items():
-        for callee in value["calls"]:
-            if callee in function_db and \
-                    call not in function_db[callee]["callee_calls"]:
-                function_db[callee]["callee_calls"][call] = 1
-
-        for callee in value["refs"]:
-            if callee in function_db and \
-                    call not in function_db[callee]["callee_refs"]:
-                function_db[callee]["callee_refs"][call] = 1
-
+class FunctionDB(object):
+    def __init__(self, functions):
+        self.names = list()
+        self.ids = dict()
+        self.records = list()
+        self.offsets = dict()
+        self.targets = dict()
+        self.patched = dict((edge_type, dict()) for edge_type in EDGE_TYPES)
+        self.edge_sets = dict()
+        self.record_loader = None
 
-#
-# dump_path_ascii()
-#
-def dump_path_ascii(path, reverse, **kwargs):
-    externs = kwargs.get("externs", False)
-    truncated = kwargs.get("truncated", False)
-    std_buf = kwargs.get("stdio_buffer", None)
+        for function_name in functions:
+            self.intern(function_name)
+        self.count = len(self.names)
 
-    if len(path) == 0:
-        return
+        for function_name, finfo in functions.items():
+            function_id = self.ids[function_name]
+            self.records[function_id] = Function(
+                self, function_id, finfo["files"], finfo.get("mycalls", []),
+                finfo.get("myinfo", {}), finfo.get("threads", []),
+                finfo.get("syncs", []), finfo.get("insns", {}))
 
-    ascii_path = ""
-    for function in reversed(path) if reverse else path:
-        if ascii_path != "":
-            ascii_path += " -> "
-        ascii_path += '"' + function + '"'
+        for edge_type in ("calls", "refs"):
+            offsets = array.array("i", [0])
+            targets = array.array("i")
+            for finfo in functions.values():
+                targets.extend(map(self.intern, finfo[edge_type]))
+                offsets.append(len(targets))
+            self.offsets[edge_type] = offsets
+            self.targets[edge_type] = targets
 
-    if truncated or externs:
-        ascii_path += ';\n"{}"{}{}'. \
-            format(function if not reverse else path[-1],
-                   " [style=dashed]" if externs else "",
-                   " [color=red]" if truncated else "")
+        for edge_type in ("callee_calls", "callee_refs"):
+            self.offsets[edge_type] = array.array("i", [0])
+            self.targets[edge_type] = array.array("i")
 
-    print_buf(std_buf, ascii_path + ";")
+    #
+    # intern(), return the ID for a function name, adding it if needed
+    #
+    def intern(self, name):
+        function_id = self.ids.get(name)
+        if function_id is None:
+            function_id = len(self.names)
+            self.names.append(name)
+            self.records.append(None)
+            self.ids[name] = function_id
+        return function_id
 
+    #
+    # edges(), return the target IDs of the given edge type for a function
+    #
+    def edges(self, edge_type, function_id):
+        edges = self.patched[edge_type].get(function_id)
+        if edges is not None:
+            return edges
+        offsets = self.offsets[edge_type]
+        if function_id + 1 >= len(offsets):
+            return array.array("i")
+        return self.targets[edge_type][offsets[function_id]:
+                                       offsets[function_id + 1]]
 
-#
-# Dump path as ASCII to stdout
-#
-def dump_path(path, functions, function_name, **kwargs):
-    max_depth = kwargs.get("max_depth", 0)
-    reverse_path = kwargs.get("reverse_path", False)
-    exclude = kwargs.get("exclude", None)
-    call_index = kwargs.get("call_index", "calls")
-    no_externs = kwargs.get("no_externs", False)
-    std_buf = kwargs.get("stdio_buffer", None)
+    #
+    # edge_set(), return the target IDs of the given edge type for a
+    # function as a set, for membership tests. The sets are kept until the
+    # edges change.
+    #
+    def edge_set(self, edge_type, function_id):
+        key = (edge_type, function_id)
+        edges = self.edge_sets.get(key)
+        if edges is None:
+            edges = frozenset(self.edges(edge_type, function_id))
+            self.edge_sets[key] = edges
+        return edges
 
     #
-    # Pass on __seen_in_path as a way to determine if a node in the graph
-    # was already processed
+    # build_callee_info(), build the reverse edges, i.e. callee_calls from
+    # calls, and callee_refs from refs. The callers of a function are kept
+    # in function (definition) order.
     #
-    if "__seen_in_path" in kwargs:
-        seen_in_path = kwargs["__seen_in_path"]
-    else:
-        seen_in_path = dict()
-        kwargs["__seen_in_path"] = seen_in_path
+    def build_callee_info(self):
+        self.edge_sets.clear()
+        size = len(self.names)
+        for edge_type, reverse_type in REVERSE_EDGE_TYPES:
+            #
+            # If functions were changed, first collect the current edges
+            # of the defined ones, CSR style, indexed by their position.
+            #
+            sources = range(self.count)
+            offsets = self.offsets[edge_type]
+            targets = self.targets[edge_type]
+            if self.patched[edge_type]:
+                sources = [function_id for function_id in range(size)
+                           if self.records[function_id] is not None]
+                offsets = array.array("i", [0])
+                targets = array.array("i")
+                for function_id in sources:
+                    targets.extend(self.edges(edge_type, function_id))
+                    offsets.append(len(targets))
+
+            reverse_offsets = array.array("i", [0] * (size + 1))
+            for target in targets:
+                reverse_offsets[target + 1] += 1
+            for function_id in range(size):
+                reverse_offsets[function_id + 1] += \
+                    reverse_offsets[function_id]
+
+            reverse_targets = array.array("i", [0] * len(targets))
+            position = array.array("i", reverse_offsets[:size])
+            for index, function_id in enumerate(sources):
+                for target in targets[offsets[index]:offsets[index + 1]]:
+                    reverse_targets[position[target]] = function_id
+                    position[target] += 1
+
+            self.offsets[reverse_type] = reverse_offsets
+            self.targets[reverse_type] = reverse_targets
+            self.patched[reverse_type] = dict()
 
     #
-    # If reached the max depth or need to stop due to exclusion, recursion
-    # display the path up till the previous entry.
+    # add_function(), add a function, with the same information as in the
+    # functions dictionary, and its reverse edges. Raises ValueError if it
+    # is already defined.
     #
-    if (exclude is not None and re.match(exclude, function_name) is not None) \
-            or (max_depth > 0 and len(path) >= max_depth):
-        dump_path_ascii(path, reverse_path, stdio_buffer=std_buf,
-                        truncated=True)
-        return
+    def add_function(self, name, finfo):
+        function_id = self.intern(name)
+        if self.records[function_id] is not None:
+            raise ValueError("Function {} already defined".format(name))
+
+        self.edge_sets.clear()
+        self.records[function_id] = Function(
+            self, function_id, finfo["files"], finfo.get("mycalls", []),
+            finfo.get("myinfo", {}), finfo.get("threads", []),
+            finfo.get("syncs", []), finfo.get("insns", {}))
+        self.count += 1
+
+        for edge_type, reverse_type in REVERSE_EDGE_TYPES:
+            targets = array.array("i", map(self.intern, finfo[edge_type]))
+            self.patched[edge_type][function_id] = targets
+            for target in targets:
+                bisect.insort(self.reverse_edges(reverse_type, target),
+                              function_id)
 
     #
-    # If already seen, we need to terminate the path here...
+    # remove_function(), remove a function, and its reverse edges. Raises
+    # KeyError if it's not defined.
     #
-    if function_name in seen_in_path:
-        if (max_depth <= 0 or (len(path) + 1) <= max_depth):
-            dump_path_ascii(path + [function_name], reverse_path,
-                            stdio_buffer=std_buf)
-        return
+    def remove_function(self, name):
+        function_id = self.ids.get(name)
+        if function_id is None or self.records[function_id] is None:
+            raise KeyError(name)
 
-    seen_in_path[function_name] = True
+        self.edge_sets.clear()
+        for edge_type, reverse_type in REVERSE_EDGE_TYPES:
+            for target in self.edges(edge_type, function_id):
+                callers = self.reverse_edges(reverse_type, target)
+                del callers[bisect.bisect_left(callers, function_id)]
+            self.patched[edge_type][function_id] = array.array("i")
+
+        self.records[function_id] = None
+        self.count -= 1
 
     #
-    # Now walk the path for each child
+    # replace_function(), replace the information of a defined function
     #
-    children = 0
-    for caller in functions[function_name][call_index]:
-        #
-        # The child is a known function, handle this trough recursion
-        #
-        if caller in functions:
-            children += 1
-            if function_name != caller:
-                dump_path(path + [function_name],
-                          functions, caller, **kwargs)
-            else:
-                #
-                # This is a recurrence for this function, add it once
-                #
-                dump_path_ascii(path + [function_name, caller], reverse_path,
-                                stdio_buffer=std_buf)
+    def replace_function(self, name, finfo):
+        self.remove_function(name)
+        self.add_function(name, finfo)
 
-        #
-        # This is a external child, so we can not handle this recursive.
-        # However as there are no more children, we can handle it here
-        # (if it can be included).
-        #
-        elif (exclude is None or re.match(exclude, caller) is None) and \
-                (max_depth <= 0 or (len(path) + 2) <= max_depth) and \
-                not no_externs:
-            children += 1
-            dump_path_ascii(path + [function_name, caller], reverse_path,
-                            externs=True, stdio_buffer=std_buf)
-        else:
-            print_buf(std_buf, '"{}" [color=red];'.
-                      format(function_name))
+    #
+    # reverse_edges(), return the reverse edges of a function, as a per
+    # function array that can be updated.
+    #
+    def reverse_edges(self, reverse_type, function_id):
+        edges = self.patched[reverse_type].get(function_id)
+        if edges is None:
+            edges = array.array("i", self.edges(reverse_type, function_id))
+            self.patched[reverse_type][function_id] = edges
+        return edges
 
     #
-    # If there where no children, the path ends here, so dump it.
+    # Dictionary like access, only the defined functions are included
     #
-    if children == 0:
-        dump_path_ascii(path + [function_name], reverse_path,
-                        stdio_buffer=std_buf)
+    def __contains__(self, name):
+        function_id = self.ids.get(name)
+        return function_id is not None and \
+            self.records[function_id] is not None
 
+    def __getitem__(self, name):
+        function_id = self.ids.get(name)
+        if function_id is None or self.records[function_id] is None:
+            raise KeyError(name)
+        return self.records[function_id]
 
-#
-# print_err()
-#
-def print_err(text):
-    sys.stderr.write(text + "\n")
+    def __iter__(self):
+        return iter(self.keys())
 
+    def __len__(self):
+        return self.count
 
-#
-# print_dbg()
-#
-def print_dbg(text):
-    sys.stderr.write("DBG: " + text + "\n")
+    def keys(self):
+        return [name for name, record in zip(self.names, self.records)
+                if record is not None]
+
+    def values(self):
+        return (record for record in self.records if record is not None)
+
+    def items(self):
+        return ((name, record)
+                for name, record in zip(self.names, self.records)
+                if record is not None)
 
 
 #
-# print_buf()
+# Function()
 #
-def print_buf(buf, text):
-    if buf is not None:
-        buf.append(text)
-    print(text)
+# Record for a single function in the FunctionDB. Indexing it with one of
+# the EDGE_TYPES returns a FunctionEdges() view on the edges, all other
+# keys return the attribute with that name. For a database read from a file
+# the files, mycalls, myinfo, threads, syncs and insns are only set on first
+# use, by the database's record_loader.
+#
+class Function(object):
+    __slots__ = ("db", "id", "files", "mycalls", "myinfo", "threads",
+                 "syncs", "insns")
+
+    def __init__(self, db, function_id, files, mycalls, myinfo, threads,
+                 syncs, insns):
+        self.db = db
+        self.id = function_id
+        self.files = files
+        self.mycalls = mycalls
+        self.myinfo = myinfo
+        self.threads = threads
+        self.syncs = syncs
+        self.insns = insns
+
+    def __getattr__(self, name):
+        if name in Function.__slots__ and self.db.record_loader is not None:
+            self.db.record_loader(self)
+            return object.__getattribute__(self, name)
+        raise AttributeError(name)
+
+    def __getitem__(self, key):
+        if key in EDGE_TYPES:
+            return FunctionEdges(self.db, key, self.id)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
 
 
 #
-# Dump function details:
+# FunctionEdges()
 #
-def dump_function_info(functions, function, details):
-    finfo = functions[function]
-    print("  {}() {}".format(function,
-                             finfo["files"] if details else ""))
-    if details:
-        for caller in sorted(finfo["calls"].keys()):
-            print("    --> {}".format(caller))
+# Read only view on the edges of a single function, iterating it returns
+# the target function names. Membership tests on more than a few edges use
+# the database's cached set of them, rather than scanning the targets.
+#
+class FunctionEdges(object):
+    __slots__ = ("db", "edge_type", "function_id", "names", "ids",
+                 "targets")
 
-        if len(finfo["calls"]) > 0 and len(finfo["callee_calls"]) > 0:
-            print("    ===")
+    def __init__(self, db, edge_type, function_id):
+        self.db = db
+        self.edge_type = edge_type
+        self.function_id = function_id
+        self.names = db.names
+        self.ids = db.ids
+        self.targets = db.edges(edge_type, function_id)
 
-        for caller in sorted(finfo["callee_calls"].keys()):
-            print("    <-- {}".format(caller))
+    def __iter__(self):
+        return map(self.names.__getitem__, self.targets)
 
-        print("\n")
+    def __len__(self):
+        return len(self.targets)
+
+    def __contains__(self, name):
+        function_id = self.ids.get(name)
+        if function_id is None:
+            return False
+        if len(self.targets) <= 16:
+            return function_id in self.targets
+        return function_id in self.db.edge_set(self.edge_type,
+                                                self.function_id)
+
+    def keys(self):
+        return iter(self)
 
 
 #
-# Build full call graph
+# Add callee to database
 #
-def full_call_graph(functions, **kwargs):
-    exclude = kwargs.get("exclude", None)
-    no_externs = kwargs.get("no_externs", False)
-    std_buf = kwargs.get("stdio_buffer", None)
-    print_buf(std_buf, "strict digraph callgraph {")
-    myjoin = re.compile(r"pthread_join")
-    switch_re=re.compile(r"switch+(\d+)")
-    tail = ""
-    has_if=0#判断当前是否出现if，为0则没有
-    count_if=0#计数出现了几次if标志
+
+
+def build_callee_info(function_db):
+    if isinstance(function_db, FunctionDB):
+        function_db.build_callee_info()
+        return
+
+    for call, value in function_db.items():
+        for callee in value["calls"]:
+            if callee in function_db and \
+                    call not in function_db[callee]["callee_calls"]:
+                function_db[callee]["callee_calls"][call] = 1
+
+        for callee in value["refs"]:
+            if callee in function_db and \
+                    call not in function_db[callee]["callee_refs"]:
+                function_db[callee]["callee_refs"][call] = 1
+
+
+#
+# Function database file
+#
+# Binary format written by --save-db, and read back, memory mapped, by
+# --load-db. All integers are little endian. The file starts with the
+# DB_HEADER, i.e. the magic, version, the number of function names, and
+# how many of them are defined, followed by a DB_SECTION, offset and size
+# in bytes, for each entry in DB_SECTIONS. Sections start 8 byte aligned.
+#
+# The strings section holds all strings NUL separated, starting with the
+# function names in ID order, where the defined functions come first. All
+# others are pairs of CSR style 32-bit integer arrays, i.e. offsets indexed
+# by function ID, and values, for the EDGE_TYPES holding function IDs, and
+# for the files, mycalls, myinfo (key and value pairs), threads (four per
+# event) and syncs (three per call) holding string IDs. The insns hold the
+# string ID of each region followed by its four counts.
+#
+DB_MAGIC = b"CALLYDB\0"
+DB_VERSION = 4
+DB_HEADER = struct.Struct("<8sIII")
+DB_SECTION = struct.Struct("<QQ")
+DB_ARRAYS = EDGE_TYPES + ("files", "mycalls", "myinfo", "threads", "syncs",
+                          "insns")
+DB_SECTIONS = ("strings",) + tuple(
+    "{}.{}".format(name, part) for name in DB_ARRAYS
+    for part in ("offsets", "values"))
+
+
+#
+# write_function_db(), write a FunctionDB to a binary file object
+#
+def write_function_db(db, db_file):
+    names = db.keys()
+    count = len(names)
+    names.extend(name for name, record in zip(db.names, db.records)
+                 if record is None)
+    translate = array.array("i", [0] * len(names))
+    for function_id, name in enumerate(names):
+        translate[db.ids[name]] = function_id
+
+    strings = list(names)
+    string_ids = dict((name, string_id)
+                      for string_id, name in enumerate(names))
+
+    def string_id(string):
+        if string not in string_ids:
+            string_ids[string] = len(strings)
+            strings.append(string)
+        return string_ids[string]
+
+    sections = list()
+    for name in DB_ARRAYS:
+        offsets = array.array("i", [0])
+        values = array.array("i")
+        for function_name in names:
+            function_id = db.ids[function_name]
+            if name in EDGE_TYPES:
+                values.extend(translate[target]
+                              for target in db.edges(name, function_id))
+            elif function_name in db:
+                function = db[function_name]
+                if name == "myinfo":
+                    for key, value in function.myinfo.items():
+                        values.append(string_id(key))
+                        values.append(string_id(value))
+                elif name in ("threads", "syncs"):
+                    for event in function[name]:
+                        values.extend(map(string_id, event))
+                elif name == "insns":
+                    for region, counts in function.insns.items():
+                        values.append(string_id(region))
+                        values.extend(counts)
+                else:
+                    values.extend(map(string_id, function[name]))
+            offsets.append(len(values))
+        sections.extend((offsets, values))
+
+    if any("\0" in string for string in strings):
+        raise ValueError("NUL character in function information")
+
+    for section in sections:
+        if sys.byteorder != "little":
+            section.byteswap()
+    sections.insert(0, "\0".join(strings).encode("utf-8"))
+
+    position = DB_HEADER.size + DB_SECTION.size * len(sections)
+    table = list()
+    for section in sections:
+        position = (position + 7) & ~7
+        size = len(section) * section.itemsize if \
+            isinstance(section, array.array) else len(section)
+        table.append(DB_SECTION.pack(position, size))
+        position += size
+
+    db_file.write(DB_HEADER.pack(DB_MAGIC, DB_VERSION, len(names), count))
+    db_file.write(b"".join(table))
+    position = DB_HEADER.size + DB_SECTION.size * len(sections)
+    for section, entry in zip(sections, table):
+        offset = DB_SECTION.unpack(entry)[0]
+        db_file.write(b"\0" * (offset - position))
+        section = section.tobytes() if \
+            isinstance(section, array.array) else section
+        db_file.write(section)
+        position = offset + len(section)
+
+
+#
+# read_function_db(), return the FunctionDB for a binary buffer, i.e.
+# bytes or a memory mapped file. Its integer arrays are used in place. Raises
+# ValueError if it's not a (supported) function database.
+#
+def read_function_db(buffer):
+    view = memoryview(buffer)
+    if len(view) < DB_HEADER.size:
+        raise ValueError("Not a function database")
+    magic, version, size, count = DB_HEADER.unpack_from(view)
+    if magic != DB_MAGIC:
+        raise ValueError("Not a function database")
+    if version != DB_VERSION:
+        raise ValueError("Unsupported function database version {}".
+                         format(version))
+
+    sections = dict()
+    for index, name in enumerate(DB_SECTIONS):
+        offset, length = DB_SECTION.unpack_from(
+            view, DB_HEADER.size + DB_SECTION.size * index)
+        if offset + length > len(view):
+            raise ValueError("Truncated function database")
+        sections[name] = view[offset:offset + length]
+
+    def integers(name):
+        section = sections[name]
+        if sys.byteorder == "little":
+            return section.cast("i")
+        values = array.array("i", section.tobytes())
+        values.byteswap()
+        return values
+
+    strings = bytes(sections["strings"]).decode("utf-8").split("\0")
+    db = FunctionDB(dict())
+    db.names = strings[:size]
+    db.ids = dict((name, function_id)
+                  for function_id, name in enumerate(db.names))
+    db.count = count
+    for edge_type in EDGE_TYPES:
+        db.offsets[edge_type] = integers(edge_type + ".offsets")
+        db.targets[edge_type] = integers(edge_type + ".values")
+
+    info = dict((name, (integers(name + ".offsets"),
+                        integers(name + ".values")))
+                for name in ("files", "mycalls", "myinfo", "threads",
+                             "syncs", "insns"))
+
+    def record_loader(record):
+        fields = dict()
+        for name, (offsets, values) in info.items():
+            fields[name] = values[offsets[record.id]:offsets[record.id + 1]]
+            if name != "insns":
+                fields[name] = list(map(strings.__getitem__, fields[name]))
+        myinfo = iter(fields["myinfo"])
+        threads = iter(fields["threads"])
+        syncs = iter(fields["syncs"])
+        record.files = fields["files"]
+        record.mycalls = fields["mycalls"]
+        record.myinfo = dict(zip(myinfo, myinfo))
+        record.threads = list(zip(threads, threads, threads, threads))
+        record.syncs = list(zip(syncs, syncs, syncs))
+        insns = fields["insns"]
+        record.insns = dict((strings[insns[index]],
+                             list(insns[index + 1:index + 5]))
+                            for index in range(0, len(insns), 5))
+
+    db.record_loader = record_loader
+    db.records = [None] * size
+    for function_id in range(count):
+        record = Function.__new__(Function)
+        record.db = db
+        record.id = function_id
+        db.records[function_id] = record
+    return db
+
+
+#
+# save_function_db() and load_function_db(), the same for a file name
+#
+def save_function_db(db, file):
+    with open(file, "wb") as db_file:
+        write_function_db(db, db_file)
+
+
+def load_function_db(file):
+    with open(file, "rb") as db_file:
+        try:
+            buffer = mmap.mmap(db_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise ValueError("Not a function database")
+    return read_function_db(buffer)
+
+
+#
+# CallGraphIndex()
+#
+# Reachability index on a FunctionDB, for queries that do not need to
+# enumerate all paths like dump_path() does. The edges of the given type
+# are kept CSR style in both directions, for all functions, the external
+# ones included, so every query is a breadth first search touching each
+# function and edge at most once.
+#
+# All queries take function names, and optionally the exclude filter, or
+# no_externs, to skip functions during the search.
+#
+class CallGraphIndex(object):
+    def __init__(self, db, edge_type="calls"):
+        if not db.patched["calls"] and not db.patched[edge_type]:
+            self.names = db.names
+            self.ids = db.ids
+            self.count = db.count
+            size = len(self.names)
+            offsets = array.array("i", db.offsets[edge_type])
+            targets = db.targets[edge_type]
+        else:
+            #
+            # The index has its own IDs, with the defined functions first,
+            # as functions added to the database after it was built come
+            # after the external ones there.
+            #
+            self.names = db.keys()
+            self.count = len(self.names)
+            self.names.extend(name for name, record in
+                              zip(db.names, db.records) if record is None)
+            self.ids = dict((name, function_id)
+                            for function_id, name in enumerate(self.names))
+            size = len(self.names)
+
+            translate = array.array("i", [0] * size)
+            for function_id, name in enumerate(self.names):
+                translate[db.ids[name]] = function_id
+
+            offsets = array.array("i", [0])
+            targets = array.array("i")
+            for name in self.names[:self.count]:
+                targets.extend(translate[target] for target in
+                               db.edges(edge_type, db.ids[name]))
+                offsets.append(len(targets))
+
+        #
+        # External functions have no edges of their own
+        #
+        offsets.extend([offsets[-1]] * (size + 1 - len(offsets)))
+        self.forward = (offsets, targets)
+
+        reverse_offsets = array.array("i", [0] * (size + 1))
+        for target in targets:
+            reverse_offsets[target + 1] += 1
+        for function_id in range(size):
+            reverse_offsets[function_id + 1] += reverse_offsets[function_id]
+
+        reverse_targets = array.array("i", [0] * len(targets))
+        position = array.array("i", reverse_offsets[:size])
+        for function_id in range(self.count):
+            for target in targets[offsets[function_id]:
+                                  offsets[function_id + 1]]:
+                reverse_targets[position[target]] = function_id
+                position[target] += 1
+        self.reverse = (reverse_offsets, reverse_targets)
+
+    #
+    # id(), return the ID for a function name, raises KeyError if unknown
+    #
+    def id(self, name):
+        return self.ids[name]
+
+    #
+    # neighbours(), the IDs called by, or calling if reverse, a function
+    #
+    def neighbours(self, function_id, reverse=False):
+        offsets, targets = self.reverse if reverse else self.forward
+        return targets[offsets[function_id]:offsets[function_id + 1]]
+
+    #
+    # search(), breadth first search from a function. Returns the depth
+    # and parent dictionaries, keyed by function ID, in visiting order. The
+    # search stops at max_depth, if not zero, or once target is found.
+    #
+    def search(self, function_id, **kwargs):
+        reverse = kwargs.get("reverse", False)
+        max_depth = kwargs.get("max_depth", 0)
+        target = kwargs.get("target", None)
+        exclude = exclude_filter(kwargs.get("exclude", None))
+        no_externs = kwargs.get("no_externs", False)
+
+        names = self.names
+        count = self.count
+        offsets, targets = self.reverse if reverse else self.forward
+        depth = {function_id: 0}
+        parent = {function_id: -1}
+        frontier = [function_id]
+        level = 0
+        while frontier and (max_depth <= 0 or level < max_depth) and \
+                target not in depth:
+            level += 1
+            next_frontier = list()
+            for node in frontier:
+                for child in targets[offsets[node]:offsets[node + 1]]:
+                    if child in depth or (no_externs and child >= count) or \
+                            (exclude is not None and
+                             exclude.excluded(names[child])):
+                        continue
+                    depth[child] = level
+                    parent[child] = node
+                    next_frontier.append(child)
+            frontier = next_frontier
+
+        return depth, parent
+
+    #
+    # reachable(), is target called, directly or indirectly, by source
+    #
+    def reachable(self, source, target, **kwargs):
+        target_id = self.id(target)
+        depth, parent = self.search(self.id(source), target=target_id,
+                                    **kwargs)
+        return target_id in depth
+
+    #
+    # shortest_path(), the shortest call chain from source to target, as a
+    # list of function names, or None if there is none.
+    #
+    def shortest_path(self, source, target, **kwargs):
+        target_id = self.id(target)
+        depth, parent = self.search(self.id(source), target=target_id,
+                                    **kwargs)
+        if target_id not in depth:
+            return None
+
+        path = list()
+        function_id = target_id
+        while function_id >= 0:
+            path.append(self.names[function_id])
+            function_id = parent[function_id]
+        path.reverse()
+        return path
+
+    #
+    # within_depth(), all functions called by, or calling if reverse, a
+    # function within max_depth calls, as an ordered dictionary of names
+    # and their depth.
+    #
+    def within_depth(self, function, max_depth=0, **kwargs):
+        depth, parent = self.search(self.id(function), max_depth=max_depth,
+                                    **kwargs)
+        return collections.OrderedDict(
+            (self.names[function_id], level)
+            for function_id, level in depth.items())
+
+    #
+    # components(), the strongly connected components reachable from the
+    # roots, using an iterative version of Tarjan's algorithm. Returns the
+    # list of components, each a list of function IDs, in reverse
+    # topological order, i.e. a component comes before its callers, and a
+    # dictionary with the component index per function ID.
+    #
+    def components(self, roots, **kwargs):
+        reverse = kwargs.get("reverse", False)
+        exclude = exclude_filter(kwargs.get("exclude", None))
+        no_externs = kwargs.get("no_externs", False)
+
+        names = self.names
+        count = self.count
+        offsets, targets = self.reverse if reverse else self.forward
+        order = dict()
+        low = dict()
+        stack = list()
+        on_stack = set()
+        components = list()
+        component_of = dict()
+
+        for root in roots:
+            if root in order:
+                continue
+            order[root] = low[root] = len(order)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(targets[offsets[root]:offsets[root + 1]]))]
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if (no_externs and child >= count) or \
+                            (exclude is not None and
+                             exclude.excluded(names[child])):
+                        continue
+                    if child not in order:
+                        order[child] = low[child] = len(order)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(
+                            targets[offsets[child]:offsets[child + 1]])))
+                        break
+                    if child in on_stack and order[child] < low[node]:
+                        low[node] = order[child]
+                else:
+                    work.pop()
+                    if work and low[node] < low[work[-1][0]]:
+                        low[work[-1][0]] = low[node]
+                    if low[node] == order[node]:
+                        component = list()
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component_of[member] = len(components)
+                            component.append(member)
+                            if member == node:
+                                break
+                        components.append(component)
+
+        return components, component_of
+
+    #
+    # common_callers(), the functions calling both first and second,
+    # directly or indirectly within max_depth calls. Returned as a list of
+    # (name, first depth, second depth) tuples, closest callers first.
+    #
+    def common_callers(self, first, second, max_depth=0, **kwargs):
+        kwargs["reverse"] = True
+        first_id = self.id(first)
+        second_id = self.id(second)
+        first_depth, parent = self.search(first_id, max_depth=max_depth,
+                                          **kwargs)
+        second_depth, parent = self.search(second_id, max_depth=max_depth,
+                                           **kwargs)
+
+        callers = [(self.names[function_id], level,
+                    second_depth[function_id])
+                   for function_id, level in first_depth.items()
+                   if function_id in second_depth and
+                   function_id != first_id and function_id != second_id]
+        callers.sort(key=lambda caller: (max(caller[1], caller[2]),
+                                         caller[1] + caller[2], caller[0]))
+        return callers
+
+
+#
+# dump_path_ascii()
+#
+def dump_path_ascii(path, reverse, **kwargs):
+    externs = kwargs.get("externs", False)
+    truncated = kwargs.get("truncated", False)
+    output = kwargs["output"]
+
+    if len(path) == 0:
+        return
+
+    ascii_path = '"' + '" -> "'.join(reversed(path) if reverse else path) + \
+        '"'
+
+    if truncated or externs:
+        ascii_path += ';\n"{}"{}{}'. \
+            format(path[-1],
+                   " [style=dashed]" if externs else "",
+                   " [color=red]" if truncated else "")
+
+    output.write(ascii_path + ";")
+
+
+#
+# ExcludeFilter()
+#
+# Decides which functions to exclude from the output, i.e. the ones
+# matching (re.match) any of the regular expressions, or the ones in the
+# set of literal names. The verdict per function name is kept in a
+# bounded LRU cache, so the regular expressions are only evaluated once
+# for each distinct name.
+#
+class ExcludeFilter(object):
+    def __init__(self, patterns=None, names=None, cache_size=1 << 16):
+        self.regexes = [re.compile(pattern) for pattern in patterns or []]
+        self.names = frozenset(names or [])
+        self.excluded = functools.lru_cache(maxsize=cache_size)(
+            self._excluded)
+
+    def _excluded(self, name):
+        if name in self.names:
+            return True
+        for regex in self.regexes:
+            if regex.match(name) is not None:
+                return True
+        return False
+
+
+#
+# exclude_filter(), returns an ExcludeFilter for the exclude option passed
+# to the output functions, which can also be a single regular expression.
+#
+def exclude_filter(exclude):
+    if exclude is None or isinstance(exclude, ExcludeFilter):
+        return exclude
+    return ExcludeFilter([exclude])
+
+
+#
+# walk_path() events, see below
+#
+PATH_END = 0
+PATH_EXTERN = 1
+PATH_TRUNCATED = 2
+PATH_CUTOFF = 3
+
+
+#
+# walk_path()
+#
+# Iterative depth first walk of the call graph starting at function_name,
+# following the call_index edges. It yields (event, path) tuples, where
+# path is a single list shared by the whole walk, i.e. it's only valid
+# until the next event is requested. The events are:
+#
+#   PATH_END        The path ends here, i.e. no (more) children, or a
+#                   recursion back into an already seen function.
+#   PATH_EXTERN     The last function in the path is an external one.
+#   PATH_TRUNCATED  The path was cut short due to max_depth or exclude.
+#   PATH_CUTOFF     The external child of the last function in the path was
+#                   not shown, due to max_depth, exclude or no_externs.
+#
+def walk_path(path, functions, function_name, **kwargs):
+    max_depth = kwargs.get("max_depth", 0)
+    exclude = exclude_filter(kwargs.get("exclude", None))
+    call_index = kwargs.get("call_index", "calls")
+    no_externs = kwargs.get("no_externs", False)
+
+    path = list(path)
+    seen_in_path = set()
+    stack = list()
+    function = function_name
+
+    while True:
+        #
+        # Visit function, with path holding the functions leading up to it.
+        # If reached the max depth or need to stop due to exclusion,
+        # display the path up till the previous entry. If already seen, we
+        # need to terminate the path here...
+        #
+        if function is not None:
+            if (exclude is not None and exclude.excluded(function)) or \
+                    (max_depth > 0 and len(path) >= max_depth):
+                yield PATH_TRUNCATED, path
+            elif function in seen_in_path:
+                if max_depth <= 0 or (len(path) + 1) <= max_depth:
+                    path.append(function)
+                    yield PATH_END, path
+                    path.pop()
+            else:
+                seen_in_path.add(function)
+                path.append(function)
+                stack.append([function,
+                              iter(functions[function][call_index]), 0])
+            function = None
+
+        if len(stack) == 0:
+            return
+
+        #
+        # Now walk the path for the next child
+        #
+        frame = stack[-1]
+        caller = next(frame[1], None)
+        if caller is None:
+            #
+            # If there where no children, the path ends here
+            #
+            if frame[2] == 0:
+                yield PATH_END, path
+            stack.pop()
+            path.pop()
+
+        elif caller in functions:
+            #
+            # The child is a known function, visit it next, unless it's a
+            # recurrence for this function, which is added once.
+            #
+            frame[2] += 1
+            if frame[0] != caller:
+                function = caller
+            else:
+                path.append(caller)
+                yield PATH_END, path
+                path.pop()
+
+        #
+        # This is a external child, so we can not walk it. However as there
+        # are no more children, we can handle it here (if it can be
+        # included).
+        #
+        elif (exclude is None or not exclude.excluded(caller)) and \
+                (max_depth <= 0 or (len(path) + 1) <= max_depth) and \
+                not no_externs:
+            frame[2] += 1
+            path.append(caller)
+            yield PATH_EXTERN, path
+            path.pop()
+        else:
+            yield PATH_CUTOFF, path
+
+
+#
+# Dump path as ASCII to stdout, returns the number of paths enumerated
+#
+def dump_path(path, functions, function_name, **kwargs):
+    reverse_path = kwargs.get("reverse_path", False)
+    output = kwargs.get("output", None)
+    close_output = output is None
+    if close_output:
+        output = DotWriter()
+
+    paths = 0
+    for event, path in walk_path(path, functions, function_name, **kwargs):
+        paths += 1
+        if event == PATH_CUTOFF:
+            output.write('"{}" [color=red];'.format(path[-1]))
+        else:
+            dump_path_ascii(path, reverse_path, output=output,
+                            externs=event == PATH_EXTERN,
+                            truncated=event == PATH_TRUNCATED)
+
+    if close_output:
+        output.close()
+
+    return paths
+
+
+#
+# dump_unique_edges()
+#
+# Same call graph as dump_path(), but each edge and node attribute is
+# written once, rather than writing the full path leading up to every
+# leaf. As walk_path() expands each function once, the edges of the path
+# on its stack are unique, so only the tail of each path not yet written
+# needs to be checked. Returns the number of edges written.
+#
+def dump_unique_edges(functions, function_name, **kwargs):
+    reverse_path = kwargs.get("reverse_path", False)
+    output = kwargs["output"]
+
+    edges = set()
+    marked = set()
+    for event, path in walk_path([], functions, function_name, **kwargs):
+        if event == PATH_TRUNCATED or event == PATH_CUTOFF:
+            if len(path) > 0 and path[-1] not in marked:
+                marked.add(path[-1])
+                output.write('"{}" [color=red];'.format(path[-1]))
+            if event == PATH_CUTOFF:
+                continue
+
+        if len(path) == 1:
+            output.write('"{}";'.format(path[0]))
+            continue
+
+        start = len(path) - 1
+        while start > 0 and (path[start - 1], path[start]) not in edges:
+            start -= 1
+        for caller, callee in zip(path[start:], path[start + 1:]):
+            edges.add((caller, callee))
+            if reverse_path:
+                output.write('"{}" -> "{}";'.format(callee, caller))
+            else:
+                output.write('"{}" -> "{}";'.format(caller, callee))
+
+        if event == PATH_EXTERN and path[-1] not in marked:
+            marked.add(path[-1])
+            output.write('"{}" [style=dashed];'.format(path[-1]))
+
+    return len(edges)
+
+
+#
+# dump_reach()
+#
+# Dump the part of the call graph reachable from a function, within
+# max_depth calls if not zero. Unlike dump_path() each edge is only written
+# once. Returns the number of functions reached.
+#
+def dump_reach(index, function_name, **kwargs):
+    max_depth = kwargs.get("max_depth", 0)
+    output = kwargs["output"]
+
+    depth, parent = index.search(index.id(function_name), **kwargs)
+    names = index.names
+    for function_id, level in depth.items():
+        if function_id >= index.count:
+            output.write('"{}" [style=dashed];'.format(names[function_id]))
+        if max_depth > 0 and level >= max_depth:
+            continue
+        for child in index.neighbours(function_id):
+            if child in depth:
+                output.write('"{}" -> "{}";'.format(names[function_id],
+                                                    names[child]))
+
+    return len(depth)
+
+
+#
+# dump_condensed()
+#
+# Dump the call graph reachable from the root functions, with each
+# strongly connected component, i.e. set of mutually recursive functions,
+# collapsed into a single node. As the result is a DAG, where each edge is
+# written once, this is linear in the size of the graph. With reverse_path
+# the callers are followed, but the edges still point to the callee.
+# Returns the number of components written.
+#
+def dump_condensed(index, roots, **kwargs):
+    reverse = kwargs.get("reverse_path", False)
+    max_depth = kwargs.get("max_depth", 0)
+    root_color = kwargs.get("root_color", False)
+    output = kwargs["output"]
+
+    root_ids = [index.id(root) for root in roots]
+    components, component_of = index.components(
+        root_ids, reverse=reverse, exclude=kwargs.get("exclude", None),
+        no_externs=kwargs.get("no_externs", False))
+
+    names = index.names
+    labels = [", ".join(sorted(names[member] for member in component))
+              for component in components]
+
+    #
+    # Walk the DAG of components breadth first, so max_depth can be
+    # honored, and each component is written once.
+    #
+    depth = dict()
+    frontier = list()
+    for root in root_ids:
+        if component_of[root] not in depth:
+            depth[component_of[root]] = 0
+            frontier.append(component_of[root])
+
+    level = 0
+    while frontier:
+        next_frontier = list()
+        for component in frontier:
+            members = components[component]
+            label = labels[component]
+            recursive = len(members) > 1 or \
+                members[0] in index.neighbours(members[0], reverse)
+            if root_color and level == 0:
+                output.write('"{}" [color=blue, style=filled];'.format(label))
+            if recursive:
+                output.write('"{}" [shape=box];'.format(label))
+            if members[0] >= index.count:
+                output.write('"{}" [style=dashed];'.format(label))
+
+            if max_depth > 0 and level >= max_depth:
+                continue
+
+            children = list()
+            for member in members:
+                for child in index.neighbours(member, reverse):
+                    child = component_of.get(child, component)
+                    if child != component and child not in children:
+                        children.append(child)
+
+            for child in children:
+                if reverse:
+                    output.write('"{}" -> "{}";'.format(labels[child], label))
+                else:
+                    output.write('"{}" -> "{}";'.format(label, labels[child]))
+                if child not in depth:
+                    depth[child] = level + 1
+                    next_frontier.append(child)
+        frontier = next_frontier
+        level += 1
+
+    return len(depth)
+
+
+#
+# HotPaths()
+#
+# Loop weighted call chains from the root functions. Each call made in a
+# while region is expected to run trip_count times, so the number of times
+# a function runs is the product of the expected calls on the chain leading
+# to it, and its cost in that chain is this times its own cost, i.e. its
+# static cost, see static_costs(), or 1 if not known. The cost of a chain
+# is the sum of the costs of its functions.
+#
+# Chains end where a function has no more calls to follow. Calls within a
+# recursive cycle are only followed to functions found later by
+# CallGraphIndex.components(), which turns the call graph into a DAG, in
+# which a function comes after all functions it calls. The count most
+# expensive chains from each function are then found in a single pass over
+# this order, as its cost plus the expected calls times the cost of the
+# chains of each function called. With max_depth, the pass is repeated for
+# each depth. The count most expensive chains from the roots are kept in
+# chains, as (cost, path) tuples, most expensive first, and paths is the
+# number of chains there are.
+#
+# The heat of a function is its cost times the number of times it runs,
+# i.e. its cost summed over all chains through it. It's computed in a
+# single pass over the DAG, callers first.
+#
+class HotPaths(object):
+    def __init__(self, functions, roots, count, **kwargs):
+        self.functions = functions
+        self.trip_count = kwargs.get("trip_count", 10)
+        self.max_depth = kwargs.get("max_depth", 0)
+        self.exclude = exclude_filter(kwargs.get("exclude", None))
+        self.no_externs = kwargs.get("no_externs", False)
+        self.costs = kwargs.get("costs", None)
+        if self.costs is None:
+            self.costs = static_costs(functions)
+        index = kwargs.get("index", None) or CallGraphIndex(functions)
+        self.weights = dict()
+        self.heat = collections.Counter()
+
+        #
+        # The functions reachable from the roots, callees first, and the
+        # calls followed from each one.
+        #
+        components, component_of = index.components(
+            [index.id(root) for root in roots], exclude=self.exclude,
+            no_externs=self.no_externs)
+        self.order = [index.names[member] for component in components
+                      for member in component]
+        rank = dict((name, position)
+                    for position, name in enumerate(self.order))
+        self.calls = dict()
+        for name in self.order:
+            self.calls[name] = list()
+            if name in functions:
+                self.calls[name] = [
+                    (callee, weight)
+                    for callee, weight in self.call_weights(name).items()
+                    if rank.get(callee, rank[name]) < rank[name]]
+
+        if self.max_depth > 0:
+            table = None
+            for depth in range(self.max_depth):
+                table = self.rank_chains(count, table)
+        else:
+            table = self.rank_chains(count, unbounded=True)
+        chains = [chain for root in roots for chain in table[root][0]]
+        chains.sort(key=lambda chain: chain[0], reverse=True)
+        self.chains = [(cost, self.unlink(path))
+                       for cost, path in chains[:count]]
+        self.paths = sum(table[root][1] for root in roots)
+
+        self.add_heat(roots)
+
+    def cost(self, function_name):
+        return self.costs.get(function_name) or 1
+
+    #
+    # call_weights(), the expected number of calls to each function called,
+    # for a single run of the function. The task of a thread runs as often
+    # as the pthread_create() call before it.
+    #
+    def call_weights(self, function_name):
+        weights = self.weights.get(function_name)
+        if weights is not None:
+            return weights
+
+        finfo = self.functions[function_name]
+        weights = dict((callee, 0) for callee in finfo["calls"])
+        previous = 1
+        for entry in finfo["mycalls"]:
+            parts = entry.split("/")
+            weight = self.trip_count if "while" in parts[:-1] else 1
+            callee = call_target(self.functions, function_name, entry)
+            if callee == entry:
+                weight = previous
+            if callee in weights:
+                weights[callee] += weight
+            previous = weight if "pthread_create" in entry else 1
+
+        weights = dict((callee, weight or 1)
+                       for callee, weight in weights.items())
+        self.weights[function_name] = weights
+        return weights
+
+    #
+    # rank_chains(), the count most expensive chains from each function,
+    # and the number of chains, using the chains of the functions called
+    # from the previous table. Without it, a function's chains are just
+    # itself, and with unbounded, the table being built is used. A path is
+    # kept as linked (name, rest) tuples, see unlink().
+    #
+    def rank_chains(self, count, previous=None, unbounded=False):
+        table = dict()
+        if unbounded:
+            previous = table
+        for name in self.order:
+            cost = self.cost(name)
+            chains = list()
+            total = 0
+            if previous is not None:
+                for callee, weight in self.calls[name]:
+                    callee_chains, callee_total = previous[callee]
+                    chains.extend((cost + weight * chain_cost, (name, path))
+                                  for chain_cost, path in callee_chains)
+                    total += callee_total
+            if len(chains) == 0:
+                chains.append((cost, (name, None)))
+                total = 1
+            else:
+                #
+                # The sort is stable, so of equally expensive chains the
+                # one found first by a depth first walk comes first.
+                #
+                chains.sort(key=lambda chain: chain[0], reverse=True)
+                del chains[count:]
+            table[name] = (chains, total)
+        return table
+
+    def unlink(self, path):
+        names = list()
+        while path is not None:
+            names.append(path[0])
+            path = path[1]
+        return names
+
+    #
+    # add_heat(), the number of times each function runs from the roots
+    # times its cost. Without max_depth, the runs are passed from the
+    # callers to their callees in DAG order, else depth by depth.
+    #
+    def add_heat(self, roots):
+        runs = collections.Counter(roots)
+        if self.max_depth > 0:
+            for depth in range(self.max_depth):
+                next_runs = collections.Counter()
+                for name, times in runs.items():
+                    self.heat[name] += times * self.cost(name)
+                    for callee, weight in self.calls[name]:
+                        next_runs[callee] += times * weight
+                runs = next_runs
+            return
+
+        for name in reversed(self.order):
+            times = runs[name]
+            self.heat[name] += times * self.cost(name)
+            for callee, weight in self.calls[name]:
+                runs[callee] += times * weight
+
+
+#
+# format_cost(), a chain's cost like "{:g}" does, also for the integers
+# too large for a float, as loops nested deep enough can give.
+#
+def format_cost(cost):
+    try:
+        return "{:g}".format(cost)
+    except OverflowError:
+        digits = str(cost)
+        mantissa = digits[1:6].rstrip("0")
+        return "{}{}e+{}".format(digits[0], "." + mantissa if mantissa else "",
+                                 len(digits) - 1)
+
+
+#
+# dump_hot_paths()
+#
+# Write the chains of a HotPaths() as a callgraph, each chain preceded by a
+# comment line with its rank and cost. Edges called more than once per run
+# are labeled with the expected number of calls, and the functions are
+# filled by their heat on a logarithmic scale, from light yellow to dark
+# red. Returns the number of edges written.
+#
+def dump_hot_paths(hot_paths, **kwargs):
+    output = kwargs["output"]
+
+    for rank, (cost, path) in enumerate(hot_paths.chains, 1):
+        output.write("// {}. {} {}".format(rank, format_cost(cost),
+                                            " -> ".join(path)))
+
+    edges = set()
+    nodes = set()
+    for cost, path in hot_paths.chains:
+        nodes.update(path)
+        for caller, callee in zip(path, path[1:]):
+            if (caller, callee) in edges:
+                continue
+            edges.add((caller, callee))
+            weight = hot_paths.weights[caller][callee]
+            if weight != 1:
+                output.write('"{}" -> "{}" [label="x{:g}"];'.
+                             format(caller, callee, weight))
+            else:
+                output.write('"{}" -> "{}";'.format(caller, callee))
+
+    top = max([hot_paths.heat[node] for node in nodes] or [1])
+    for node in sorted(nodes):
+        level = 9
+        if top > 1:
+            level = 1 + int(8 * math.log(hot_paths.heat[node]) /
+                            math.log(top))
+        output.write('"{}" [style=filled, fillcolor="/ylorrd9/{}"];'.
+                     format(node, level))
+
+    return len(edges)
+
+
+#
+# ThreadModel()
+#
+# Thread model built from the pthread_create() and pthread_join() calls
+# found by the scanner, i.e. the threads list of each function, holding
+# ("create", site, handle, task) and ("join", site, handle, "") tuples in
+# program order. The site is the call's name in mycalls, and the handle
+# the pthread_t symbol, the local variable or stack slot, or empty if it's
+# not known.
+#
+# Each create site is a thread running the task function. A join is
+# matched to the last create on the same handle before it, in the same
+# function. A function runs in the threads of the tasks calling it,
+# directly or indirectly, but not through another task. Functions creating
+# or joining threads that are not called by anyone are root threads.
+#
+# The happens-before relation is computed on an event graph, where each
+# thread starts, runs the creates and joins of its functions, each one in
+# program order, and ends. A create precedes the start of its thread, and
+# the end of a thread precedes its joins. The clock of each event is a bit
+# set, vector clock style, of the threads that ended before it. A thread
+# started by more than one create only gets what all of them know. Threads
+# creating each other recursively make the graph cyclic, the creates and
+# joins closing the cycles are then ignored, and the threads created by
+# them get an empty clock.
+#
+class ThreadInfo(object):
+    __slots__ = ("id", "task", "function", "site", "handle", "parents",
+                 "joins")
+
+    def __init__(self, thread_id, task, function=None, site="", handle=""):
+        self.id = thread_id
+        self.task = task
+        self.function = function
+        self.site = site
+        self.handle = handle
+        self.parents = list()
+        self.joins = list()
+
+
+class ThreadModel(object):
+    def __init__(self, functions):
+        self.threads = list()
+        self.unmatched = list()
+
+        spawning = [function_name for function_name in sorted(functions.keys())
+                    if functions[function_name]["threads"]]
+        tasks = set(task for function_name in spawning
+                    for kind, site, handle, task in
+                    functions[function_name]["threads"] if kind == "create")
+
+        #
+        # Find the task or root functions each function runs in, and add
+        # the root threads, followed by a thread per create site.
+        #
+        owners = dict((function_name,
+                       self.owners(functions, function_name, tasks))
+                      for function_name in spawning)
+        entry_threads = collections.defaultdict(list)
+        for entry in sorted(set(entry for entries in owners.values()
+                                for entry in entries) - tasks):
+            entry_threads[entry].append(self.add_thread(entry))
+
+        events = dict()
+        for function_name in spawning:
+            last = dict()
+            function_events = events[function_name] = list()
+            for kind, site, handle, task in \
+                    functions[function_name]["threads"]:
+                if kind == "create":
+                    thread_id = self.add_thread(task, function_name, site,
+                                                handle)
+                    entry_threads[task].append(thread_id)
+                    if handle:
+                        last[handle] = thread_id
+                    function_events.append((kind, thread_id))
+                elif handle in last:
+                    self.threads[last[handle]].joins.append(
+                        (function_name, site))
+                    function_events.append((kind, last[handle]))
+                else:
+                    self.unmatched.append((function_name, site, handle))
+
+        for thread in self.threads:
+            if thread.function is not None:
+                thread.parents = [parent
+                                  for entry in owners[thread.function]
+                                  for parent in entry_threads[entry]]
+
+        self.clocks = self.compute_clocks(events, owners, entry_threads)
+
+    def add_thread(self, task, function=None, site="", handle=""):
+        self.threads.append(ThreadInfo(len(self.threads), task, function,
+                                       site, handle))
+        return len(self.threads) - 1
+
+    #
+    # owners(), the task or root functions calling the function, directly
+    # or indirectly, breadth first, without passing another task.
+    #
+    @staticmethod
+    def owners(functions, function_name, tasks):
+        owners = list()
+        seen = set([function_name])
+        queue = collections.deque([function_name])
+        while queue:
+            name = queue.popleft()
+            callers = functions[name]["callee_calls"]
+            if name in tasks or not len(callers):
+                owners.append(name)
+                continue
+            for caller in callers:
+                if caller not in seen:
+                    seen.add(caller)
+                    queue.append(caller)
+        return sorted(owners) or [function_name]
+
+    #
+    # compute_clocks(), build the event graph and return the clock of each
+    # thread's start. Nodes 2 * ID and 2 * ID + 1 are the start and end of
+    # a thread, the create and join events follow. The predecessors of a
+    # node are (node, thread) tuples, where thread is the one joined, or -1.
+    #
+    def compute_clocks(self, events, owners, entry_threads):
+        size = 2 * len(self.threads)
+        predecessors = [list() for node in range(size)]
+        creates = [list() for thread in self.threads]
+        for function_name, function_events in events.items():
+            for entry in owners[function_name]:
+                for thread_id in entry_threads[entry]:
+                    previous = 2 * thread_id
+                    for kind, other in function_events:
+                        predecessors.append([(previous, -1)])
+                        previous = len(predecessors) - 1
+                        if kind == "create":
+                            creates[other].append(previous)
+                        else:
+                            predecessors[previous].append((2 * other + 1,
+                                                           other))
+                    predecessors[2 * thread_id + 1].append((previous, -1))
+
+        successors = [list() for node in predecessors]
+        remaining = array.array("i", [0] * len(predecessors))
+        for node, sources in enumerate(predecessors):
+            if node < size and node % 2 == 1 and not sources:
+                sources.append((node - 1, -1))
+            for source, joined in sources:
+                successors[source].append(node)
+            remaining[node] = len(sources)
+        for thread_id, sources in enumerate(creates):
+            for source in sources:
+                successors[source].append(2 * thread_id)
+            remaining[2 * thread_id] = len(sources)
+
+        clocks = [None] * len(predecessors)
+        ready = [node for node in range(len(predecessors))
+                 if remaining[node] == 0]
+        cyclic = set()
+        while True:
+            while ready:
+                node = ready.pop()
+                clock = 0
+                if node < size and node % 2 == 0:
+                    sources = creates[node // 2]
+                    if sources and node // 2 not in cyclic:
+                        clock = functools.reduce(
+                            lambda first, second: first & second,
+                            (clocks[source] for source in sources))
+                else:
+                    for source, joined in predecessors[node]:
+                        clock |= clocks[source]
+                        if joined >= 0:
+                            clock |= 1 << joined
+                clocks[node] = clock
+                for successor in successors[node]:
+                    remaining[successor] -= 1
+                    if remaining[successor] == 0:
+                        ready.append(successor)
+
+            if None not in clocks:
+                break
+
+            #
+            # The nodes left are on, or after, a cycle. Ignore the creates
+            # and joins from those nodes, which leaves the threads, each a
+            # chain from start to end.
+            #
+            for node, clock in enumerate(clocks):
+                if clock is not None:
+                    continue
+                if node < size and node % 2 == 0:
+                    for source in creates[node // 2]:
+                        if clocks[source] is None:
+                            successors[source].remove(node)
+                            remaining[node] -= 1
+                            cyclic.add(node // 2)
+                for source, joined in list(predecessors[node]):
+                    if joined >= 0 and clocks[source] is None:
+                        successors[source].remove(node)
+                        predecessors[node].remove((source, joined))
+                        remaining[node] -= 1
+                if remaining[node] == 0:
+                    ready.append(node)
+
+        return clocks[0:size:2]
+
+    #
+    # happens_before(), True if the first thread always ends before the
+    # second one starts.
+    #
+    def happens_before(self, first, second):
+        return self.clocks[second] >> first & 1 == 1
+
+    #
+    # after(), the threads that always end before the thread starts
+    #
+    def after(self, thread_id):
+        return [other.id for other in self.threads
+                if self.happens_before(other.id, thread_id)]
+
+    #
+    # overlaps(), the other threads that might run at the same time
+    #
+    def overlaps(self, thread_id):
+        return [other.id for other in self.threads
+                if other.id != thread_id and
+                not self.happens_before(other.id, thread_id) and
+                not self.happens_before(thread_id, other.id)]
+
+
+#
+# dump_thread_model(), print the threads, with where they are created and
+# joined, and how they are ordered.
+#
+def dump_thread_model(model):
+    def thread_ids(threads):
+        return ", ".join("T{}".format(thread_id)
+                         for thread_id in threads) or "-"
+
+    print("\nThread model")
+    print("------------")
+    for thread in model.threads:
+        if thread.function is None:
+            print("  T{} {}()".format(thread.id, thread.task))
+        else:
+            print("  T{} {}() created by {} in {}() at {} [{}]".
+                  format(thread.id, thread.task or "?",
+                         thread_ids(thread.parents), thread.function,
+                         thread.site, thread.handle or "?"))
+        for function, site in thread.joins:
+            print("       joined in {}() at {}".format(function, site))
+        print("       runs after: {}".format(
+            thread_ids(model.after(thread.id))))
+        print("       overlaps: {}".format(
+            thread_ids(model.overlaps(thread.id))))
+
+    for function, site, handle in model.unmatched:
+        print("  Unmatched join in {}() at {} [{}]".
+              format(function, site, handle or "?"))
+
+
+#
+# call_target(), the function called by a mycalls entry of function_name,
+# or None. A call to a function defined before it is only prefixed by the
+# if, while and switch regions. Other calls, i.e. to external functions or
+# ones defined later, are also prefixed by the caller's name, and followed
+# by the call's sequence number, so they are matched against its calls.
+#
+def call_target(functions, function_name, entry):
+    parts = entry.split("/")
+    name = parts[-1]
+    if name in functions and \
+            all(part in ("if", "while") or part.startswith("switch")
+                for part in parts[:-1]):
+        return name
+    if len(parts) > 1 and parts[0] == function_name:
+        calls = functions[function_name]["calls"]
+        for end in range(len(name) - 1, 0, -1):
+            if name[end:].isdigit() and name[:end] in calls:
+                return name[:end]
+    return None
+
+
+#
+# TaskDAG()
+#
+# Task graph for scheduling analysis, starting at the root function. Each
+# function creating or joining threads, directly or through the functions
+# it calls, is expanded into a node for itself, followed by a node for each
+# mycalls entry in order. A create site forks the expansion of its task,
+# and a join site also waits for the last node of the task created on the
+# same handle. Functions called that don't create or join threads are a
+# single node, costing what their whole expansion would, and so are
+# recursive calls.
+#
+# The cost of a node is taken from costs, by its function or call site
+# name, and is 1 by default.
+#
+class TaskDAG(object):
+    def __init__(self, functions, root, costs=None):
+        self.functions = functions
+        self.costs = costs or dict()
+        self.names = list()
+        self.weights = list()
+        self.predecessors = list()
+        self.inclusive_costs = dict()
+
+        #
+        # The functions calling, directly or indirectly, one that creates
+        # or joins threads are expanded.
+        #
+        self.expanded = set()
+        queue = collections.deque(
+            name for name in functions.keys() if functions[name]["threads"])
+        while queue:
+            name = queue.popleft()
+            if name not in self.expanded:
+                self.expanded.add(name)
+                queue.extend(functions[name]["callee_calls"])
+
+        self.add_inclusive_costs(root)
+        self.expand(root)
+
+    def add_node(self, name, weight, *predecessors):
+        self.names.append(name)
+        self.weights.append(weight)
+        self.predecessors.append([predecessor
+                                  for predecessor in predecessors
+                                  if predecessor is not None])
+        return len(self.names) - 1
+
+    #
+    # expand(), add the nodes for the root function, and return the last
+    # one. The functions being expanded are kept on an explicit stack, each
+    # frame holding the function, its remaining mycalls entries, its thread
+    # events, the previous node, the last node of the task created on each
+    # handle, the task entry to skip after a create, and what the node
+    # returned by the function expanded next is for, i.e. a ("call", "")
+    # continues from it, and a ("create", handle) keeps it for the join.
+    #
+    def expand(self, root):
+        functions = self.functions
+        stack = list()
+        active = set()
+        end = self.enter(root, None, stack, active)
+        while stack:
+            frame = stack[-1]
+            if end is not None:
+                kind, handle = frame[6]
+                if kind == "call":
+                    frame[3] = end
+                elif handle:
+                    frame[4][handle] = end
+                frame[6] = None
+                end = None
+
+            entry = next(frame[1], None)
+            if entry is None:
+                stack.pop()
+                active.discard(frame[0])
+                end = frame[3]
+                continue
+            if entry == frame[5]:
+                frame[5] = None
+                continue
+            frame[5] = None
+
+            kind, handle, task = frame[2].get(entry, (None, "", ""))
+            target = call_target(functions, frame[0], entry)
+            if kind == "create":
+                frame[3] = self.add_node(entry, self.costs.get(entry, 1),
+                                         frame[3])
+                frame[5] = task
+                frame[6] = (kind, handle)
+                end = self.enter(task, frame[3], stack, active)
+            elif kind == "join":
+                frame[3] = self.add_node(entry, self.costs.get(entry, 1),
+                                         frame[3], frame[4].get(handle))
+            elif target is not None and target in functions:
+                frame[6] = ("call", "")
+                end = self.enter(target, frame[3], stack, active)
+            else:
+                frame[3] = self.add_node(entry, self.costs.get(entry, 1),
+                                         frame[3])
+        return end
+
+    #
+    # enter(), add the node for a function after the previous node. If it's
+    # expanded, its frame is pushed and None returned, else it's a single
+    # node, which is returned.
+    #
+    def enter(self, function_name, previous, stack, active):
+        functions = self.functions
+        if function_name not in functions:
+            return self.add_node(function_name,
+                                 self.costs.get(function_name, 1), previous)
+        if function_name in active or function_name not in self.expanded:
+            return self.add_node(function_name,
+                                 self.inclusive_cost(function_name),
+                                 previous)
+
+        active.add(function_name)
+        events = dict((site, (kind, handle, task)) for kind, site, handle, task
+                      in functions[function_name]["threads"])
+        previous = self.add_node(function_name,
+                                 self.costs.get(function_name, 1), previous)
+        stack.append([function_name,
+                      iter(functions[function_name]["mycalls"]), events,
+                      previous, dict(), None, None])
+        return None
+
+    #
+    # add_inclusive_costs(), the cost of each function reachable from the
+    # root, and all the calls it makes, including the tasks of the threads
+    # it creates. The call graph's components are done callees first, and
+    # all functions of a recursive cycle cost the whole cycle, i.e. each
+    # of its functions once, and the calls leaving the cycle.
+    #
+    def add_inclusive_costs(self, root):
+        functions = self.functions
+        if root not in functions:
+            return
+        index = CallGraphIndex(functions)
+        components, component_of = index.components([index.id(root)])
+        for number, component in enumerate(components):
+            members = [index.names[member] for member in component
+                       if member < index.count]
+            cost = 0
+            for function_name in members:
+                cost += self.costs.get(function_name, 1)
+                for entry in functions[function_name]["mycalls"]:
+                    target = call_target(functions, function_name, entry)
+                    if target is None or target not in functions:
+                        cost += self.costs.get(entry, 1)
+                    elif component_of[index.id(target)] != number:
+                        cost += self.inclusive_costs[target]
+            for function_name in members:
+                self.inclusive_costs[function_name] = cost
+
+    def inclusive_cost(self, function_name):
+        return self.inclusive_costs[function_name]
+
+    #
+    # earliest_start(), the earliest start time of each node, with
+    # unlimited cores. Nodes are added after their predecessors, so they
+    # are in topological order.
+    #
+    def earliest_start(self):
+        start = [0] * len(self.names)
+        for node, predecessors in enumerate(self.predecessors):
+            for predecessor in predecessors:
+                start[node] = max(start[node],
+                                  start[predecessor] + self.weights[predecessor])
+        return start
+
+    def work(self):
+        return sum(self.weights)
+
+    def span(self):
+        start = self.earliest_start()
+        return max(start[node] + self.weights[node]
+                   for node in range(len(self.names))) if self.names else 0
+
+    #
+    # critical_path(), the nodes of a longest path, from the root
+    #
+    def critical_path(self):
+        if not self.names:
+            return list()
+        start = self.earliest_start()
+        node = max(range(len(self.names)),
+                   key=lambda node: start[node] + self.weights[node])
+        path = [node]
+        while self.predecessors[node]:
+            node = max(self.predecessors[node],
+                       key=lambda predecessor: start[predecessor] +
+                       self.weights[predecessor])
+            path.append(node)
+        path.reverse()
+        return path
+
+    #
+    # list_schedule(), simulate list scheduling on the given number of
+    # cores, where a ready node with the longest path to the end goes
+    # first. Returns the makespan.
+    #
+    def list_schedule(self, cores):
+        size = len(self.names)
+        successors = [list() for node in range(size)]
+        remaining = [len(predecessors) for predecessors in self.predecessors]
+        for node, predecessors in enumerate(self.predecessors):
+            for predecessor in predecessors:
+                successors[predecessor].append(node)
+
+        level = list(self.weights)
+        for node in range(size - 1, -1, -1):
+            for successor in successors[node]:
+                level[node] = max(level[node],
+                                  self.weights[node] + level[successor])
+
+        ready = [(-level[node], node) for node in range(size)
+                 if remaining[node] == 0]
+        heapq.heapify(ready)
+        running = list()
+        time = 0
+        while ready or running:
+            while ready and len(running) < cores:
+                node = heapq.heappop(ready)[1]
+                heapq.heappush(running, (time + self.weights[node], node))
+            time, node = heapq.heappop(running)
+            for successor in successors[node]:
+                remaining[successor] -= 1
+                if remaining[successor] == 0:
+                    heapq.heappush(ready, (-level[successor], successor))
+        return time
+
+
+#
+# insn_totals(), the insn, call_insn, jump_insn and memory reference counts
+# of a function, over all its regions.
+#
+def insn_totals(finfo):
+    totals = [0, 0, 0, 0]
+    for counts in finfo["insns"].values():
+        for index, count in enumerate(counts):
+            totals[index] += count
+    return totals
+
+
+#
+# static_costs(), the cost of each defined function as estimated from its
+# RTL, i.e. one for each insn, and one more for each memory reference.
+#
+def static_costs(functions):
+    return dict((function_name, sum(insn_totals(functions[function_name])))
+                for function_name in functions.keys())
+
+
+#
+# load_cost_file(), read the node costs from a CSV file, with a function or
+# call site name, and its cost, on each line. Costs must be finite, and not
+# negative. Raises IOError or ValueError.
+#
+def load_cost_file(file):
+    costs = dict()
+    with open(file) as cost_file:
+        csv_reader = csv.reader(cost_file)
+        for row in csv_reader:
+            if not row or row[0].startswith("#"):
+                continue
+            if len(row) != 2:
+                raise ValueError("Line {} is not a name and a cost".
+                                 format(csv_reader.line_num))
+            try:
+                cost = float(row[1])
+            except ValueError:
+                cost = None
+            if cost is None or not math.isfinite(cost) or cost < 0:
+                raise ValueError("Line {} has an invalid cost, {}".
+                                 format(csv_reader.line_num, row[1].strip()))
+            costs[row[0].strip()] = cost
+    return costs
+
+
+#
+# dump_schedule(), print the work, span and parallelism of the task graph,
+# its critical path, and how list scheduling does on the cores.
+#
+def dump_schedule(dag, cores):
+    work = dag.work()
+    span = dag.span()
+    start = dag.earliest_start()
+
+    print("\nSchedule analysis")
+    print("-----------------")
+    print("  Nodes       : {}".format(len(dag.names)))
+    print("  Work        : {:g}".format(work))
+    print("  Span        : {:g}".format(span))
+    print("  Parallelism : {:.2f}".format(work / span if span else 1))
+    for count in sorted(set([1, cores])):
+        makespan = dag.list_schedule(count)
+        print("  {} core(s)   : makespan {:g}, speedup {:.2f}".
+              format(count, makespan, work / makespan if makespan else 1))
+    print("\n  Critical path (earliest start, cost):")
+    for node in dag.critical_path():
+        print("    {} ({:g}, {:g})".format(dag.names[node], start[node],
+                                          dag.weights[node]))
+
+
+#
+# print_err()
+#
+def print_err(text):
+    sys.stderr.write(text + "\n")
+
+
+#
+# print_dbg()
+#
+def print_dbg(text):
+    sys.stderr.write("DBG: " + text + "\n")
+
+
+#
+# Profiler()
+#
+# Collects the named stage timers and counters of a run. The timers are
+# always kept, the more expensive counters, i.e. the ones per RTL line or
+# token, are only collected by the scanner if the profiler is enabled.
+# The result is either reported as debug output, or dumped as JSON.
+#
+class Profiler(object):
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.timers = collections.OrderedDict()
+        self.counters = collections.Counter()
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            timer = self.timers.setdefault(name, [0.0, 0])
+            timer[0] += time.perf_counter() - start_time
+            timer[1] += 1
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def update(self, counters):
+        self.counters.update(counters)
+
+    def peak_rss(self):
+        if resource is None:
+            return None
+
+        #
+        # ru_maxrss is in kilobytes, except on macOS where it's in bytes
+        #
+        scale = 1024 if sys.platform == "darwin" else 1
+        return dict(
+            self=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+            children=resource.getrusage(
+                resource.RUSAGE_CHILDREN).ru_maxrss // scale)
+
+    def report(self):
+        for name, (seconds, calls) in self.timers.items():
+            print_dbg("[PERF] {} took {:.9f} seconds{}".format(
+                name, seconds, "" if calls == 1 else
+                ", {} calls".format(calls)))
+        for name in sorted(self.counters):
+            print_dbg("[PERF] {}: {}".format(name, self.counters[name]))
+        rss = self.peak_rss()
+        if rss is not None:
+            print_dbg("[PERF] Peak RSS {} KB, {} KB for worker "
+                      "processes".format(rss["self"], rss["children"]))
+
+    def dump(self, file):
+        data = collections.OrderedDict()
+        data["argv"] = sys.argv
+        data["timers"] = collections.OrderedDict(
+            (name, dict(seconds=seconds, calls=calls))
+            for name, (seconds, calls) in self.timers.items())
+        data["counters"] = collections.OrderedDict(
+            (name, self.counters[name]) for name in sorted(self.counters))
+        data["peak_rss_kb"] = self.peak_rss()
+        with open(file, "w") as profile_file:
+            json.dump(data, profile_file, indent=2)
+            profile_file.write("\n")
+
+
+#
+# DotWriter()
+#
+# Output for the generated .dot data. Lines are collected and written in
+# large chunks, rather than doing a print() per line, to stdout or to a
+# file, optionally gzip compressed. In capture mode nothing is written,
+# the lines are only kept in the lines list, which is what unit_test()
+# uses.
+#
+class DotWriter(object):
+    def __init__(self, file=None, compress=None, capture=False,
+                 buffer_size=1 << 20):
+        self.lines = list() if capture else None
+        self.written = 0
+        self.buffer_size = buffer_size
+        self.chunks = list()
+        self.size = 0
+        self.raw = None
+        self.stream = None
+        self.close_raw = False
+
+        if capture:
+            return
+
+        if compress is None:
+            compress = file is not None and file.endswith(".gz")
+
+        if file is None or file == "-":
+            sys.stdout.flush()
+            self.raw = sys.stdout.buffer
+        else:
+            self.raw = open(file, "wb")
+            self.close_raw = True
+
+        if compress:
+            self.stream = gzip.GzipFile(fileobj=self.raw, mode="wb",
+                                        filename="")
+        else:
+            self.stream = self.raw
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, text):
+        self.written += 1
+        if self.lines is not None:
+            self.lines.append(text)
+            return
+
+        self.chunks.append(text)
+        self.size += len(text) + 1
+        if self.size >= self.buffer_size:
+            self.write_chunks()
+
+    def write_chunks(self):
+        if self.stream is None or len(self.chunks) == 0:
+            return
+
+        self.chunks.append("")
+        self.stream.write("\n".join(self.chunks).encode("utf-8"))
+        self.chunks = list()
+        self.size = 0
+
+    def flush(self):
+        if self.stream is None:
+            return
+
+        self.write_chunks()
+        self.stream.flush()
+
+    def close(self):
+        if self.stream is None:
+            return
+
+        self.write_chunks()
+        if self.stream is not self.raw:
+            self.stream.close()
+        if self.close_raw:
+            self.raw.close()
+        else:
+            self.raw.flush()
+        self.stream = None
+
+
+#
+# Dump function details:
+#
+def dump_function_info(functions, function, details):
+    finfo = functions[function]
+    print("  {}() {}".format(function,
+                             finfo["files"] if details else ""))
+    if details:
+        for caller in sorted(finfo["calls"].keys()):
+            print("    --> {}".format(caller))
+
+        if len(finfo["calls"]) > 0 and len(finfo["callee_calls"]) > 0:
+            print("    ===")
+
+        for caller in sorted(finfo["callee_calls"].keys()):
+            print("    <-- {}".format(caller))
+
+        for region, counts in sorted(finfo["insns"].items()):
+            print("    {}: {} insn, {} call_insn, {} jump_insn, {} mem".
+                  format(region or "body", *counts))
+
+        print("\n")
+
+
+#
+# Build full call graph
+#
+def full_call_graph(functions, **kwargs):
+    exclude = exclude_filter(kwargs.get("exclude", None))
+    no_externs = kwargs.get("no_externs", False)
+    output = kwargs.get("output", None)
+    close_output = output is None
+    if close_output:
+        output = DotWriter()
+    output.write("strict digraph callgraph {")
+    myjoin = re.compile(r"pthread_join")
+    switch_re=re.compile(r"switch+(\d+)")
+    tail = ""
+    has_if=0#判断当前是否出现if，为0则没有
+    count_if=0#计数出现了几次if标志
     count_switch=0
     start_if=""#记录if开始关键词
     end_if=""#记录if结束关键词
@@ -531,108 +3296,1546 @@ def full_call_graph(functions, **kwargs):
     preswtich=""#储存上一个switch
     prenum=1#判断与上一个是不是一组的
     #
-    # Simply walk all nodes and print the callers
+    # Simply walk all nodes and print the callers
+    #
+    for func in sorted(functions.keys()):
+        printed_functions = 1
+        pre = func
+        if exclude is None or not exclude.excluded(func):
+
+            for caller in functions[func]["mycalls"]:
+                if (not no_externs or caller in functions) and \
+                        (exclude is None or
+                         not exclude.excluded(caller)):
+                    join_search = re.search(myjoin, caller)
+                    if join_search is not None:
+                        #
+                        # The thread joined is only known if it's created
+                        # with a pthread_t symbol in this function.
+                        #
+                        myg_thread = functions[func]["myinfo"][caller]
+                        myg_task = functions[func]["myinfo"].get(myg_thread)
+                        if myg_task in functions:
+                            myg_tail = functions[myg_task]["myinfo"]["tail"]
+                            output.write('"{}" -> "{}";'.format(myg_tail,
+                                                                caller))
+
+
+                    # if caller not in functions:
+                    #     output.write('"{}" [style=dashed]'.
+                    #               format(caller))
+                    # if "if" in caller:
+                    #     if has_if==0:
+                    #         has_if=1
+                    #     count_if=count_if+1
+                    #     if count_if==1:
+                    #         start_if=pre
+                    #     output.write('"{}" [style=dashed]'.
+                    #               format(caller))
+                    # else:
+                    #     if has_if==1:
+                    #         has_if=0
+                    #         end_if=caller
+                    #         output.write('"{}" -> "{}";'.format(start_if, end_if))
+                    #         # output.write('"{}" [style=dashed]'.
+                    #         #           format(start_if))
+                    #         # output.write('"{}" [style=dashed]'.
+                    #         #           format(end_if))
+                    #     count_if=0
+                    #     if "while" in caller:
+                    #         output.write('"{}" [style=dashed]'.
+                    #               format(caller))
+                    #     elif"switch" in caller:
+                    #         output.write('"{}" [style=dashed]'.
+                    #                   format(caller))
+                    if "if" in caller:
+                        if count_if==0:
+                            count_if=count_if+1
+                            start_if=pre
+                        output.write('"{}" -> "{}";'.format(pre, caller))
+                        output.write('"{}" [style=dashed]'.format(caller))
+                    elif "while" in caller:
+                        output.write('"{}" -> "{}";'.format(pre, caller))
+                        output.write('"{}" [style=dashed]'.format(caller))
+                    elif "switch" in caller:
+                        if count_switch==0:
+                            count_switch=count_switch+1
+                            start_switch=pre
+                        switch_re_flag=re.search(switch_re,caller)
+                        search_switch="switch"+switch_re_flag.group(1)
+                        if prenum!=switch_re_flag.group(1):
+                            prenum=switch_re_flag.group(1)
+                            preswtich=start_switch
+                        else:
+                            preswtich=pre
+                        switchlist[start_switch]=dict()
+                        switchlist[start_switch][search_switch]=list()
+                        switchlist[start_switch][search_switch].append(caller)
+                        output.write('"{}" -> "{}";'.format(start_switch, caller))
+                        output.write('"{}" [style=dashed]'.format(caller))
+                    else:
+                        if count_if>0:
+                            count_if=0
+                            end_if=caller
+                            output.write('"{}" -> "{}";'.format(pre, end_if))
+                            output.write('"{}" -> "{}";'.format(start_if, end_if))
+                        elif count_switch>0:#switch与最后节点相连的元素
+                            end_switch=caller
+                            for key in switchlist[start_switch]:
+                                output.write('"{}" -> "{}";'.format(key[-1], end_switch))
+                            count_switch=0
+                            prenum=1
+                        else:
+                            output.write('"{}" -> "{}";'.format(pre, caller))
+                    printed_functions += 1
+                    pre = caller
+            if printed_functions == 0:
+                output.write('"{}"'.format(func))
+    if kwargs.get("weights", False):
+        for func in sorted(functions.keys()):
+            if exclude is None or not exclude.excluded(func):
+                insn, call_insn, jump_insn, mems = \
+                    insn_totals(functions[func])
+                output.write('"{}" [label="{}\\n{} insns, {} mem"];'.
+                             format(func, func, insn + call_insn + jump_insn,
+                                    mems))
+    if kwargs.get("locks", False):
+        dump_sync_edges(functions, exclude=exclude, no_externs=no_externs,
+                        output=output)
+    output.write("}")
+
+    if close_output:
+        output.close()
+
+
+#
+# dump_sync_edges()
+#
+# Write the synchronization objects, as octagons, with a dotted edge to
+# each call site acquiring one, and from each one releasing it. Within a
+# function, a release is matched to the last acquire of the same object
+# before it, and the critical section between them is a bold edge,
+# labeled with the object. A release in an if or switch branch might not
+# be taken, so the object is still held for the next release. Condition
+# variables have no critical sections, as their waits and signals are not
+# nested, but a wait ends the critical section of its mutex and starts a
+# new one, see SYNC_CALLS. Returns the number of critical sections.
+#
+def dump_sync_edges(functions, **kwargs):
+    exclude = exclude_filter(kwargs.get("exclude", None))
+    no_externs = kwargs.get("no_externs", False)
+    output = kwargs["output"]
+
+    objects = dict()
+    sections = 0
+    for func in sorted(functions.keys()):
+        if exclude is not None and exclude.excluded(func):
+            continue
+        acquired = collections.defaultdict(list)
+        for call, site, sync_object in functions[func]["syncs"]:
+            if not sync_object or \
+                    (no_externs and site not in functions) or \
+                    (exclude is not None and
+                     (exclude.excluded(site) or
+                      exclude.excluded(sync_object))):
+                continue
+            operation, kind = SYNC_CALLS[call]
+            color = SYNC_COLORS[kind]
+            objects[sync_object] = color
+            if operation == "acquire":
+                output.write('"{}" -> "{}" [color={}, style=dotted];'.
+                             format(sync_object, site, color))
+                if kind != "condvar":
+                    acquired[sync_object].append(site)
+            else:
+                output.write('"{}" -> "{}" [color={}, style=dotted];'.
+                             format(site, sync_object, color))
+                if acquired[sync_object]:
+                    output.write('"{}" -> "{}" [color={}, style=bold, '
+                                 'label="{}"];'.
+                                 format(acquired[sync_object][-1], site,
+                                        color, sync_object))
+                    sections += 1
+                    if not any(part == "if" or part.startswith("switch")
+                               for part in site.split("/")[:-1]):
+                        acquired[sync_object].pop()
+
+    for sync_object in sorted(objects):
+        output.write('"{}" [shape=octagon, color={}];'.
+                     format(sync_object, objects[sync_object]))
+    return sections
+
+
+#
+# Regex to extract functions
+#
+function = re.compile(
+    r"^;; Function (?P<mangle>.*)\s+\((?P<function>\S+)(,.*)?\).*$")
+
+#
+# Line classifier
+#
+# All RTL constructs the scanner is interested in are found by a single
+# alternation regex. Each alternative is wrapped in a named group, so
+# match.lastgroup tells which one matched. The semantics mirror the
+# individual regexes the scanner used to run on each line:
+#
+#   code_label   r"\(code_label\s+(\d+)", at the start of the line
+#   jump_insn    r"\(jump_insn\s+(\d+)", at the start of the line
+#   label_ref    r".*\(label_ref\s+(\d+)", last one on the line
+#   if_then_else r".*\(if_then_else"
+#   thread_set   r".*\(set\s+\(reg:DI\s+5\s+di\)"
+#   task_set     r".*\(set\s+\(reg:DI\s+1\s+dx\)"
+#   join_thread  r".*\(reg:DI \d+ \[ (thread\d*).*\]", last one on the line
+#   call         r"^.*\(call.*\"(?P<target>.*)\".*$"
+#   symbol_ref   r"^.*\(symbol_ref.*\"(?P<target>.*)\".*$"
+#   symbol       r".*\(symbol_ref:DI \(\"(?P<target>.*?)\"\)", last one on the
+#                line, used for the thread and task names.
+#
+# The insn and call_insn headers, and the memory references, are counted
+# for the static cost of a function without this regex, see classify_line().
+#
+rtl_token = re.compile(
+    r"\((?:"
+    r"(?P<code_label>code_label\s+(?P<code_num>\d+))|"
+    r"(?P<jump_insn>jump_insn\s+\d+)|"
+    r"(?P<label_ref>label_ref\s+(?P<ref_num>\d+))|"
+    r"(?P<if_then_else>if_then_else)|"
+    r"(?P<set>set\s+\(reg:DI\s+(?:(?P<thread_set>5\s+di)|"
+    r"(?P<task_set>1\s+dx))\))|"
+    r"(?P<join_thread>reg:DI \d+ \[ (?P<thread>thread\d*))|"
+    r"(?P<call>call)|"
+    r"(?P<symbol_ref>symbol_ref(?::DI \(\"(?P<symbol>.*?)\"\))?)"
+    r")")
+
+RTL_CODE_LABEL = 0x001
+RTL_JUMP_INSN = 0x002
+RTL_LABEL_REF = 0x004
+RTL_IF_THEN_ELSE = 0x008
+RTL_THREAD_SET = 0x010
+RTL_TASK_SET = 0x020
+RTL_JOIN_THREAD = 0x040
+RTL_CALL = 0x080
+RTL_SYMBOL_REF = 0x100
+RTL_SYMBOL = 0x200
+RTL_INSN = 0x400
+RTL_CALL_INSN = 0x800
+RTL_INSN_KINDS = RTL_INSN | RTL_CALL_INSN | RTL_JUMP_INSN
+
+RTL_KIND_NAMES = (
+    (RTL_CODE_LABEL, "code_label"), (RTL_JUMP_INSN, "jump_insn"),
+    (RTL_LABEL_REF, "label_ref"), (RTL_IF_THEN_ELSE, "if_then_else"),
+    (RTL_THREAD_SET, "thread_set"), (RTL_TASK_SET, "task_set"),
+    (RTL_JOIN_THREAD, "join_thread"), (RTL_CALL, "call"),
+    (RTL_SYMBOL_REF, "symbol_ref"), (RTL_SYMBOL, "symbol"),
+    (RTL_INSN, "insn"), (RTL_CALL_INSN, "call_insn"))
+
+#
+# Synchronization calls, recorded by the scanner with the symbol of the
+# object they operate on, i.e. their first argument. For each call, if it
+# acquires or releases the object, and the kind of object. A condition
+# wait releases its mutex, the second argument, while waiting and acquires
+# it again before returning, so it's recorded between an unlock and a lock
+# of the mutex, all at the wait's call site.
+#
+SYNC_CALLS = {
+    "pthread_mutex_lock": ("acquire", "mutex"),
+    "pthread_mutex_trylock": ("acquire", "mutex"),
+    "pthread_mutex_timedlock": ("acquire", "mutex"),
+    "pthread_mutex_unlock": ("release", "mutex"),
+    "pthread_rwlock_rdlock": ("acquire", "rwlock"),
+    "pthread_rwlock_wrlock": ("acquire", "rwlock"),
+    "pthread_rwlock_unlock": ("release", "rwlock"),
+    "pthread_spin_lock": ("acquire", "spinlock"),
+    "pthread_spin_unlock": ("release", "spinlock"),
+    "sem_wait": ("acquire", "semaphore"),
+    "sem_trywait": ("acquire", "semaphore"),
+    "sem_timedwait": ("acquire", "semaphore"),
+    "sem_post": ("release", "semaphore"),
+    "pthread_cond_wait": ("acquire", "condvar"),
+    "pthread_cond_timedwait": ("acquire", "condvar"),
+    "pthread_cond_signal": ("release", "condvar"),
+    "pthread_cond_broadcast": ("release", "condvar")}
+
+SYNC_COLORS = {"mutex": "red", "rwlock": "orange", "spinlock": "brown",
+               "semaphore": "blue", "condvar": "darkgreen"}
+
+
+#
+# RtlToken()
+#
+# Classification result for a single RTL line. The kinds field is a mask of
+# the RTL_* values above, as one line can contain more than one construct,
+# for example a call_insn also holds the symbol_ref of its target. The mems
+# field is the number of memory references on the line. For calls, handle
+# and mutex are the sources of the first and second argument, as found by
+# HandleTracker().
+#
+class RtlToken(object):
+    __slots__ = ("kinds", "code_label", "label_ref", "thread", "target",
+                 "symbol", "mems", "handle", "mutex")
+
+    def __init__(self):
+        self.kinds = 0
+        self.code_label = None
+        self.label_ref = None
+        self.thread = None
+        self.target = None
+        self.symbol = None
+        self.mems = 0
+        self.handle = None
+        self.mutex = None
+
+
+#
+# classify_line()
+#
+# Returns a RtlToken for the given line, or None if the line holds nothing
+# the scanner is interested in. Lines are first rejected on their first
+# character, as all RTL constructs need an opening parenthesis, and only
+# than the combined rtl_token regex is run. The insn headers and memory
+# references are found with plain string operations, where the memory a
+# call's target is in doesn't count.
+#
+def classify_line(line):
+    first = line[:1]
+    if first != "(" and first != " " and "(" not in line:
+        return None
+
+    kinds = 0
+    if first == "(":
+        if line.startswith(("(insn ", "(insn/")):
+            kinds = RTL_INSN
+        elif line.startswith(("(call_insn ", "(call_insn/")):
+            kinds = RTL_CALL_INSN
+    mems = 0
+    if "(mem" in line:
+        mems = line.count("(mem:") + line.count("(mem/") - \
+            line.count("(call (mem")
+
+    match = rtl_token.search(line)
+    if match is None:
+        if kinds == 0 and mems == 0:
+            return None
+        token = RtlToken()
+        token.kinds = kinds
+        token.mems = mems
+        return token
+
+    token = RtlToken()
+    token.mems = mems
+    call_pos = -1
+    symbol_ref_pos = -1
+    for match in rtl_token.finditer(line, match.start()):
+        kind = match.lastgroup
+        if kind == "label_ref":
+            kinds |= RTL_LABEL_REF
+            token.label_ref = match.group("ref_num")
+        elif kind == "symbol_ref":
+            if symbol_ref_pos < 0:
+                symbol_ref_pos = match.start()
+            if match.group("symbol") is not None:
+                kinds |= RTL_SYMBOL
+                token.symbol = match.group("symbol")
+        elif kind == "call":
+            if call_pos < 0:
+                call_pos = match.start()
+        elif kind == "code_label":
+            if match.start() == 0:
+                kinds |= RTL_CODE_LABEL
+                token.code_label = match.group("code_num")
+        elif kind == "jump_insn":
+            if match.start() == 0:
+                kinds |= RTL_JUMP_INSN
+        elif kind == "if_then_else":
+            kinds |= RTL_IF_THEN_ELSE
+        elif kind == "set":
+            if match.group("thread_set") is not None:
+                kinds |= RTL_THREAD_SET
+            else:
+                kinds |= RTL_TASK_SET
+        elif kind == "join_thread":
+            if "]" in line[match.end():]:
+                kinds |= RTL_JOIN_THREAD
+                token.thread = match.group("thread")
+
+    #
+    # Both the call and symbol_ref target are the text between the last two
+    # double quotes on the line, if they follow the first "(call" or
+    # "(symbol_ref".
+    #
+    if call_pos >= 0 or symbol_ref_pos >= 0:
+        end = line.rfind('"')
+        start = line.rfind('"', 0, end) if end > 0 else -1
+        if start >= 0:
+            if 0 <= call_pos and call_pos + 5 <= start:
+                kinds |= RTL_CALL
+            if 0 <= symbol_ref_pos and symbol_ref_pos + 11 <= start:
+                kinds |= RTL_SYMBOL_REF
+            token.target = line[start + 1:end]
+
+    if kinds == 0 and mems == 0:
+        return None
+
+    token.kinds = kinds
+    return token
+
+
+#
+# RTL_KEYWORDS
+#
+# Every construct matched by the rtl_token regex contains one of these, as
+# printed by GCC, i.e. separated by single spaces, and so do the insn
+# headers and memory references counted, and the registers and offsets
+# followed by HandleTracker(). They are used by the mmap reader, together
+# with the ";; Function" header, to find the lines worth decoding.
+#
+RTL_KEYWORDS = (b";; Function", b"(code_label", b"(jump_insn", b"(label_ref",
+                b"(if_then_else", b"(reg", b"[ thread", b"(call",
+                b"(symbol_ref", b"(insn", b"(mem", b"(const_int")
+
+
+#
+# Compressed RTL files
+#
+# RTL files compressed with one of the formats below, recognized by their
+# magic bytes, are decompressed while being read. The entries are the
+# format's name, magic bytes, and a function returning a decompressing
+# binary stream for the raw file object, or None if the module needed is
+# not available.
+#
+def zstd_stream(raw):
+    return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(
+        raw, read_across_frames=True))
+
+
+RTL_COMPRESSION = (
+    ("gzip", b"\x1f\x8b", lambda raw: gzip.GzipFile(fileobj=raw)),
+    ("xz", b"\xfd7zXZ\x00", lzma.LZMAFile),
+    ("bzip2", b"BZh", bz2.BZ2File),
+    ("zstd", b"\x28\xb5\x2f\xfd", zstd_stream if zstandard else None))
+
+
+#
+# rtl_file_compression()
+#
+# Returns the RTL_COMPRESSION entry for the RTL file, or its content if
+# already read into data, or None if it's not compressed.
+#
+def rtl_file_compression(file, data=None):
+    if data is None:
+        with open(file, "rb") as rtl_file:
+            magic = rtl_file.read(6)
+    else:
+        magic = bytes(data[:6])
+
+    for compression in RTL_COMPRESSION:
+        if magic.startswith(compression[1]):
+            return compression
+    return None
+
+
+#
+# rtl_file_open()
+#
+# Opens the RTL file, or its content if already read into data, as a
+# binary stream, decompressing it if needed. Yields the stream, and
+# whether the file is compressed.
+#
+@contextlib.contextmanager
+def rtl_file_open(file, data=None):
+    compression = rtl_file_compression(file, data)
+    with open(file, "rb") if data is None else io.BytesIO(data) as raw:
+        if compression is None:
+            yield raw, False
+            return
+        if compression[2] is None:
+            raise IOError("Can't decompress {} data, module not available".
+                          format(compression[0]))
+        with compression[2](raw) as stream:
+            yield stream, True
+
+
+#
+# rtl_file_lines()
+#
+# Returns the lines of a RTL file, or of its content if already read into
+# data. With use_mmap, the lines of interest are taken from the file with
+# rtl_buffer_lines(). The file is mapped, or if compressed, the
+# decompressed data is processed in windows of at most 1MB, so the memory
+# used does not depend on the file's size.
+#
+def rtl_file_lines(file, use_mmap=False, window=1 << 26, data=None):
+    with rtl_file_open(file, data) as (rtl_file, compressed):
+        if not use_mmap:
+            lines = io.TextIOWrapper(rtl_file)
+        elif compressed:
+            lines = rtl_stream_lines(rtl_file, min(window, 1 << 20))
+        elif data is not None:
+            lines = rtl_buffer_lines(data, window)
+        elif os.fstat(rtl_file.fileno()).st_size == 0:
+            return
+        else:
+            with mmap.mmap(rtl_file.fileno(), 0,
+                           access=mmap.ACCESS_READ) as data:
+                for line in rtl_buffer_lines(data, window):
+                    yield line
+            return
+
+        for line in lines:
+            yield line
+
+
+#
+# rtl_stream_lines()
+#
+# Same as rtl_buffer_lines(), but reads the data from a binary stream, one
+# window of whole lines at the time.
+#
+def rtl_stream_lines(stream, window=1 << 20):
+    while True:
+        data = stream.read(window)
+        if not data:
+            return
+        if not data.endswith(b"\n"):
+            data += stream.readline()
+        for line in rtl_buffer_lines(data, len(data)):
+            yield line
+
+
+#
+# rtl_buffer_lines()
+#
+# Returns the lines of interest of RTL data, processed in windows of whole
+# lines. In each window the keywords above are located with bytes.find(),
+# and only the lines holding one of them are decoded. Any run of other
+# lines is returned as a single empty line, as RtlScanner.scan() only needs
+# to know such lines were there, i.e. for the line consumed by a task set.
+#
+def rtl_buffer_lines(data, window=1 << 26):
+    size = len(data)
+    pos = 0
+    while pos < size:
+        limit = data.find(b"\n", min(pos + window, size) - 1)
+        limit = size if limit < 0 else limit + 1
+
+        starts = set()
+        for keyword in RTL_KEYWORDS:
+            at = data.find(keyword, pos, limit)
+            while at >= 0:
+                starts.add(data.rfind(b"\n", pos, at) + 1 or pos)
+                at = data.find(keyword, at + 1, limit)
+
+        for start in sorted(starts):
+            if start > pos:
+                yield ""
+            end = data.find(b"\n", start, limit) + 1 or limit
+            yield data[start:end].decode("utf-8")
+            pos = end
+
+        if pos < limit:
+            yield ""
+            pos = limit
+
+
+#
+# read_rtl_file(), returns the raw content of a RTL file
+#
+def read_rtl_file(file):
+    with open(file, "rb") as rtl_file:
+        return rtl_file.read()
+
+
+#
+# prefetch_rtl_files()
+#
+# Yields (file, data) tuples for the files, in order, where data is the
+# file's content. Up to count files ahead are read by a thread pool, so on
+# slow storage reading them overlaps with parsing the current one. The time
+# spent waiting for a file to be read is kept as the "read_wait" timer.
+#
+def prefetch_rtl_files(files, count, profiler=None):
+    files = iter(files)
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=count) as executor:
+        for file in itertools.islice(files, count):
+            pending.append((file, executor.submit(read_rtl_file, file)))
+        while pending:
+            file, future = pending.popleft()
+            for next_file in itertools.islice(files, 1):
+                pending.append((next_file,
+                                executor.submit(read_rtl_file, next_file)))
+            if profiler is None:
+                data = future.result()
+            else:
+                with profiler.timer("read_wait"):
+                    data = future.result()
+            yield file, data
+
+
+#
+# fixup_functions_pre()
+#
+# Post process the jump/code_label sequence of a single function, i.e.
+# turn "jump1" entries into "jump" entries for backward jumps, and remove
+# the code labels nobody jumps to.
+#
+# This used to be done with list.index() and list.remove() calls inside
+# loops over the same list, which is quadratic. The result depends on the
+# details of that, i.e. index() returns the first equal entry, and a
+# remove() while iterating skips the next entry. Those semantics are kept
+# here using per label number position maps, see the unit test for the
+# original implementation.
+#
+def fixup_functions_pre(labels):
+    count = len(labels)
+
+    #
+    # Smallest code label number from each position onwards, note that
+    # label numbers are compared as strings, as they always have been.
+    #
+    code_min = [None] * (count + 1)
+    for position in range(count - 1, -1, -1):
+        kind, num = labels[position]
+        code_min[position] = code_min[position + 1]
+        if kind == "code" and (code_min[position] is None or
+                               num < code_min[position]):
+            code_min[position] = num
+
+    first_jump = dict()
+    jump1_positions = dict()
+    for position, (kind, num) in enumerate(labels):
+        if kind == "jump":
+            first_jump.setdefault(num, position)
+        elif kind == "jump1":
+            jump1_positions.setdefault(num, list()).append(position)
+
+    #
+    # 对jump1进行处理, once a jump has a smaller code label following it, the
+    # first remaining "jump1" entries with the same number as the next
+    # "jump1" seen are turned into "jump" entries.
+    #
+    jump1_first = dict()
+    jump_flag = 0
+    index = 0
+    for position in range(count):
+        kind, num = labels[position]
+        if kind == "jump":
+            index = first_jump[num] + 1
+            if code_min[index] is not None and code_min[index] < num:
+                jump_flag = 1
+        elif kind == "jump1" and jump_flag == 1:
+            positions = jump1_positions[num]
+            first = jump1_first.get(num, 0)
+            found = len(positions) - max(first,
+                                         bisect.bisect_left(positions, index))
+            if found > 0:
+                for jump1 in positions[first:first + found]:
+                    labels[jump1] = ("jump", num)
+                first_jump[num] = min(first_jump.get(num, count),
+                                      positions[first])
+                jump1_first[num] = first + found
+                jump_flag = 0
+
+    #
+    # 对code进行删除, the first remaining equal entry is removed, and the
+    # entry following the one being looked at is skipped.
+    #
+    jumps = set(num for kind, num in labels if kind == "jump")
+    remaining = dict()
+    for position, key in enumerate(labels):
+        remaining.setdefault(key, collections.deque()).append(position)
+
+    removed = [False] * count
+    skip = False
+    for key in labels:
+        if skip:
+            skip = False
+            continue
+        if (key[0] == "code" and key[1] not in jumps) or key[0] == "jump1":
+            removed[remaining[key].popleft()] = True
+            skip = True
+
+    labels[:] = [key for key, gone in zip(labels, removed) if not gone]
+    return labels
+
+
+#
+# HandleTracker()
+#
+# Follows, line by line, where the value in the first argument register
+# (di) comes from, so the pthread_t of a pthread_create() and
+# pthread_join() call can be matched. The second one (si) is followed the
+# same way, for the mutex of a pthread_cond_wait(). A create takes the address of the
+# handle, e.g. (plus (reg virtual-stack-vars) (const_int -56)), and a join
+# loads it from the same stack slot, (mem (plus ... (const_int -56))),
+# usually through a pseudo register or two. Within each insn the first set
+# of a pseudo register, or di, is followed, and its source is the first
+# stack slot or symbol in it, or else the first pseudo register it reads.
+# The handle is the symbol's name for a global, or the name of the variable
+# in the stack slot, as found in the memory attributes of any access to it
+# in the function, else "stack" followed by its offset.
+#
+rtl_handle = re.compile(
+    r"\(set \(reg(?:/[a-z]+)*:DI (?P<dest>\d+)(?: (?P<hard>[a-z]\w*))?[ )]|"
+    r"(?P<stack>virtual-stack-vars\))|"
+    r"\(const_int (?P<offset>-?\d+)|"
+    r"\(reg(?:/[a-z]+)*:DI (?P<reg>\d+)(?:\)| \[)|"
+    r"\(symbol_ref:DI \(\"(?P<symbol>[^\"]+)\"\)|"
+    r"\[\d+ (?P<name>[A-Za-z_][\w.]*)(?:\+\d+)? S\d+")
+
+
+class HandleTracker(object):
+    def __init__(self):
+        self.reset()
+
+    #
+    # reset(), forget all registers and stack slot names, for a new function
+    #
+    def reset(self):
+        self.registers = dict()
+        self.names = dict()
+        self.di = None
+        self.si = None
+        self.start_insn()
+
+    #
+    # end_insn(), record the source of the register set by the insn
+    #
+    def end_insn(self):
+        if self.dest is not None:
+            source = self.slot or self.symbol or \
+                self.registers.get(self.source)
+            if self.dest == "di":
+                self.di = source
+            elif self.dest == "si":
+                self.si = source
+            else:
+                self.registers[self.dest] = source
+        self.start_insn()
+
+    def start_insn(self):
+        self.dest = None
+        self.slot = None
+        self.symbol = None
+        self.source = None
+        self.stack = False
+        self.last_slot = None
+        self.done = False
+
+    #
+    # track(), process a single line
+    #
+    def track(self, line):
+        if line[:1] == "(":
+            self.end_insn()
+        if self.done or "(" not in line:
+            return
+        if self.dest is None:
+            #
+            # Only insns setting a DImode register are followed.
+            #
+            if ":DI " not in line or "(set (reg" not in line:
+                if "(set" in line:
+                    self.done = True
+                return
+        elif "(expr_list" in line:
+            self.done = True
+            return
+        for match in rtl_handle.finditer(line):
+            kind = match.lastgroup
+            if kind == "dest" or kind == "hard":
+                if self.dest is None:
+                    hard = match.group("hard")
+                    if hard is None:
+                        self.dest = match.group("dest")
+                    elif hard == "di" or hard == "si":
+                        self.dest = hard
+                    else:
+                        self.done = True
+                        return
+            elif kind == "stack":
+                self.stack = True
+            elif kind == "offset":
+                if self.stack:
+                    self.stack = False
+                    self.last_slot = "stack" + match.group("offset")
+                    if self.dest is not None and self.slot is None:
+                        self.slot = self.last_slot
+            elif kind == "name":
+                if self.last_slot is not None:
+                    self.names.setdefault(self.last_slot, match.group("name"))
+                    self.last_slot = None
+            elif self.dest is not None:
+                if kind == "reg":
+                    if self.source is None:
+                        self.source = match.group("reg")
+                elif self.symbol is None:
+                    self.symbol = match.group("symbol")
+
+    #
+    # handle(), the name of a handle found
+    #
+    def handle(self, source):
+        return self.names.get(source, source)
+
+
+#
+# RtlScanner()
+#
+# Single pass RTL scanner. Lines are fed in file order, classified by
+# classify_line(), and the resulting tokens are buffered until the next
+# ";; Function" header is seen. The buffered function body is then first
+# scanned for its jump/code_label sequence (functions_pre), which drives
+# the if/while/switch state machine over the same tokens. This way each
+# RTL file is only read once, each line is only classified once, and only
+# one function's worth of tokens is kept in memory.
+#
+class RtlScanner(object):
+    def __init__(self, functions, **kwargs):
+        self.functions = functions
+        self.functions_pre = kwargs.get("functions_pre", dict())
+        self.no_warnings = kwargs.get("no_warnings", False)
+
+        #
+        # If a list is given, calls to functions not (yet) known are
+        # recorded as (function, target, name, plain name) tuples, so they
+        # can be renamed once the function turns out to be defined in an
+        # earlier file, see merge_functions().
+        #
+        self.unresolved = kwargs.get("unresolved", None)
+
+        #
+        # If a Counter is given, the lines scanned, the function headers,
+        # and the matches per rtl_token construct are counted in it.
+        #
+        self.stats = kwargs.get("stats", None)
+
+        self.function_name = ""
+        self.tokens = list()
+        self.task_set = False
+        self.handles = HandleTracker()
+
+        #
+        # Pre-scan state, jump_1 -> jump_2 -> jump_3
+        #
+        self.jump_state = 1
+
+        #
+        # Main scan state, these are kept across functions just like the
+        # original two pass implementation did. A new scanner is used for
+        # each file, so no state leaks from one file into the next.
+        #
+        self.state = dict(state_1=1, state_2=0, state_3=1, state_4=0,
+                          state_5=0, state_6=0, state_7=0,
+                          switch_count=0, state_count=0, count=0, flag=0,
+                          mytarget="", thread_num="")
+
     #
-    for func in sorted(functions.keys()):
-        printed_functions = 1
-        pre = func
-        if exclude is None or \
-                re.match(exclude, func) is None:
+    # scan(), feed all lines of a single RTL file
+    #
+    def scan(self, lines, filename):
+        if self.stats is not None:
+            lines = self.count_lines(lines)
 
-            for caller in functions[func]["mycalls"]:
-                if (not no_externs or caller in functions) and \
-                        (exclude is None or
-                         re.match(exclude, caller) is None):
-                    join_search = re.search(myjoin, caller)
-                    if join_search is not None:
-                        myg_thread = functions[func]["myinfo"][caller]
-                        myg_task = functions[func]["myinfo"][myg_thread]
-                        myg_tail = functions[myg_task]["myinfo"]["tail"]
-                        print_buf(std_buf, '"{}" -> "{}";'.format(myg_tail, caller))
+        tokens = self.tokens
+        task_set = self.task_set
+        handles = self.handles
+        track = handles.track
+        for line in lines:
+            if line.startswith(";; Function"):
+                match = function.match(line)
+                if match is not None:
+                    self.tokens = tokens
+                    self.flush()
+                    tokens = self.tokens
+                    task_set = False
+                    self.start_function(match.group("function"), filename)
+                    continue
 
+            #
+            # Irrelevant lines are not buffered, except for the line
+            # following a task set, as that one gets consumed by it. Calls
+            # get the source of their first argument, see HandleTracker().
+            #
+            if line[:1] == "(" or handles.dest is not None or "(set" in line:
+                track(line)
+            token = classify_line(line)
+            if token is not None and token.kinds & RTL_CALL:
+                token.handle = handles.di
+                token.mutex = handles.si
+            if task_set:
+                tokens.append(token)
+                task_set = False
+            elif token is not None:
+                tokens.append(token)
+                task_set = token.kinds & RTL_TASK_SET != 0
+        self.tokens = tokens
+        self.task_set = task_set
 
-                    # if caller not in functions:
-                    #     print_buf(std_buf, '"{}" [style=dashed]'.
-                    #               format(caller))
-                    # if "if" in caller:
-                    #     if has_if==0:
-                    #         has_if=1
-                    #     count_if=count_if+1
-                    #     if count_if==1:
-                    #         start_if=pre
-                    #     print_buf(std_buf, '"{}" [style=dashed]'.
-                    #               format(caller))
-                    # else:
-                    #     if has_if==1:
-                    #         has_if=0
-                    #         end_if=caller
-                    #         print_buf(std_buf, '"{}" -> "{}";'.format(start_if, end_if))
-                    #         # print_buf(std_buf, '"{}" [style=dashed]'.
-                    #         #           format(start_if))
-                    #         # print_buf(std_buf, '"{}" [style=dashed]'.
-                    #         #           format(end_if))
-                    #     count_if=0
-                    #     if "while" in caller:
-                    #         print_buf(std_buf, '"{}" [style=dashed]'.
-                    #               format(caller))
-                    #     elif"switch" in caller:
-                    #         print_buf(std_buf, '"{}" [style=dashed]'.
-                    #                   format(caller))
-                    if "if" in caller:
-                        if count_if==0:
-                            count_if=count_if+1
-                            start_if=pre
-                        print_buf(std_buf, '"{}" -> "{}";'.format(pre, caller))
-                        print_buf(std_buf, '"{}" [style=dashed]'.format(caller))
-                    elif "while" in caller:
-                        print_buf(std_buf, '"{}" -> "{}";'.format(pre, caller))
-                        print_buf(std_buf, '"{}" [style=dashed]'.format(caller))
-                    elif "switch" in caller:
-                        if count_switch==0:
-                            count_switch=count_switch+1
-                            start_switch=pre
-                        switch_re_flag=re.search(switch_re,caller)
-                        search_switch="switch"+switch_re_flag.group(1)
-                        if prenum!=switch_re_flag.group(1):
-                            prenum=switch_re_flag.group(1)
-                            preswtich=start_switch
+    #
+    # count_lines(), pass through lines, counting them in stats
+    #
+    def count_lines(self, lines):
+        stats = self.stats
+        for line in lines:
+            stats["lines_scanned"] += 1
+            yield line
+
+    #
+    # finish(), process the last buffered function
+    #
+    def finish(self):
+        self.flush()
+        return self.functions
+
+    #
+    # start_function(), handle a ";; Function" header line
+    #
+    def start_function(self, function_name, filename):
+        functions = self.functions
+        self.state["count"] = 0
+        if self.stats is not None:
+            self.stats["function_definitions"] += 1
+        if function_name in functions:
+            if not self.no_warnings:
+                print_err("WARNING: Function {} defined in multiple"
+                          "files \"{}\"!".
+                          format(function_name,
+                                 ', '.join(map(
+                                     str,
+                                     functions[function_name]["files"] +
+                                     [filename]))))
+        else:
+            functions[function_name] = dict()
+            functions[function_name]["files"] = list()
+            functions[function_name]["calls"] = dict()
+            functions[function_name]["refs"] = dict()
+            functions[function_name]["callee_calls"] = dict()
+            functions[function_name]["callee_refs"] = dict()
+            functions[function_name]["mycalls"] = list()
+            functions[function_name]["myinfo"] = dict()
+            functions[function_name]["threads"] = list()
+            functions[function_name]["syncs"] = list()
+            functions[function_name]["insns"] = dict()
+
+        #
+        # Each definition gets its own label sequence, so also restart
+        # walking it, even if the function was seen before.
+        #
+        functions[function_name]["files"].append(filename)
+        self.functions_pre[function_name] = list()
+        self.handles.reset()
+        self.state["state_count"] = 0
+        self.function_name = function_name
+
+    #
+    # flush(), run both scans over the buffered function body
+    #
+    def flush(self):
+        tokens = self.tokens
+        self.tokens = list()
+        if self.stats is not None:
+            self.count_tokens(tokens)
+        if self.function_name != "":
+            self.pre_scan(tokens, self.functions_pre[self.function_name])
+            fixup_functions_pre(self.functions_pre[self.function_name])
+        self.main_scan(tokens)
+
+    #
+    # count_tokens(), count the matches per construct in stats
+    #
+    def count_tokens(self, tokens):
+        stats = self.stats
+        for token in tokens:
+            if token is None:
+                continue
+            for kind, name in RTL_KIND_NAMES:
+                if token.kinds & kind:
+                    stats["matches." + name] += 1
+
+    #
+    # pre_scan(), collect the jump/code_label sequence of a function
+    #
+    def pre_scan(self, tokens, labels):
+        jump_state = self.jump_state
+        for token in tokens:
+            if token is None:
+                continue
+            kinds = token.kinds
+            if jump_state == 1:
+                if kinds & RTL_JUMP_INSN:
+                    jump_state = 2
+            elif jump_state == 2:
+                if kinds & RTL_IF_THEN_ELSE:
+                    jump_state = 3
+                elif kinds & RTL_LABEL_REF:
+                    labels.append(("jump1", token.label_ref))
+                    jump_state = 1
+            elif jump_state == 3:
+                if kinds & RTL_LABEL_REF:
+                    labels.append(("jump", token.label_ref))
+                    jump_state = 1
+            if kinds & RTL_CODE_LABEL:
+                labels.append(("code", token.code_label))
+        self.jump_state = jump_state
+
+    #
+    # main_scan(), walk the if/while/switch state machine, and collect the
+    # calls, references, thread information and insn counts of a function.
+    #
+    def main_scan(self, tokens):
+        functions = self.functions
+        unresolved = self.unresolved
+        function_name = self.function_name
+        if function_name != "":
+            labels = self.functions_pre[function_name]
+            length = len(labels)
+            insns = functions[function_name]["insns"]
+
+        state = self.state
+        state_1 = state["state_1"]
+        state_2 = state["state_2"]
+        state_3 = state["state_3"]
+        state_4 = state["state_4"]
+        state_5 = state["state_5"]
+        state_6 = state["state_6"]
+        state_7 = state["state_7"]
+        switch_count = state["switch_count"]  # 判断switch分支
+        state_count = state["state_count"]  # 用来计数当前识别到第几个
+        count = state["count"]
+        flag = state["flag"]
+        mytarget = state["mytarget"]
+        thread_num = state["thread_num"]
+
+        token_iter = iter(tokens)
+        for token in token_iter:
+            kinds = token.kinds
+            #分两边识别
+            excuted = 0  # 判断是否执行过第一个判断
+            if function_name != "":
+                if state_count < length:
+                    if state_1 == 1:
+                        condition_code_flag = kinds & RTL_CODE_LABEL
+                        if condition_code_flag:
+                            if token.code_label == labels[state_count][1]:
+                                state_count = state_count + 1
+                                state_1 = 0
+                                state_2 = 1
+                                state_3 = 0
+                    elif state_2 == 1:
+                        condition_jump_flag = kinds & RTL_LABEL_REF
+                        if condition_jump_flag:
+                            if token.label_ref == labels[state_count][1]:
+                                state_count = state_count + 1
+                                state_1 = 1
+                                state_2 = 0
+                                state_3 = 1
+                                excuted = 1
+                    if state_3 == 1 and excuted == 0:
+                        condition_jump_flag = kinds & RTL_LABEL_REF
+                        if condition_jump_flag:
+                            if token.label_ref == labels[state_count][1]:
+                                state_count = state_count + 1
+                                state_4 = 1
+                                state_3 = 0
+                                state_1 = 0
+                    elif state_4 == 1:
+                        condition_code_flag = kinds & RTL_CODE_LABEL
+                        if condition_code_flag:
+                            if token.code_label == labels[state_count][1]:
+                                state_count = state_count + 1
+                                state_4 = 0
+                                state_3 = 1
+                                state_1 = 1  # 识别出是if
                         else:
-                            preswtich=pre
-                        switchlist[start_switch]=dict()
-                        switchlist[start_switch][search_switch]=list()
-                        switchlist[start_switch][search_switch].append(caller)
-                        print_buf(std_buf, '"{}" -> "{}";'.format(start_switch, caller))
-                        print_buf(std_buf, '"{}" [style=dashed]'.format(caller))
-                    else:
-                        if count_if>0:
-                            count_if=0
-                            end_if=caller
-                            print_buf(std_buf, '"{}" -> "{}";'.format(pre, end_if))
-                            print_buf(std_buf, '"{}" -> "{}";'.format(start_if, end_if))
-                        elif count_switch>0:#switch与最后节点相连的元素
-                            end_switch=caller
-                            for key in switchlist[start_switch]:
-                                print_buf(std_buf, '"{}" -> "{}";'.format(key[-1], end_switch))
-                            count_switch=0
-                            prenum=1
+                            condition_jump_flag = kinds & RTL_LABEL_REF
+                            if condition_jump_flag:
+                                if token.label_ref == labels[state_count][1]:
+                                    state_count = state_count + 1
+                                    state_4 = 0
+                                    state_5 = 1  # 识别出事Switch，并且读入了第一个jump
+                                    switch_count = 0
+                    elif state_5 == 1:  # 直到识别到code
+                        condition_jump_flag = kinds & RTL_LABEL_REF  # 把jump读干
+                        if condition_jump_flag:
+                            if token.label_ref == labels[state_count][1]:
+                                state_count = state_count + 1
                         else:
-                            print_buf(std_buf, '"{}" -> "{}";'.format(pre, caller))
-                    printed_functions += 1
-                    pre = caller
-            if printed_functions == 0:
-                print_buf(std_buf, '"{}"'.format(func))
-    print_buf(std_buf, "}")
+                            condition_code_flag = kinds & RTL_CODE_LABEL
+                            if condition_code_flag:
+                                if token.code_label == labels[state_count][1]:
+                                    state_count = state_count + 1
+                                    state_6 = 1
+                                    state_5 = 0
+                    elif state_6 == 1:
+                        condition_jump_flag = kinds & RTL_LABEL_REF  # 如果是jump进入7状态，如果是code则结束
+                        if condition_jump_flag:
+                            if token.label_ref == labels[state_count][1]:
+                                state_count = state_count + 1
+                                state_7 = 1
+                                state_6 = 0
+                                switch_count = switch_count + 1
+                        else:
+                            condition_code_flag = kinds & RTL_CODE_LABEL
+                            if condition_code_flag:
+                                if token.code_label == labels[state_count][1]:
+                                    state_count = state_count + 1
+                                    state_6 = 0
+                                    state_3 = 1
+                                    state_1 = 1
+                                    switch_count = switch_count + 1
+                    elif state_7 == 1:  # 已经读到code，回到6状态
+                        condition_code_flag = kinds & RTL_CODE_LABEL
+                        if condition_code_flag:
+                            if token.code_label == labels[state_count][1]:
+                                state_count = state_count + 1
+                                state_7 = 0
+                                state_6 = 1
+            if flag == 0:
+                if kinds & RTL_THREAD_SET:
+                    flag = 1
+            else:
+                if kinds & RTL_SYMBOL:
+                    thread_num = token.symbol
+                    flag = 0
+                elif kinds & RTL_JOIN_THREAD:
+                    thread_num = token.thread
+                    flag = 0
+                else:
+                    flag += 1
+
+            #
+            # Count the insns and memory references per region, named like
+            # the prefix of the calls in it.
+            #
+            if (kinds & RTL_INSN_KINDS or token.mems) and function_name != "":
+                if state_2 == 1:
+                    region = "while"
+                elif state_4 == 1:
+                    region = "if"
+                elif state_6 == 1:
+                    region = "switch" + str(switch_count)
+                else:
+                    region = ""
+                counts = insns.get(region)
+                if counts is None:
+                    counts = insns[region] = [0, 0, 0, 0]
+                if kinds & RTL_INSN:
+                    counts[0] += 1
+                elif kinds & RTL_CALL_INSN:
+                    counts[1] += 1
+                elif kinds & RTL_JUMP_INSN:
+                    counts[2] += 1
+                counts[3] += token.mems
+
+            # Find direct function calls
+            if kinds & RTL_TASK_SET:
+                #
+                # The task function is on the next line, which is consumed
+                # here, i.e. it's not processed by the code below.
+                #
+                next_token = next(token_iter, None)
+                if next_token is not None and next_token.kinds & RTL_SYMBOL:
+                    mytarget = next_token.symbol
+            if kinds & RTL_CALL:
+                count += 1
+                target = token.target
+                if target == "puts":
+                    target = "printf"
+                elif target == "fwrite":
+                    target = "fprintf"
+                origin_target = target
+                if state_2 == 1:
+                    target = "while/" + target
+                elif state_4 == 1:
+                    target = "if/" + target
+                elif state_6 == 1:
+                    target = "switch" + str(switch_count) + "/" + target
+                if origin_target not in functions:
+                    if unresolved is not None:
+                        unresolved.append((function_name, origin_target,
+                                           function_name + "/" + target +
+                                           str(count), target))
+                    target = function_name + "/" + target + str(count)
+                #
+                # Without a symbol for the thread, or the object of a
+                # synchronization call, the last one found is the called
+                # function itself, i.e. it's unknown. The pthread_t of a
+                # create or join is preferably the one its argument was
+                # tracked back to.
+                #
+                handle = "" if thread_num == origin_target else thread_num
+                if token.handle is not None and \
+                        ("pthread_create" in target or
+                         "pthread_join" in target):
+                    handle = self.handles.handle(token.handle)
+                if 'pthread_create' in target:
+                    functions[function_name]["calls"][mytarget] = True
+                    functions[function_name]["mycalls"].append(target)
+                    functions[function_name]["mycalls"].append(mytarget)
+                    functions[function_name]["myinfo"]["tail"] = mytarget
+                    functions[function_name]["myinfo"][thread_num] = mytarget
+                    functions[function_name]["threads"].append(
+                        ("create", target, handle, mytarget))
+                else:
+                    flag = 0
+                    if 'pthread_join' in target:
+                        flag = 1
+                    functions[function_name]["calls"][origin_target] = True
+                    functions[function_name]["mycalls"].append(target)
+                    functions[function_name]["myinfo"]["tail"] = target
+                    if flag:
+                        functions[function_name]["myinfo"][target] = thread_num
+                        functions[function_name]["threads"].append(
+                            ("join", target, handle, ""))
+                    if origin_target in SYNC_CALLS:
+                        syncs = functions[function_name]["syncs"]
+                        mutex = None
+                        if token.mutex is not None and \
+                                SYNC_CALLS[origin_target] == \
+                                ("acquire", "condvar"):
+                            mutex = self.handles.handle(token.mutex)
+                            syncs.append(("pthread_mutex_unlock", target,
+                                          mutex))
+                        syncs.append((origin_target, target, handle))
+                        if mutex is not None:
+                            syncs.append(("pthread_mutex_lock", target,
+                                          mutex))
+            elif kinds & RTL_SYMBOL_REF:
+                target = token.target
+                if target not in functions[function_name]["refs"]:
+                    functions[function_name]["refs"][target] = True
+
+        state.update(state_1=state_1, state_2=state_2, state_3=state_3,
+                     state_4=state_4, state_5=state_5, state_6=state_6,
+                     state_7=state_7, switch_count=switch_count,
+                     state_count=state_count, count=count, flag=flag,
+                     mytarget=mytarget, thread_num=thread_num)
+
+
+#
+# scan_rtl_file()
+#
+# Parse a single RTL file into its own function database, this is the
+# worker for the --jobs option. Returns the file name, the functions and
+# functions_pre dictionaries, the unresolved call list, and the scanner
+# counters if profile is set.
+#
+def scan_rtl_file(file, use_mmap=False, profile=False):
+    unresolved = list()
+    stats = collections.Counter() if profile else None
+    scanner = RtlScanner(dict(), no_warnings=True, unresolved=unresolved,
+                         stats=stats)
+    scanner.scan(rtl_file_lines(file, use_mmap), file)
+    scanner.finish()
+    return file, scanner.functions, scanner.functions_pre, unresolved, \
+        dict(stats or {})
+
+
+#
+# Parse cache
+#
+# The result of scan_rtl_file() is stored per RTL file in the --cache-dir
+# directory, in a pickle file named after the hash of the file's absolute
+# path. An entry is used as is if the file's size and modification time
+# did not change, if they did the content hash decides. Bump the version
+# whenever the scanner's output changes.
+#
+CACHE_VERSION = 7
+
+
+#
+# rtl_file_hash()
+#
+def rtl_file_hash(file):
+    digest = hashlib.sha1()
+    with open(file, "rb") as rtl_file:
+        for chunk in iter(lambda: rtl_file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+#
+# load_rtl_file()
+#
+# Same as scan_rtl_file(), but uses the parse cache if a directory is
+# given. Returns the result, and the cache status, i.e. "hit",
+# "revalidated", "miss", or None if no cache is used.
+#
+def load_rtl_file(file, cache_dir=None, use_mmap=False, profile=False):
+    if cache_dir is None:
+        return scan_rtl_file(file, use_mmap, profile), None
+
+    path = os.path.abspath(file)
+    file_stat = os.stat(file)
+    cache_file = os.path.join(
+        cache_dir, hashlib.sha1(path.encode("utf-8")).hexdigest() + ".pickle")
+
+    try:
+        with open(cache_file, "rb") as cache:
+            entry = pickle.load(cache)
+        if entry["version"] != CACHE_VERSION or entry["path"] != path:
+            entry = None
+    except Exception:
+        entry = None
+
+    status = "miss"
+    content_hash = None
+    if entry is not None:
+        if entry["size"] == file_stat.st_size and \
+                entry["mtime"] == file_stat.st_mtime_ns:
+            status = "hit"
+        else:
+            content_hash = rtl_file_hash(file)
+            if entry["hash"] == content_hash:
+                status = "revalidated"
+
+    if status == "miss":
+        if content_hash is None:
+            content_hash = rtl_file_hash(file)
+        result = scan_rtl_file(file, use_mmap, profile)
+    else:
+        result = entry["result"]
+        #
+        # The file might have been given under another (relative) name
+        #
+        if result[0] != file:
+            for finfo in result[1].values():
+                finfo["files"] = [file] * len(finfo["files"])
+            result = (file,) + result[1:]
+        if status == "hit":
+            return result, status
+
+    entry = dict(version=CACHE_VERSION, path=path, size=file_stat.st_size,
+                 mtime=file_stat.st_mtime_ns, hash=content_hash, result=result)
+    tmp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+    try:
+        with open(tmp_file, "wb") as cache:
+            pickle.dump(entry, cache, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print_err("WARNING: Can't write cache file, \"{}\" -> \"{}\"!".
+                  format(cache_file, e))
+
+    return result, status
+
+
+#
+# merge_functions()
+#
+# Merge the result of scan_rtl_file() into the global function database.
+# This needs to be done in the same order as the files are given on the
+# command line, as this determines which definition comes first. If
+# only part of the functions is merged, defined tells if a function is
+# defined in an earlier file.
+#
+def merge_functions(functions, functions_pre, result, **kwargs):
+    no_warnings = kwargs.get("no_warnings", False)
+    defined = kwargs.get("defined", functions.__contains__)
+    file, file_functions, file_functions_pre, unresolved, stats = result
+
+    #
+    # Calls to functions defined in an earlier file are not prefixed with
+    # the caller's name, so rename them now we know.
+    #
+    for function_name, target, name, plain_name in unresolved:
+        if not defined(target):
+            continue
+        finfo = file_functions[function_name]
+        mycalls = finfo["mycalls"]
+        mycalls[mycalls.index(name)] = plain_name
+        myinfo = finfo["myinfo"]
+        if name in myinfo:
+            myinfo[plain_name] = myinfo.pop(name)
+        if myinfo.get("tail") == name:
+            myinfo["tail"] = plain_name
+        finfo["threads"] = [
+            (kind, plain_name if site == name else site, handle, task)
+            for kind, site, handle, task in finfo["threads"]]
+        finfo["syncs"] = [
+            (call, plain_name if site == name else site, sync_object)
+            for call, site, sync_object in finfo["syncs"]]
+
+    for function_name, finfo in file_functions.items():
+        if function_name not in functions:
+            functions[function_name] = finfo
+            files = finfo["files"]
+            finfo["files"] = files[:1]
+            files = files[1:]
+        else:
+            files = finfo["files"]
+            gfinfo = functions[function_name]
+            gfinfo["calls"].update(finfo["calls"])
+            gfinfo["refs"].update(finfo["refs"])
+            gfinfo["mycalls"].extend(finfo["mycalls"])
+            gfinfo["myinfo"].update(finfo["myinfo"])
+            gfinfo["threads"].extend(finfo["threads"])
+            gfinfo["syncs"].extend(finfo["syncs"])
+            for region, counts in finfo["insns"].items():
+                gcounts = gfinfo["insns"].setdefault(region, [0, 0, 0, 0])
+                for index, count in enumerate(counts):
+                    gcounts[index] += count
+
+        for filename in files:
+            if not no_warnings:
+                print_err("WARNING: Function {} defined in multiple"
+                          "files \"{}\"!".
+                          format(function_name,
+                                 ', '.join(map(
+                                     str,
+                                     functions[function_name]["files"] +
+                                     [filename]))))
+            functions[function_name]["files"].append(filename)
+
+    functions_pre.update(file_functions_pre)
+
+
+#
+# add_query_arguments()
+#
+# Add the options selecting the call graph to generate, these are shared
+# by the command line and the --serve queries.
+#
+def add_query_arguments(parser):
+    parser.add_argument("--callee",
+                        help="Callgraph for the function being called",
+                        type=str, metavar="FUNCTION", action='append')
+    parser.add_argument("--caller",
+                        help="Callgraph for functions being called by",
+                        type=str, metavar="FUNCTION", action='append')
+    parser.add_argument("--reach",
+                        help="Callgraph of all functions reachable from",
+                        type=str, metavar="FUNCTION")
+    parser.add_argument("--path-between",
+                        help="Shortest call chain from one function to the "
+                        "other",
+                        type=str, metavar="FUNCTION", nargs=2)
+    parser.add_argument("--locks",
+                        help="Add the mutex, semaphore and condition "
+                        "variable operations, and the critical sections "
+                        "between them, to the full callgraph",
+                        action="store_true")
+    parser.add_argument("--weights",
+                        help="Label the functions in the full callgraph "
+                        "with their RTL insn and memory reference counts",
+                        action="store_true")
+    parser.add_argument("--hot-paths",
+                        help="Only show the K most expensive call chains of "
+                        "the caller callgraph, where calls in loops are "
+                        "weighted by --trip-count",
+                        type=int, metavar="K")
+    parser.add_argument("--trip-count", metavar="N",
+                        help="Estimated number of iterations of a loop for "
+                        "--hot-paths, default 10",
+                        type=int, default=10)
+    parser.add_argument("--condense",
+                        help="Collapse recursive functions into a single "
+                        "node, for the full, caller or callee callgraph",
+                        action="store_true")
+    parser.add_argument("--unique-edges",
+                        help="Write each edge of the caller or callee "
+                        "callgraph once, instead of once for every path",
+                        action="store_true")
+    parser.add_argument("-e", "--exclude",
+                        help="RegEx for functions to exclude, can be given "
+                        "multiple times",
+                        type=str, metavar="REGEX", action='append')
+    parser.add_argument("--exclude-function",
+                        help="Function to exclude, can be given multiple "
+                        "times",
+                        type=str, metavar="FUNCTION", action='append')
+    parser.add_argument("--no-externs",
+                        help="Do not show external functions",
+                        action="store_true")
+    parser.add_argument("--max-depth", metavar="DEPTH",
+                        help="Maximum tree depth traversal, default no depth",
+                        type=int, default=0)
+
+
+#
+# check_query_options(), returns False if the options selecting the call
+# graph are not valid, after reporting the error.
+#
+def check_query_options(config):
+    if len([option for option in (config.caller, config.callee,
+                                  config.reach, config.path_between)
+            if option]) > 1:
+        print_err("ERROR: Only one of the --caller, --callee, --reach or "
+                  "--path-between options should be given!")
+        return False
+
+    for exclude in config.exclude or []:
+        try:
+            re.compile(exclude)
+        except Exception as e:
+            print_err("ERROR: Invalid --exclude regular expression, "
+                      "\"{}\" -> \"{}\"!".
+                      format(exclude, e))
+            return False
+
+    if config.condense and (config.reach or config.path_between):
+        print_err("ERROR: The --condense option is not valid with --reach "
+                  "or --path-between!")
+        return False
+
+    if config.locks and (config.caller or config.callee or config.reach or
+                         config.path_between or config.condense):
+        print_err("ERROR: The --locks option is only valid for the full "
+                  "callgraph!")
+        return False
+
+    if config.weights and (config.caller or config.callee or
+                           config.reach or config.path_between or
+                           config.condense):
+        print_err("ERROR: The --weights option is only valid for the full "
+                  "callgraph!")
+        return False
+
+    if config.hot_paths is not None and (not config.caller or
+                                         config.condense or
+                                         config.unique_edges):
+        print_err("ERROR: The --hot-paths option is only valid with "
+                  "--caller, without --condense or --unique-edges!")
+        return False
+
+    if config.hot_paths is not None and config.hot_paths < 1:
+        print_err("ERROR: The --hot-paths option needs at least one call "
+                  "chain!")
+        return False
+
+    if config.trip_count < 1:
+        print_err("ERROR: The --trip-count option needs at least one "
+                  "iteration!")
+        return False
+
+    if config.unique_edges and not config.caller and not config.callee:
+        print_err("ERROR: The --unique-edges option is only valid with "
+                  "--caller or --callee!")
+        return False
+
+    if not config.caller and not config.callee and not config.reach and \
+            config.max_depth:
+        print_err("ERROR: The --max_depth option is only valid with "
+                  "--caller, --callee or --reach!")
+        return False
+
+    return True
+
+
+#
+# query_exclude(), returns the ExcludeFilter for the query, if any
+#
+def query_exclude(config):
+    if config.exclude or config.exclude_function:
+        return ExcludeFilter(config.exclude, config.exclude_function)
+    return None
 
 
 #
 # Main()
 #
 def main():
-    #
-    # Data sets
-    #
-    functions = dict()
-
     #
     # Command line argument parsing
     #
@@ -644,28 +4847,83 @@ def main():
                         help="Dump functions name(s)",
                         type=str, default="&None", const="&all",
                         action='store', nargs='?')
-    parser.add_argument("--callee",
-                        help="Callgraph for the function being called",
-                        type=str, metavar="FUNCTION", action='append')
-    parser.add_argument("--caller",
-                        help="Callgraph for functions being called by",
-                        type=str, metavar="FUNCTION", action='append')
-    parser.add_argument("-e", "--exclude",
-                        help="RegEx for functions to exclude",
-                        type=str, metavar="REGEX")
-    parser.add_argument("--no-externs",
-                        help="Do not show external functions",
+    add_query_arguments(parser)
+    parser.add_argument("--threads",
+                        help="Show the threads created, where they are "
+                        "joined, and which of them run after or alongside "
+                        "each other",
+                        action="store_true")
+    parser.add_argument("--schedule", metavar="FUNCTION",
+                        help="Analyze the task graph of the threads created "
+                        "from FUNCTION, i.e. its work, critical path, "
+                        "parallelism, and list scheduling on the cores",
+                        type=str)
+    parser.add_argument("--cores", metavar="N",
+                        help="Number of cores for --schedule, default the "
+                        "number of CPUs",
+                        type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--cost-file", metavar="CSV",
+                        help="Cost of each function or call site for "
+                        "--schedule, as name,cost lines, default 1",
+                        type=str)
+    parser.add_argument("--static-cost",
+                        help="Use the RTL insn and memory reference counts "
+                        "as the cost of each function for --schedule, "
+                        "unless given in the --cost-file",
                         action="store_true")
     parser.add_argument("--no-warnings",
                         help="Do not show warnings on the console",
                         action="store_true")
-    parser.add_argument("--max-depth", metavar="DEPTH",
-                        help="Maximum tree depth traversal, default no depth",
+    parser.add_argument("-j", "--jobs", metavar="N",
+                        help="Number of processes used to parse the RTL "
+                        "files, default 1",
+                        type=int, default=1)
+    parser.add_argument("--cache-dir", metavar="DIR",
+                        help="Directory to cache parsed RTL files in",
+                        type=str)
+    parser.add_argument("--mmap",
+                        help="Memory map the RTL files, and only decode the "
+                        "lines of interest",
+                        action="store_true")
+    parser.add_argument("--prefetch", metavar="N",
+                        help="Read up to N RTL files ahead, in background "
+                        "threads, while parsing, default 0",
                         type=int, default=0)
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help="Write the .dot output to FILE, default stdout",
+                        type=str)
+    parser.add_argument("--gzip",
+                        help="Compress the .dot output, default when the "
+                        "output FILE ends in .gz",
+                        action="store_true", default=None)
+    parser.add_argument("--profile-out", metavar="FILE",
+                        help="Write the stage timers and counters to FILE "
+                        "as JSON",
+                        type=str)
+    parser.add_argument("--cprofile-out", metavar="FILE",
+                        help="Run under cProfile, and write its statistics "
+                        "to FILE",
+                        type=str)
+    parser.add_argument("--save-db", metavar="FILE",
+                        help="Save the function database to FILE, instead "
+                        "of generating a callgraph",
+                        type=str)
+    parser.add_argument("--load-db", metavar="FILE",
+                        help="Load the function database from FILE, "
+                        "instead of parsing RTL files",
+                        type=str)
+    parser.add_argument("--serve", metavar="SOCKET",
+                        help="Keep running, and answer call graph queries "
+                        "on the Unix SOCKET, parsing changed RTL files again",
+                        type=str)
+    parser.add_argument("--poll-interval", metavar="SECONDS",
+                        help="Interval to check the RTL files for changes "
+                        "with --serve, default 1",
+                        type=float, default=1.0)
     parser.add_argument("--unit-test", help=argparse.SUPPRESS,
                         action="store_true")
 
-    parser.add_argument("RTLFILE", help="GCCs RTL .expand file", nargs="+")
+    parser.add_argument("RTLFILE", help="GCCs RTL .expand file", nargs="*")
 
     parser.parse_args()
     config = parser.parse_args()
@@ -676,387 +4934,148 @@ def main():
     if config.unit_test:
         return unit_test()
 
+    if not config.RTLFILE and config.load_db is None:
+        parser.error("the following arguments are required: RTLFILE")
+
+    if config.RTLFILE and config.load_db is not None:
+        parser.error("argument RTLFILE: not allowed with argument --load-db")
+
     #
     # Additional option checks
     #
-    if config.caller and config.callee:
-        print_err("ERROR: Either --caller or --callee option should be given, "
-                  "not both!")
+    if not check_query_options(config):
+        return 1
+
+    exclude = query_exclude(config)
+
+    if (config.threads or config.schedule) and \
+            (config.caller or config.callee or config.reach or
+             config.path_between or config.condense):
+        print_err("ERROR: The --threads and --schedule options can't be "
+                  "used with a callgraph query!")
         return 1
 
-    if config.exclude is not None:
+    if config.cores < 1:
+        print_err("ERROR: The --cores option needs at least one core!")
+        return 1
+
+    if config.jobs < 1:
+        print_err("ERROR: The --jobs option needs at least one process!")
+        return 1
+
+    if config.prefetch < 0:
+        print_err("ERROR: The --prefetch option needs a positive number of "
+                  "files!")
+        return 1
+
+    if config.prefetch > 0 and (config.jobs > 1 or
+                                config.cache_dir is not None):
+        print_err("ERROR: The --prefetch option can't be used with --jobs "
+                  "or --cache-dir!")
+        return 1
+
+    if config.cache_dir is not None:
         try:
-            exclude_regex = re.compile(config.exclude)
-        except Exception as e:
-            print_err("ERROR: Invalid --exclude regular expression, "
-                      "\"{}\" -> \"{}\"!".
-                      format(config.exclude, e))
+            os.makedirs(config.cache_dir, exist_ok=True)
+        except OSError as e:
+            print_err("ERROR: Can't create cache directory, \"{}\" -> "
+                      "\"{}\"!".format(config.cache_dir, e))
             return 1
-    else:
-        exclude_regex = None
 
-    if not config.caller and not config.callee and config.max_depth:
-        print_err("ERROR: The --max_depth option is only valid with "
-                  "--caller or --callee!")
+    if config.serve is not None and config.load_db is not None:
+        print_err("ERROR: The --serve option needs RTL files, not --load-db!")
+        return 1
+
+    if config.serve is not None and not hasattr(socket, "AF_UNIX"):
+        print_err("ERROR: The --serve option needs Unix socket support!")
+        return 1
+
+    if config.poll_interval <= 0:
+        print_err("ERROR: The --poll-interval option needs a positive "
+                  "interval!")
         return 1
 
     #
-    # Check if all files exist
+    # Check if all files exist, and can be decompressed if needed
     #
     for file in config.RTLFILE:
         if not os.path.isfile(file) or not os.access(file, os.R_OK):
             print_err("ERROR: Can't open rtl file, \"{}\"!".format(file))
             return 1
+        compression = rtl_file_compression(file)
+        if compression is not None and compression[2] is None:
+            print_err("ERROR: Can't read {} compressed rtl file, \"{}\", "
+                      "the Python module is not available!".
+                      format(compression[0], file))
+            return 1
 
     #
-    # Regex to extract functions
-    #
-    function = re.compile(
-        r"^;; Function (?P<mangle>.*)\s+\((?P<function>\S+)(,.*)?\).*$")
-    call = re.compile(
-        r"^.*\(call.*\"(?P<target>.*)\".*$")
-    symbol_ref = re.compile(r"^.*\(symbol_ref.*\"(?P<target>.*)\".*$")
-    mytaskset = re.compile(r".*\(set\s+\(reg:DI\s+1\s+dx\)")
-    mytask = re.compile(r".*\(symbol_ref:DI \(\"(?P<target>.*?)\"[^\"]*\)")
-    mythreadset = re.compile(r".*\(set\s+\(reg:DI\s+5\s+di\)")
-    mythread = re.compile(r".*\(symbol_ref:DI \(\"(?P<target>.*?)\"\)")
-    myjointhread = re.compile(r".*\(reg:DI \d+ \[ (thread\d*).*\]")
-    condition_myjump = re.compile(r"\(jump_insn\s+(\d+)")
-    condition_if = re.compile(r".*\(if_then_else")
-    condition_jump = re.compile(r".*\(label_ref\s+(\d+)")
-    condition_barrier = re.compile(r"\(barrier")
-    condition_code = re.compile(r"\(code_label\s+(\d+)")
-    exist = 0  # 是否出现条件标志,初始状态为1
-    exist_flag = 0  # 条件标志位为0代表while循环，条件标志位1代表if条件
-    jump_flag=0#用来判断上次是不是出现jump了
-    if_flag=0#用来判断上次是不是出现if——then了
-    barrier_flag=0#判断上一行是否出现了barrier
-    #状态标志
-    jump_1=1
-    jump_2=0
-    jump_3=0
-    jump_4=0
-    #
-    # Parse each line in each file given
-    #
-    functions_pre=dict()
-    #预读模块
-    for line in fileinput.input(config.RTLFILE):
-        match = re.match(function, line)
-        if match is not None:
-            function_name = match.group("function")
-            if function_name in functions:#说明重复定义了，正确代码只执行else
-                if not config.no_warnings:#是否打印报错信息
-                    print_err("WARNING: Function {} defined in multiple"
-                              "files \"{}\"!".
-                              format(function_name,
-                                     ', '.join(map(
-                                         str,
-                                         functions[function_name]["files"] +
-                                         [fileinput.filename()]))))
-            else:
-                functions_pre[function_name] = list()
-        else:
-            if jump_1==1:
-                condition_myjump_flag=re.match(condition_myjump,line)
-                if condition_myjump_flag is not None:
-                    jump_2=1
-                    jump_1=0
-            elif jump_2==1:
-                condition_if_flag=re.match(condition_if,line)
-                if condition_if_flag is not None:
-                    jump_3=1
-                    jump_2=0
-                else:
-                    condition_jump_flag = re.match(condition_jump, line)
-                    if condition_jump_flag is not None:
-                        num = condition_jump_flag.group(1)
-                        functions_pre[function_name].append(("jump1", num))
-                        jump_2 = 0
-                        jump_1 = 1
-            elif jump_3==1:
-                condition_jump_flag=re.match(condition_jump,line)
-                if condition_jump_flag is not None:
-                    num=condition_jump_flag.group(1)
-                    functions_pre[function_name].append(("jump",num))
-                    jump_3=0
-                    jump_1=1
-            condition_code_flag=re.match(condition_code,line)
-            if condition_code_flag is not None:
-                    num=condition_code_flag.group(1)
-                    functions_pre[function_name].append(("code",num))
-    #对预读模块进行处理
-    #对jump1进行处理
-    jump_flag=0
-    for functions_pre_name in functions_pre:
-        jump_flag=0
-        for key in functions_pre[functions_pre_name]:
-            if key[0]=="jump":
-                index=functions_pre[functions_pre_name].index(key)+1
-                for key_test in functions_pre[functions_pre_name][index:]:
-                    if key_test[0]=="code" and key_test[1]<key[1]:
-                        jump_flag=1
-            if key[0]=="jump1" and jump_flag==1:
-                for key_test in functions_pre[functions_pre_name][index:]:
-                    if key_test[0]=="jump1" and key_test[1]==key[1]:
-                        newindex=functions_pre[functions_pre_name].index(key_test)
-                        functions_pre[functions_pre_name][newindex]=("jump",key_test[1])
-                        jump_flag=0
-
-    #对code进行删除
-    key_exist=0
-    for functions_pre_name in functions_pre:
-        for key in functions_pre[functions_pre_name]:
-            if key[0]=="code":
-                key_exist=0
-                for key_test in functions_pre[functions_pre_name]:
-                    if key_test[0]=="jump" and key_test[1]==key[1]:
-                        key_exist=1
-                if key_exist==0:
-                    functions_pre[functions_pre_name].remove(key)
-            elif key[0]=="jump1":
-                functions_pre[functions_pre_name].remove(key)
-
-    def next_line_generator():
-        # 使用 fileinput.input() 打开文件并创建迭代器
-        with fileinput.input(files=config.RTLFILE) as file:
-            for line in file:
-                yield line
-                # 由于fileinput.input()返回的是一个迭代器，我们尝试预读取下一行
-                try:
-                    next_line = next(file)
-                except StopIteration:
-                    # 没有下一行了
-                    next_line = None
-                else:
-                    # 如果读取下一行成功，暂存它并在下一次迭代中产生
-                    yield next_line
-
-    # 使用生成器获取下一行
-    next_line_gen = next_line_generator()
-
-    function_name = ""
-    mytarget = ""
-    thread_num = ""
-    start_time = time.time()
-    flag = 0
-    state_1=1
-    state_2=0
-    state_3=1
-    state_4=0
-    state_5=0
-    state_6=0
-    state_7=0
-    state_8=0
-    state_9=0
-    switch_count=0#判断switch分支
-    excuted=0#判断是否执行过第一个判断
-    state_count=0  #用来计数当前识别到第几个
-    for line in next_line_gen:
-        #
-        # Find function entry point
-        #
-        match = re.match(function, line)
-        if match is not None:
-            count = 0
-            function_name = match.group("function")
-            if function_name in functions:
-                if not config.no_warnings:
-                    print_err("WARNING: Function {} defined in multiple"
-                              "files \"{}\"!".
-                              format(function_name,
-                                     ', '.join(map(
-                                         str,
-                                         functions[function_name]["files"] +
-                                         [fileinput.filename()]))))
-            else:
-                functions[function_name] = dict()
-                functions[function_name]["files"] = list()
-                functions[function_name]["calls"] = dict()
-                functions[function_name]["refs"] = dict()
-                functions[function_name]["callee_calls"] = dict()
-                functions[function_name]["callee_refs"] = dict()
-                functions[function_name]["mycalls"] = list()
-                functions[function_name]["myinfo"] = dict()
-                state_count=0
-
-            functions[function_name]["files"].append(fileinput.filename())
-        #
-        # find thread
-        else:
-            #分两边识别
-            excuted=0
-            if function_name != "":
-                length=functions_pre[function_name].__len__()
-                if state_count < length:
-                    if state_1 == 1:
-                        condition_code_flag = re.match(condition_code, line)
-                        if condition_code_flag is not None:
-                            if condition_code_flag.group(1) == functions_pre[function_name][state_count][1]:
-                                state_count = state_count + 1
-                                state_1 = 0
-                                state_2 = 1
-                                state_3 = 0
-                    elif state_2 == 1:
-                        condition_jump_flag = re.match(condition_jump, line)
-                        if condition_jump_flag is not None:
-                            if condition_jump_flag.group(1) == functions_pre[function_name][state_count][1]:
-                                state_count = state_count + 1
-                                state_1 = 1
-                                state_2 = 0
-                                state_3 = 1
-                                excuted = 1
-                    if state_3 == 1 and excuted == 0:
-                        condition_jump_flag = re.match(condition_jump, line)
-                        if condition_jump_flag is not None:
-                            if condition_jump_flag.group(1) == functions_pre[function_name][state_count][1]:
-                                state_count = state_count + 1
-                                state_4 = 1
-                                # state_5 = 1
-                                state_3 = 0
-                                state_1 = 0
-                    elif state_4 == 1:
-                        condition_code_flag = re.match(condition_code, line)
-                        if condition_code_flag is not None:
-                            if condition_code_flag.group(1) == functions_pre[function_name][state_count][1]:
-                                state_count = state_count + 1
-                                state_4 = 0
-                                # state_5 = 0
-                                state_3 = 1
-                                state_1 = 1#识别出是if
-                        else:
-                            condition_jump_flag=re.match(condition_jump,line)
-                            if condition_jump_flag is not None:
-                                if condition_jump_flag.group(1) == functions_pre[function_name][state_count][1]:
-                                    state_count = state_count + 1
-                                    state_4=0
-                                    state_5=1#识别出事Switch，并且读入了第一个jump
-                                    switch_count=0
-                    elif state_5 == 1:  # 直到识别到code
-                        condition_jump_flag = re.match(condition_jump, line)#把jump读干
-                        if condition_jump_flag is not None:
-                            if condition_jump_flag.group(1) == functions_pre[function_name][state_count][1]:
-                                state_count = state_count + 1
-                        else:
-                            condition_code_flag = re.match(condition_code, line)
-                            if condition_code_flag is not None:
-                                if condition_code_flag.group(1) == functions_pre[function_name][state_count][1]:
-                                    state_count = state_count + 1
-                                    state_6=1
-                                    state_5=0
-                    elif state_6 == 1:
-                        condition_jump_flag = re.match(condition_jump, line)#如果是jump进入7状态，如果是code则结束
-                        if condition_jump_flag is not None:
-                            if condition_jump_flag.group(1) == functions_pre[function_name][state_count][1]:
-                                state_count = state_count + 1
-                                state_7 = 1
-                                state_6 = 0
-                                switch_count=switch_count+1
-                        else:
-                            condition_code_flag = re.match(condition_code, line)
-                            if condition_code_flag is not None:
-                                if condition_code_flag.group(1) == functions_pre[function_name][state_count][1]:
-                                    state_count = state_count + 1
-                                    state_6 = 0
-                                    state_3 = 1
-                                    state_1 = 1
-                                    switch_count=switch_count+1
-                    elif state_7==1:#已经读到code，回到6状态
-                        condition_code_flag = re.match(condition_code, line)
-                        if condition_code_flag is not None:
-                            if condition_code_flag.group(1) == functions_pre[function_name][state_count][1]:
-                                state_count = state_count + 1
-                                state_7=0
-                                state_6=1
-            if flag == 0:
-                match_mythreadset = re.match(mythreadset, line)
-                if match_mythreadset is not None:
-                    flag = 1;
-            else:
-                match_mythread = re.match(mythread, line)
-                if match_mythread is not None:
-                    thread_num = match_mythread.group("target")
-                    flag = 0;
-                else:
-                    match_mythread = re.match(myjointhread, line)
-                    if match_mythread is not None:
-                        thread_num = match_mythread.group(1)
-                        flag = 0;
-                    else:
-                        flag += 1
+    # Run, optionally under cProfile, and report the profile data
+    #
+    profiler = Profiler(enabled=config.debug or
+                        config.profile_out is not None)
+    if config.serve is not None:
+        return CallGraphServer(config, profiler).serve(config.serve)
 
-            # Find direct function calls
-            match_mytaskset = re.match(mytaskset, line)
-            if match_mytaskset is not None:
-                try:
-                    next_line = next(next_line_gen)  # 获取下一行
-                    match_mytask = re.match(mytask, next_line)
-                    if match_mytask is not None:
-                        mytarget = match_mytask.group("target")
-                except StopIteration:
-                    next_line = None  # 文件结束，没有下一行
-            match = re.match(call, line)
-            if match is not None:
-                count += 1
-                target = match.group("target")
-                if target=="puts":
-                    target="printf"
-                elif target=="fwrite":
-                    target="fprintf"
-                origin_target=target
-                # if exist==1:
-                #     if exist_flag==0:
-                #         target="while/"+target
-                #     elif exist_flag==1:
-                #         target="if/"+target
-                if state_2==1:
-                    target = "while/" + target
-                elif state_4==1:
-                    target = "if/" + target
-                elif state_6==1:
-                    target="switch"+str(switch_count)+"/"+target
-                # elif state_7==1:
-                #     switch_count=switch_count+1
-                if origin_target not in functions:
-                    target = function_name + "/" + target + str(count)
-                if 'pthread_create' in target:
-                    functions[function_name]["calls"][mytarget] = True
-                    functions[function_name]["mycalls"].append(target)
-                    functions[function_name]["mycalls"].append(mytarget)
-                    functions[function_name]["myinfo"]["tail"] = mytarget
-                    functions[function_name]["myinfo"][thread_num] = mytarget
-                else:
-                    flag = 0
-                    if 'pthread_join' in target:
-                        flag = 1
-                    functions[function_name]["calls"][origin_target] = True
-                    functions[function_name]["mycalls"].append(target)
-                    functions[function_name]["myinfo"]["tail"] = target
-                    if flag:
-                        functions[function_name]["myinfo"][target] = thread_num
+    if config.cprofile_out is not None:
+        cprofile = cProfile.Profile()
+        try:
+            result = cprofile.runcall(run, config, exclude, profiler)
+        finally:
+            cprofile.dump_stats(config.cprofile_out)
+    else:
+        result = run(config, exclude, profiler)
 
+    if config.debug:
+        profiler.report()
 
-            else:
-                match = re.match(symbol_ref, line)
-                if match is not None:
-                    target = match.group("target")
-                    if target not in functions[function_name]["refs"]:
-                        functions[function_name]["refs"][target] = True
+    if config.profile_out is not None:
+        try:
+            profiler.dump(config.profile_out)
+        except IOError as e:
+            print_err("ERROR: Can't write profile file, \"{}\" -> \"{}\"!".
+                      format(config.profile_out, e.strerror))
+            return 1
 
-    if config.debug:
-        print_dbg("[PERF] Processing {} RTL files took {:.9f} seconds".format(
-            len(config.RTLFILE), time.time() - start_time))
-        print_dbg("[PERF] Found {} functions".format(len(functions)))
-    #
-    # Build callee data
-    #
-    start_time = time.time()
+    return result
 
-    build_callee_info(functions)
 
-    if config.debug:
-        print_dbg("[PERF] Building callee info took {:.9f} seconds".format(
-            time.time() - start_time))
+#
+# run(), parse the RTL files, and generate the requested output
+#
+def run(config, exclude, profiler):
+    if config.load_db is not None:
+        with profiler.timer("load_db"):
+            try:
+                functions = load_function_db(config.load_db)
+            except (IOError, ValueError) as e:
+                print_err("ERROR: Can't load database, \"{}\" -> \"{}\"!".
+                          format(config.load_db,
+                                 getattr(e, "strerror", None) or e))
+                return 1
+        profiler.count("functions_found", len(functions))
+    else:
+        with profiler.timer("parse"):
+            functions = parse_rtl_files(config, profiler)
+        profiler.count("functions_found", len(functions))
+
+        #
+        # Build callee data
+        #
+        with profiler.timer("build_callee_info"):
+            functions = FunctionDB(functions)
+            build_callee_info(functions)
+
+    if config.save_db is not None:
+        with profiler.timer("save_db"):
+            try:
+                save_function_db(functions, config.save_db)
+            except (IOError, ValueError) as e:
+                print_err("ERROR: Can't save database, \"{}\" -> \"{}\"!".
+                          format(config.save_db,
+                                 getattr(e, "strerror", None) or e))
+                return 1
+        return 0
 
     #
     # Dump functions if requested
@@ -1076,13 +5095,192 @@ def main():
                 return 1
         return 0
 
-    start_time = time.time()
+    #
+    # Analyze the task graph if requested
+    #
+    if config.schedule is not None:
+        if config.schedule not in functions:
+            print_err("ERROR: Can't find function \"{}\" in RTL data!".
+                      format(config.schedule))
+            return 1
+        costs = static_costs(functions) if config.static_cost else dict()
+        if config.cost_file is not None:
+            try:
+                costs.update(load_cost_file(config.cost_file))
+            except (IOError, ValueError) as e:
+                print_err("ERROR: Can't read cost file, \"{}\" -> \"{}\"!".
+                          format(config.cost_file,
+                                 getattr(e, "strerror", None) or e))
+                return 1
+        with profiler.timer("schedule"):
+            dag = TaskDAG(functions, config.schedule, costs)
+            dump_schedule(dag, config.cores)
+        profiler.count("task_nodes", len(dag.names))
+        return 0
+
+    #
+    # Dump the thread model if requested
+    #
+    if config.threads:
+        with profiler.timer("thread_model"):
+            model = ThreadModel(functions)
+        profiler.count("threads_found", len(model.threads))
+        dump_thread_model(model)
+        return 0
+
+    with profiler.timer("generate_dot"):
+        try:
+            output = DotWriter(config.output, compress=config.gzip)
+        except IOError as e:
+            print_err("ERROR: Can't open output file, \"{}\" -> \"{}\"!".
+                      format(config.output, e.strerror))
+            return 1
+        try:
+            result = write_call_graph(functions, config, exclude, output,
+                                      profiler)
+        finally:
+            output.close()
+        profiler.count("dot_lines_written", output.written)
+
+    return result
+
+
+#
+# parse_rtl_files()
+#
+# Parse each line in each file given, in a single pass, and return the
+# function database.
+#
+def parse_rtl_files(config, profiler):
+    functions = dict()
+    stats = profiler.counters if profiler.enabled else None
+    if config.jobs > 1 and len(config.RTLFILE) > 1:
+        #
+        # Each file is parsed by a worker process into its own database,
+        # which are merged here in command line order.
+        #
+        functions_pre = dict()
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=config.jobs) as executor:
+            for result, status in executor.map(
+                    load_rtl_file, config.RTLFILE,
+                    itertools.repeat(config.cache_dir),
+                    itertools.repeat(config.mmap),
+                    itertools.repeat(profiler.enabled)):
+                if status is not None:
+                    profiler.count("cache." + status)
+                if status is None or status == "miss":
+                    profiler.update(result[4])
+                merge_functions(functions, functions_pre, result,
+                                no_warnings=config.no_warnings)
+    elif config.cache_dir is not None:
+        functions_pre = dict()
+        for file in config.RTLFILE:
+            result, status = load_rtl_file(file, config.cache_dir,
+                                           config.mmap, profiler.enabled)
+            profiler.count("cache." + status)
+            if status == "miss":
+                profiler.update(result[4])
+            merge_functions(functions, functions_pre, result,
+                            no_warnings=config.no_warnings)
+    else:
+        if config.prefetch > 0:
+            files = prefetch_rtl_files(config.RTLFILE, config.prefetch,
+                                       profiler)
+        else:
+            files = ((file, None) for file in config.RTLFILE)
+        for file, data in files:
+            scanner = RtlScanner(functions, no_warnings=config.no_warnings,
+                                 stats=stats)
+            scanner.scan(rtl_file_lines(file, config.mmap, data=data), file)
+            scanner.finish()
+
+    return functions
+
+
+#
+# write_call_graph()
+#
+# Write the full, callee or caller call graph to output, as requested.
+#
+def write_call_graph(functions, config, exclude, output, profiler):
+    #
+    # Condensed call graph, either full or for the callers or callees
+    #
+    if config.condense:
+        roots = config.caller or config.callee
+        for function in roots or []:
+            if function not in functions:
+                print_err("ERROR: Can't find function \"{}\" in RTL data!".
+                          format(function))
+                return 1
+
+        with profiler.timer("build_index"):
+            index = CallGraphIndex(functions)
+
+        output.write("strict digraph callgraph {")
+        profiler.count("components_written", dump_condensed(
+            index, roots or functions.keys(),
+            reverse_path=bool(config.callee),
+            root_color=bool(roots),
+            max_depth=config.max_depth,
+            exclude=exclude,
+            no_externs=config.no_externs,
+            output=output))
+        output.write("}")
+        return 0
+
     #
     # Dump full call graph
     #
-    if not config.caller and not config.callee:
-        full_call_graph(functions, exclude=config.exclude,
-                        no_externs=config.no_externs)
+    if not config.caller and not config.callee and not config.reach and \
+            not config.path_between:
+        full_call_graph(functions, exclude=exclude,
+                        no_externs=config.no_externs,
+                        locks=config.locks,
+                        weights=config.weights,
+                        output=output)
+
+    #
+    # Queries answered by the reachability index
+    #
+    if config.reach or config.path_between:
+        for function in [config.reach] if config.reach else \
+                config.path_between[:1]:
+            if function not in functions:
+                print_err("ERROR: Can't find function \"{}\" in RTL data!".
+                          format(function))
+                return 1
+
+        with profiler.timer("build_index"):
+            index = CallGraphIndex(functions)
+
+        if config.path_between:
+            source, target = config.path_between
+            path = None
+            if target in index.ids:
+                path = index.shortest_path(source, target, exclude=exclude,
+                                           no_externs=config.no_externs)
+            if path is None:
+                print_err("ERROR: No call path from \"{}\" to \"{}\"!".
+                          format(source, target))
+                return 1
+
+        output.write("strict digraph callgraph {")
+        if config.reach:
+            output.write('"{}" [color=blue, style=filled];'.
+                         format(config.reach))
+            profiler.count("functions_reached", dump_reach(
+                index, config.reach,
+                max_depth=config.max_depth,
+                exclude=exclude,
+                no_externs=config.no_externs,
+                output=output))
+        else:
+            output.write('"{}" [color=blue, style=filled];'.format(source))
+            dump_path_ascii(path, False, output=output,
+                            externs=target not in functions)
+        output.write("}")
 
     #
     # Build callgraph for callee function
@@ -1093,15 +5291,27 @@ def main():
                 print_err("ERROR: Can't find callee \"{}\" in RTL data!".
                           format(callee))
                 return 1
-        print("strict digraph callgraph {")
+        output.write("strict digraph callgraph {")
         for callee in config.callee:
-            print('"{}" [color=blue, style=filled];'.format(callee))
-            dump_path([], functions, callee,
-                      max_depth=config.max_depth,
-                      reverse_path=True,
-                      exclude=exclude_regex,
-                      call_index="callee_calls")
-        print("}")
+            output.write('"{}" [color=blue, style=filled];'.format(callee))
+            if config.unique_edges:
+                profiler.count("edges_written", dump_unique_edges(
+                    functions, callee,
+                    max_depth=config.max_depth,
+                    reverse_path=True,
+                    exclude=exclude,
+                    call_index="callee_calls",
+                    no_externs=config.no_externs,
+                    output=output))
+            else:
+                profiler.count("paths_enumerated", dump_path(
+                    [], functions, callee,
+                    max_depth=config.max_depth,
+                    reverse_path=True,
+                    exclude=exclude,
+                    call_index="callee_calls",
+                    output=output))
+        output.write("}")
 
     #
     # Build callgraph for caller function
@@ -1112,22 +5322,310 @@ def main():
                 print_err("ERROR: Can't find caller \"{}\" in RTL data!".
                           format(caller))
                 return 1
-        print("strict digraph callgraph {")
+        output.write("strict digraph callgraph {")
+        if config.hot_paths is not None:
+            for caller in config.caller:
+                output.write('"{}" [color=blue, style=filled];'.
+                             format(caller))
+            with profiler.timer("hot_paths"):
+                hot_paths = HotPaths(functions, config.caller,
+                                     config.hot_paths,
+                                     trip_count=config.trip_count,
+                                     max_depth=config.max_depth,
+                                     exclude=exclude,
+                                     no_externs=config.no_externs)
+            profiler.count("paths_counted", hot_paths.paths)
+            profiler.count("edges_written",
+                           dump_hot_paths(hot_paths, output=output))
+            output.write("}")
+            return 0
         for caller in config.caller:
-            print('"{}" [color=blue, style=filled];'.format(caller))
-            dump_path([], functions, caller,
-                      max_depth=config.max_depth,
-                      exclude=exclude_regex,
-                      no_externs=config.no_externs)
-        print("}")
-
-    if config.debug:
-        print_dbg("[PERF] Generating .dot file took {:.9f} seconds".format(
-            time.time() - start_time))
+            output.write('"{}" [color=blue, style=filled];'.format(caller))
+            if config.unique_edges:
+                profiler.count("edges_written", dump_unique_edges(
+                    functions, caller,
+                    max_depth=config.max_depth,
+                    exclude=exclude,
+                    no_externs=config.no_externs,
+                    output=output))
+            else:
+                profiler.count("paths_enumerated", dump_path(
+                    [], functions, caller,
+                    max_depth=config.max_depth,
+                    exclude=exclude,
+                    no_externs=config.no_externs,
+                    output=output))
+        output.write("}")
 
     return 0
 
 
+#
+# CallGraphServer()
+#
+# The --serve mode. The RTL files are parsed once, and the parse results are
+# kept in memory per file. The files are polled for changes, and only the
+# changed ones are parsed again. Only the functions defined in them, or
+# calling functions they (no longer) define, are then merged again, and
+# replaced in the function database. Each connection to the Unix socket
+# sends one query line, using the same options as the command line, e.g.
+# "--caller main --max-depth 3", and gets back the .dot output or the error
+# messages.
+#
+class CallGraphServer(object):
+    def __init__(self, config, profiler):
+        self.config = config
+        self.profiler = profiler
+        self.files = list(collections.OrderedDict.fromkeys(config.RTLFILE))
+        self.position = dict((file, position)
+                             for position, file in enumerate(self.files))
+        self.stamps = dict()
+        self.results = dict()
+        self.defines = dict()
+        self.unresolved = dict()
+        self.definitions = dict()
+        self.functions = None
+        self.parser = argparse.ArgumentParser(prog="query", add_help=False)
+        add_query_arguments(self.parser)
+
+    #
+    # refresh(), parse the new or changed RTL files, and update the
+    # function database. Returns True if anything changed.
+    #
+    def refresh(self):
+        stamps = dict()
+        for file in self.files:
+            try:
+                file_stat = os.stat(file)
+                stamps[file] = (file_stat.st_mtime_ns, file_stat.st_size)
+            except OSError:
+                stamps[file] = None
+
+        changed = [file for file, stamp in stamps.items()
+                   if stamp is not None and stamp != self.stamps.get(file)]
+        removed = [file for file, stamp in stamps.items()
+                   if stamp is None and file in self.results]
+        if not changed and not removed:
+            return False
+
+        #
+        # If a file can't be read, e.g. as it's being written, keep the old
+        # stamps, so all changed files are tried again on the next poll.
+        #
+        try:
+            with self.profiler.timer("parse"):
+                if self.config.jobs > 1 and len(changed) > 1:
+                    with concurrent.futures.ProcessPoolExecutor(
+                            max_workers=self.config.jobs) as executor:
+                        loaded = list(executor.map(
+                            load_rtl_file, changed,
+                            itertools.repeat(self.config.cache_dir),
+                            itertools.repeat(self.config.mmap)))
+                else:
+                    loaded = [load_rtl_file(file, self.config.cache_dir,
+                                            self.config.mmap)
+                              for file in changed]
+        except OSError as e:
+            print_err("WARNING: Can't parse rtl file, \"{}\" -> \"{}\"!".
+                      format(e.filename, e.strerror))
+            return False
+
+        #
+        # merge_functions() modifies the results, so they are kept pickled
+        #
+        updated = dict()
+        for file, (result, status) in zip(changed, loaded):
+            self.results[file] = pickle.dumps(result,
+                                              pickle.HIGHEST_PROTOCOL)
+            updated[file] = result
+        for file in removed:
+            print_err("WARNING: Can't open rtl file, \"{}\"!".format(file))
+            del self.results[file]
+            updated[file] = None
+        self.stamps = stamps
+
+        with self.profiler.timer("build_callee_info"):
+            if self.functions is None:
+                functions = dict()
+                functions_pre = dict()
+                for file in self.files:
+                    if file in updated:
+                        self.index_file(file, updated[file])
+                        merge_functions(functions, functions_pre,
+                                        updated[file],
+                                        no_warnings=self.config.no_warnings)
+                self.functions = FunctionDB(functions)
+                build_callee_info(self.functions)
+            else:
+                self.update_functions(updated)
+
+        if self.config.debug:
+            print_dbg("[SERVE] Parsed {} changed RTL file(s), {} functions".
+                      format(len(changed), len(self.functions)))
+        return True
+
+    #
+    # index_file(), keep track of the functions a file defines, and of its
+    # calls that depend on a function being defined in an earlier file.
+    #
+    def index_file(self, file, result):
+        position = self.position[file]
+        for name in self.defines.pop(file, []):
+            self.definitions[name].remove(position)
+            if not self.definitions[name]:
+                del self.definitions[name]
+        self.unresolved.pop(file, None)
+        if result is None:
+            return
+
+        self.defines[file] = list(result[1])
+        for name in result[1]:
+            bisect.insort(self.definitions.setdefault(name, []), position)
+        unresolved = dict()
+        for function_name, target, name, plain_name in result[3]:
+            unresolved.setdefault(target, set()).add(function_name)
+        self.unresolved[file] = unresolved
+
+    #
+    # update_functions(), update the function database for the new parse
+    # results of some files, or None for the ones removed.
+    #
+    def update_functions(self, updated):
+        affected = set()
+        redefined = set()
+        for file, result in updated.items():
+            old_names = set(self.defines.get(file, []))
+            self.index_file(file, result)
+            new_names = set(self.defines.get(file, []))
+            affected |= old_names | new_names
+            redefined |= old_names ^ new_names
+
+        #
+        # How calls are named depends on the target being defined in an
+        # earlier file, so the callers of functions added or removed also
+        # need to be merged again.
+        #
+        for targets in self.unresolved.values():
+            for target in redefined.intersection(targets):
+                affected |= targets[target]
+
+        merged = dict()
+        for position in sorted(set(
+                position for name in affected
+                for position in self.definitions.get(name, []))):
+            file = self.files[position]
+            if file in updated:
+                result = updated[file]
+            else:
+                result = pickle.loads(self.results[file])
+            merge_functions(
+                merged, dict(),
+                (file,
+                 dict((name, finfo) for name, finfo in result[1].items()
+                      if name in affected),
+                 dict(),
+                 [entry for entry in result[3] if entry[0] in affected],
+                 dict()),
+                no_warnings=True,
+                defined=lambda target: self.definitions.get(
+                    target, [position])[0] < position)
+
+        for name in affected:
+            if name in self.functions and name not in merged:
+                self.functions.remove_function(name)
+        for name, finfo in merged.items():
+            if name in self.functions:
+                self.functions.replace_function(name, finfo)
+            else:
+                self.functions.add_function(name, finfo)
+
+    #
+    # query(), returns the .dot output for a query line, or the errors
+    #
+    def query(self, line):
+        errors = io.StringIO()
+        output = DotWriter(capture=True)
+        with contextlib.redirect_stderr(errors):
+            try:
+                config = self.parser.parse_args(shlex.split(line))
+                if check_query_options(config):
+                    if write_call_graph(self.functions, config,
+                                        query_exclude(config), output,
+                                        self.profiler) != 0:
+                        output.lines = list()
+            except SystemExit:
+                pass
+            except Exception as e:
+                print_err("ERROR: Query failed, \"{}\"!".format(e))
+
+        if errors.getvalue():
+            return errors.getvalue()
+        return "\n".join(output.lines) + "\n"
+
+    #
+    # handle(), answer the query of a single connection
+    #
+    def handle(self, connection):
+        connection.settimeout(self.config.poll_interval * 10)
+        try:
+            line = connection.makefile("rb").readline()
+            if not line:
+                return
+            line = line.decode("utf-8", "replace").strip()
+            start_time = time.perf_counter()
+            self.refresh()
+            response = self.query(line)
+            connection.sendall(response.encode("utf-8"))
+        except OSError:
+            return
+
+        if self.config.debug:
+            print_dbg("[SERVE] \"{}\" took {:.3f} ms".format(
+                line, (time.perf_counter() - start_time) * 1000))
+
+    #
+    # serve(), the main loop, until interrupted or terminated
+    #
+    def serve(self, path):
+        self.refresh()
+
+        if os.path.exists(path):
+            if not stat.S_ISSOCK(os.stat(path).st_mode):
+                print_err("ERROR: Can't create socket, \"{}\" exists!".
+                          format(path))
+                return 1
+            os.unlink(path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server.bind(path)
+            server.listen(16)
+        except OSError as e:
+            print_err("ERROR: Can't create socket, \"{}\" -> \"{}\"!".
+                      format(path, e.strerror))
+            server.close()
+            return 1
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        server.settimeout(self.config.poll_interval)
+        try:
+            while True:
+                try:
+                    connection, address = server.accept()
+                except socket.timeout:
+                    self.refresh()
+                    continue
+                with connection:
+                    self.handle(connection)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            os.unlink(path)
+
+        return 0
+
+
 #
 # Start main() as default entry point...
 #
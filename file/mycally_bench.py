@@ -0,0 +1,524 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/python
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#  Files name:
+#    mycally_bench.py
+#
+#  Description:
+#    Benchmark the mycally.py pipeline, stage by stage, on synthetic or
+#    given RTL .expand files
+#
+#  Notes:
+#    Results are written as JSON, and can be compared against an earlier
+#    run with --compare.
+#
+
+#
+# Imports
+#
+import argparse
+import collections
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import mycally
+
+#
+# Version of the JSON result layout
+#
+RESULT_VERSION = 1
+
+#
+# The stages timed, in pipeline order. The "tokenize" stage is the part of
+# the scan not spent in pre_scan(), fixup_functions_pre() or main_scan(),
+# i.e. mainly classify_line().
+#
+STAGES = ("read", "tokenize", "pre_scan", "fixup", "main_scan", "scan",
+          "build_callee_info", "full_call_graph", "dump_path_caller",
+          "dump_path_callee")
+
+#
+# External functions called by the synthetic code
+#
+EXTERN_FUNCTIONS = ("printf", "sem_wait", "sem_post", "pthread_mutex_lock",
+                    "pthread_mutex_unlock", "pthread_cond_wait",
+                    "pthread_cond_broadcast", "malloc", "free", "memcpy")
+
+#
+# RTL templates, in the format of GCC's .expand dump
+#
+RTL_HEADER = \
+    ";; Function {name} ({name}, funcdef_no={no}, decl_uid={no}, " \
+    "cgraph_uid={no}, symbol_order={no})\n" \
+    "\n" \
+    ";; Generated by mycally_bench.py\n" \
+    "\n"
+
+RTL_FILLER = \
+    "(insn {uid} {prev} {next} 2 (set (reg:SI {reg})\n" \
+    "        (plus:SI (reg:SI {reg})\n" \
+    "            (const_int 1 [0x1]))) \"bench.c\":{uid}:5 -1\n" \
+    "     (nil))\n"
+
+RTL_ARGUMENT = \
+    "(insn {uid} {prev} {next} 2 (set (reg:DI {reg})\n" \
+    "        (symbol_ref:DI (\"{symbol}\") [flags 0x2]  " \
+    "<var_decl 0x7f0000000000 {symbol}>)) \"bench.c\":{uid}:5 -1\n" \
+    "     (nil))\n"
+
+RTL_CALL = \
+    "(call_insn {uid} {prev} {next} 2 (set (reg:SI 0 ax)\n" \
+    "        (call (mem:QI (symbol_ref:DI (\"{target}\") [flags 0x41]  " \
+    "<function_decl 0x7f0000000000 {target}>) [0 {target} S1 A8])\n" \
+    "            (const_int 0 [0]))) \"bench.c\":{uid}:5 -1\n" \
+    "     (nil)\n" \
+    "    (expr_list:DI (use (reg:DI 5 di))\n" \
+    "        (nil)))\n"
+
+RTL_COND_JUMP = \
+    "(jump_insn {uid} {prev} {next} 2 (set (pc)\n" \
+    "        (if_then_else (ne (reg:CCZ 17 flags)\n" \
+    "                (const_int 0 [0]))\n" \
+    "            (label_ref {label})\n" \
+    "            (pc))) \"bench.c\":{uid}:5 -1\n" \
+    "     (nil)\n" \
+    " -> {label})\n"
+
+RTL_JUMP = \
+    "(jump_insn {uid} {prev} {next} 2 (set (pc)\n" \
+    "        (label_ref {label})) \"bench.c\":{uid}:5 -1\n" \
+    "     (nil)\n" \
+    " -> {label})\n"
+
+RTL_CODE_LABEL = \
+    "(code_label {label} {prev} {next} 3 {label} (nil) [1 uses])\n"
+
+
+#
+# RtlGenerator()
+#
+# Writes the body of one synthetic function. Statements are calls, to
+# other synthetic functions or to EXTERN_FUNCTIONS, and if, if/else, while
+# and switch constructs holding statements themselves, up to the nesting
+# depth given.
+#
+class RtlGenerator(object):
+    def __init__(self, out, rand, config):
+        self.out = out
+        self.rand = rand
+        self.config = config
+        self.uid = 1
+
+    def next_uid(self):
+        self.uid += 1
+        return self.uid
+
+    def emit(self, template, **kwargs):
+        uid = self.next_uid()
+        self.out.write(template.format(uid=uid, prev=uid - 1, next=uid + 1,
+                                       **kwargs))
+        return uid
+
+    def filler(self):
+        for i in range(self.config.filler):
+            self.emit(RTL_FILLER, reg=self.rand.randint(80, 120))
+
+    def call(self, target, argument="buf_mutex"):
+        self.filler()
+        self.emit(RTL_ARGUMENT, reg="5 di", symbol=argument)
+        self.emit(RTL_CALL, target=target)
+
+    def code_label(self, label):
+        self.out.write(RTL_CODE_LABEL.format(label=label, prev=label - 1,
+                                             next=label + 1))
+
+    def label(self):
+        return self.next_uid()
+
+    def body(self, targets, calls, constructs, depth):
+        rand = self.rand
+        statements = ["call"] * calls + ["construct"] * constructs
+        rand.shuffle(statements)
+        for statement in statements:
+            if statement == "call" or depth >= self.config.nesting:
+                self.call(rand.choice(targets))
+                continue
+
+            kind = rand.choice(("if", "if_else", "while", "switch"))
+            inner_calls = rand.randint(1, 2)
+            inner_constructs = 1 if depth + 1 < self.config.nesting and \
+                rand.random() < 0.5 else 0
+
+            if kind == "if":
+                end = self.label()
+                self.emit(RTL_COND_JUMP, label=end)
+                self.body(targets, inner_calls, inner_constructs, depth + 1)
+                self.code_label(end)
+            elif kind == "if_else":
+                other = self.label()
+                end = self.label()
+                self.emit(RTL_COND_JUMP, label=other)
+                self.body(targets, inner_calls, inner_constructs, depth + 1)
+                self.emit(RTL_JUMP, label=end)
+                self.code_label(other)
+                self.body(targets, inner_calls, 0, depth + 1)
+                self.code_label(end)
+            elif kind == "while":
+                start = self.label()
+                condition = self.label()
+                self.emit(RTL_JUMP, label=condition)
+                self.code_label(start)
+                self.body(targets, inner_calls, inner_constructs, depth + 1)
+                self.code_label(condition)
+                self.emit(RTL_COND_JUMP, label=start)
+            else:
+                cases = [self.label()
+                         for i in range(self.config.switch_cases)]
+                default = self.label()
+                end = self.label()
+                for case in cases:
+                    self.emit(RTL_COND_JUMP, label=case)
+                self.emit(RTL_JUMP, label=default)
+                for case in cases:
+                    self.code_label(case)
+                    self.body(targets, 1, 0, depth + 1)
+                    self.emit(RTL_JUMP, label=end)
+                self.code_label(default)
+                self.code_label(end)
+
+    def threads(self, workers):
+        for i, worker in enumerate(workers):
+            self.filler()
+            self.emit(RTL_ARGUMENT, reg="1 dx", symbol=worker)
+            self.emit(RTL_ARGUMENT, reg="5 di", symbol="thread{}".format(i))
+            self.emit(RTL_CALL, target="pthread_create")
+        for i in range(len(workers)):
+            self.call("pthread_join", "thread{}".format(i))
+
+
+#
+# generate_rtl_files()
+#
+# Writes the synthetic RTL files to the given directory, and returns their
+# names. Function fN only calls functions with a higher N, and "main" is
+# the root calling f0, and starting the --threads worker threads. The
+# functions are spread round robin over the files.
+#
+def generate_rtl_files(directory, config):
+    rand = random.Random(config.seed)
+    names = ["f{}".format(i) for i in range(config.functions)]
+    files = [os.path.join(directory, "bench{}.c.233r.expand".format(i))
+             for i in range(config.files)]
+    outputs = [open(file, "w") for file in files]
+    try:
+        outputs[0].write(RTL_HEADER.format(name="main", no=0))
+        generator = RtlGenerator(outputs[0], rand, config)
+        generator.call(names[0] if names else "printf")
+        generator.threads(names[-config.threads:] if config.threads else [])
+        outputs[0].write("\n")
+
+        for i, name in enumerate(names):
+            out = outputs[i % len(outputs)]
+            out.write(RTL_HEADER.format(name=name, no=i + 1))
+            callees = names[i + 1:i + 1 + config.fan_out]
+            targets = list(callees) + list(EXTERN_FUNCTIONS[
+                :max(1, int(len(callees) * config.extern_ratio))])
+            RtlGenerator(out, rand, config).body(
+                targets, config.calls, config.constructs, 0)
+            out.write("\n")
+    finally:
+        for out in outputs:
+            out.close()
+
+    return files
+
+
+#
+# TimedRtlScanner()
+#
+# RtlScanner accumulating the time spent in each of its passes.
+#
+class TimedRtlScanner(mycally.RtlScanner):
+    def __init__(self, functions, **kwargs):
+        super(TimedRtlScanner, self).__init__(functions, **kwargs)
+        self.timings = collections.Counter()
+
+    def flush(self):
+        tokens = self.tokens
+        self.tokens = list()
+        if self.function_name != "":
+            labels = self.functions_pre[self.function_name]
+            start_time = time.perf_counter()
+            self.pre_scan(tokens, labels)
+            self.timings["pre_scan"] += time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            mycally.fixup_functions_pre(labels)
+            self.timings["fixup"] += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        self.main_scan(tokens)
+        self.timings["main_scan"] += time.perf_counter() - start_time
+
+
+#
+# run_pipeline()
+#
+# Runs the complete pipeline once, and returns the timing of each stage,
+# and some statistics on the data processed.
+#
+def run_pipeline(files, config):
+    timings = dict()
+
+    start_time = time.perf_counter()
+    lines = 0
+    for file in files:
+        for line in mycally.rtl_file_lines(file, config.mmap):
+            lines += 1
+    timings["read"] = time.perf_counter() - start_time
+
+    functions = dict()
+    passes = collections.Counter()
+    start_time = time.perf_counter()
+    for file in files:
+        scanner = TimedRtlScanner(functions, no_warnings=True)
+        scanner.scan(mycally.rtl_file_lines(file, config.mmap), file)
+        scanner.finish()
+        passes.update(scanner.timings)
+    timings["scan"] = time.perf_counter() - start_time
+    for stage in ("pre_scan", "fixup", "main_scan"):
+        timings[stage] = passes[stage]
+    timings["tokenize"] = timings["scan"] - sum(passes.values())
+
+    start_time = time.perf_counter()
+    functions = mycally.FunctionDB(functions)
+    mycally.build_callee_info(functions)
+    timings["build_callee_info"] = time.perf_counter() - start_time
+
+    caller = config.caller
+    callee = config.callee
+    if callee is None:
+        callee = max(functions.keys(),
+                     key=lambda name: len(functions[name]["callee_calls"]))
+    for name in (caller, callee):
+        if name not in functions:
+            raise KeyError(name)
+
+    with mycally.DotWriter(os.devnull) as output:
+        start_time = time.perf_counter()
+        mycally.full_call_graph(functions, output=output)
+        timings["full_call_graph"] = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        mycally.dump_path([], functions, caller,
+                          max_depth=config.max_depth, output=output)
+        timings["dump_path_caller"] = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        mycally.dump_path([], functions, callee,
+                          max_depth=config.max_depth, reverse_path=True,
+                          call_index="callee_calls", output=output)
+        timings["dump_path_callee"] = time.perf_counter() - start_time
+
+    info = dict(caller=caller, callee=callee, files=len(files),
+                bytes=sum(os.path.getsize(file) for file in files),
+                lines=lines,
+                functions=len(functions),
+                calls=sum(len(functions.edges("calls", i))
+                          for i in range(len(functions))))
+    return timings, info
+
+
+#
+# compare_results()
+#
+# Prints the median of each stage against the one in the baseline result,
+# and returns the stages that got slower by more than max_regression
+# percent.
+#
+def compare_results(baseline, result, max_regression):
+    regressions = list()
+    print("{:<20} {:>12} {:>12} {:>8}".format("stage", "baseline",
+                                              "current", "change"),
+          file=sys.stderr)
+    for stage in STAGES:
+        if stage not in baseline["stages"] or stage not in result["stages"]:
+            continue
+        old = baseline["stages"][stage]["median"]
+        new = result["stages"][stage]["median"]
+        change = (new - old) / old * 100 if old > 0 else 0.0
+        print("{:<20} {:>12.6f} {:>12.6f} {:>+7.1f}%".format(stage, old,
+                                                              new, change),
+              file=sys.stderr)
+        if max_regression is not None and change > max_regression:
+            regressions.append(stage)
+
+    return regressions
+
+
+#
+# main()
+#
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the mycally.py pipeline stages")
+
+    parser.add_argument("RTLFILE", nargs="*",
+                        help="Benchmark these RTL files, instead of "
+                        "generated ones")
+    parser.add_argument("--functions", metavar="N", type=int, default=2000,
+                        help="Number of generated functions, default 2000")
+    parser.add_argument("--calls", metavar="N", type=int, default=8,
+                        help="Calls per generated function, default 8")
+    parser.add_argument("--fan-out", metavar="N", type=int, default=4,
+                        help="Number of other functions each generated "
+                        "function can call, default 4")
+    parser.add_argument("--extern-ratio", metavar="RATIO", type=float,
+                        default=0.5,
+                        help="Number of external call targets relative to "
+                        "the fan out, default 0.5")
+    parser.add_argument("--constructs", metavar="N", type=int, default=3,
+                        help="if/while/switch constructs per generated "
+                        "function, default 3")
+    parser.add_argument("--nesting", metavar="DEPTH", type=int, default=2,
+                        help="Maximum construct nesting depth, default 2")
+    parser.add_argument("--switch-cases", metavar="N", type=int, default=3,
+                        help="Case labels per switch, default 3")
+    parser.add_argument("--threads", metavar="N", type=int, default=8,
+                        help="pthread_create/pthread_join pairs in main, "
+                        "default 8")
+    parser.add_argument("--filler", metavar="N", type=int, default=2,
+                        help="Uninteresting insns before each call, "
+                        "default 2")
+    parser.add_argument("--files", metavar="N", type=int, default=4,
+                        help="Number of generated files, default 4")
+    parser.add_argument("--seed", metavar="SEED", type=int, default=0,
+                        help="Random seed for the generator, default 0")
+    parser.add_argument("--keep-dir", metavar="DIR", type=str,
+                        help="Generate the RTL files in DIR, and keep them")
+    parser.add_argument("--caller", metavar="FUNCTION", type=str,
+                        default="main",
+                        help="Function for the caller stage, default main")
+    parser.add_argument("--callee", metavar="FUNCTION", type=str,
+                        help="Function for the callee stage, default the "
+                        "one with the most callers")
+    parser.add_argument("--max-depth", metavar="DEPTH", type=int, default=0,
+                        help="Maximum depth for the caller/callee stages, "
+                        "default no depth")
+    parser.add_argument("--mmap", action="store_true",
+                        help="Read the RTL files using mmap")
+    parser.add_argument("--repeat", metavar="N", type=int, default=3,
+                        help="Number of runs, default 3")
+    parser.add_argument("--label", metavar="LABEL", type=str, default="",
+                        help="Label stored in the result, e.g. a version")
+    parser.add_argument("-o", "--output", metavar="FILE", type=str,
+                        help="Write the JSON result to FILE, default stdout")
+    parser.add_argument("--compare", metavar="FILE", type=str,
+                        help="Compare against the JSON result in FILE")
+    parser.add_argument("--max-regression", metavar="PERCENT", type=float,
+                        help="With --compare, fail if a stage got slower "
+                        "by more than PERCENT")
+
+    config = parser.parse_args()
+
+    if config.repeat < 1 or config.files < 1:
+        print("ERROR: The --repeat and --files values must be at least 1!",
+              file=sys.stderr)
+        return 1
+
+    baseline = None
+    if config.compare is not None:
+        try:
+            with open(config.compare) as compare:
+                baseline = json.load(compare)
+        except (IOError, ValueError) as e:
+            print("ERROR: Can't read baseline, \"{}\" -> \"{}\"!".
+                  format(config.compare, e), file=sys.stderr)
+            return 1
+
+    with tempfile.TemporaryDirectory(prefix="mycally_bench") as directory:
+        if config.RTLFILE:
+            files = config.RTLFILE
+            generator = None
+        else:
+            if config.keep_dir is not None:
+                os.makedirs(config.keep_dir, exist_ok=True)
+                directory = config.keep_dir
+            files = generate_rtl_files(directory, config)
+            generator = dict(functions=config.functions, calls=config.calls,
+                             fan_out=config.fan_out,
+                             extern_ratio=config.extern_ratio,
+                             constructs=config.constructs,
+                             nesting=config.nesting,
+                             switch_cases=config.switch_cases,
+                             threads=config.threads, filler=config.filler,
+                             files=config.files, seed=config.seed)
+
+        runs = collections.defaultdict(list)
+        for i in range(config.repeat):
+            try:
+                timings, info = run_pipeline(files, config)
+            except KeyError as e:
+                print("ERROR: Can't find function \"{}\" in RTL data!".
+                      format(e.args[0]), file=sys.stderr)
+                return 1
+            for stage, seconds in timings.items():
+                runs[stage].append(seconds)
+
+    result = dict(
+        version=RESULT_VERSION,
+        label=config.label,
+        timestamp=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        generator=generator,
+        options=dict(max_depth=config.max_depth, mmap=config.mmap,
+                     repeat=config.repeat),
+        input=info,
+        stages=collections.OrderedDict(
+            (stage, dict(min=min(runs[stage]),
+                         median=statistics.median(runs[stage]),
+                         runs=runs[stage]))
+            for stage in STAGES))
+
+    text = json.dumps(result, indent=2) + "\n"
+    if config.output is not None:
+        with open(config.output, "w") as output:
+            output.write(text)
+    else:
+        sys.stdout.write(text)
+
+    if baseline is not None:
+        regressions = compare_results(baseline, result,
+                                      config.max_regression)
+        if regressions:
+            print("ERROR: Regression in stage(s) {}!".
+                  format(", ".join(regressions)), file=sys.stderr)
+            return 1
+
+    return 0
+
+
+#
+# Start main() as default entry point...
+#
+if __name__ == '__main__':
+    exit(main())